@@ -2,10 +2,12 @@
 
 import streamlit as st
 from database import db_manager
-from utils import metrics, visualizer, excel_reader, categorizer, sync
+from utils import metrics, visualizer, excel_reader, categorizer, sync, cache_importacion, importador
 import datetime
+import time
 import pandas as pd
 import json
+import sqlite3
 import auth  # Sistema de autenticación
 
 # --- Configuración de la página ---
@@ -24,6 +26,8 @@ if not auth.check_authentication():
 def inicializar_app():
     """Inicializa la base de datos creando las tablas si es necesario."""
     db_manager.crear_tablas()
+    # Retomar las importaciones que quedaron a medias en la ejecución anterior
+    importador.reanudar_pendientes()
 
 inicializar_app()
 
@@ -47,6 +51,14 @@ NOMBRES_MESES = {
 }
 MESES_INVERTIDO = {v: k for k, v in NOMBRES_MESES.items()}
 
+# Segundos entre refrescos de la página de importación mientras hay trabajos en curso
+INTERVALO_REFRESCO_IMPORTACION = 1
+
+# Editor de transacciones: filas por página y páginas que se cargan por adelantado en cada consulta
+TAMAÑO_PAGINA_EDITOR = 50
+PAGINAS_PRECARGADAS = 2
+COLUMNAS_EDITOR = ['id', 'fecha', 'concepto', 'importe', 'categoria', 'tipo', 'notas', 'saldo_posterior']
+
 # --- Contenido principal de la página ---
 
 def mostrar_dashboard():
@@ -139,6 +151,7 @@ def mostrar_dashboard():
                     if datos_mes['gastos_por_categoria']:
                         df = pd.DataFrame(list(datos_mes['gastos_por_categoria'].items()),
                                         columns=['Categoría', 'Importe'])
+                        df['Categoría'] = df['Categoría'].fillna(visualizer.ETIQUETA_SIN_CATEGORIA)
                         df['Importe'] = df['Importe'].abs()
                         total = df['Importe'].sum()
                         df['%'] = (df['Importe'] / total * 100).round(1)
@@ -157,18 +170,20 @@ def mostrar_dashboard():
 
                 # Gráfico de evolución del saldo disponible
                 st.markdown("### 📈 Evolución del Saldo Disponible")
-                transacciones = db_manager.obtener_transacciones(mes=mes, año=año)
-
-                if transacciones:
-                    df_trans = pd.DataFrame(transacciones)
+                # Cierre de cada día del mes con movimientos, leído de saldos_diarios
+                primer_dia = datetime.date(año, mes, 1)
+                siguiente_mes = datetime.date(año + mes // 12, mes % 12 + 1, 1)
+                try:
+                    dias = db_manager.saldos_entre(primer_dia, siguiente_mes - datetime.timedelta(days=1))
+                    # Saldo inicial del mes: saldo disponible al cierre del día anterior
+                    saldo_inicial = db_manager.saldo_en(primer_dia - datetime.timedelta(days=1))
+                except sqlite3.Error as e:
+                    st.error(f"❌ No se pudo leer la evolución del saldo: {e}")
+                    dias = None
+
+                if dias:
+                    df_trans = pd.DataFrame(dias).rename(columns={'saldo': 'saldo_disponible'})
                     df_trans['fecha'] = pd.to_datetime(df_trans['fecha'])
-                    df_trans = df_trans.sort_values('fecha')
-
-                    # Calcular el saldo inicial del mes:
-                    # Líquido disponible total MENOS las transacciones del mes actual
-                    liquido_total = metrics.calcular_liquido_disponible()
-                    importe_mes_actual = df_trans['importe'].sum()
-                    saldo_inicial = liquido_total - importe_mes_actual
 
                     # Añadir punto inicial del mes (saldo al cierre del mes anterior)
                     fecha_inicial = df_trans['fecha'].min() - pd.Timedelta(days=1)
@@ -178,8 +193,7 @@ def mostrar_dashboard():
                         'saldo_disponible': saldo_inicial
                     }])
 
-                    # Combinar con las transacciones del mes
-                    df_trans['saldo_disponible'] = saldo_inicial + df_trans['importe'].cumsum()
+                    # Combinar con los cierres diarios del mes
                     df_completo = pd.concat([df_inicial, df_trans[['fecha', 'saldo_disponible']]], ignore_index=True)
 
                     # Crear gráfico de línea
@@ -236,7 +250,7 @@ def mostrar_dashboard():
 
                     # Estadísticas del mes
                     col1, col2, col3, col4 = st.columns(4)
-                    num_transacciones = len(df_trans)
+                    num_transacciones = int(df_trans['n'].sum())
                     col1.metric(
                         "📊 Transacciones",
                         num_transacciones,
@@ -258,7 +272,7 @@ def mostrar_dashboard():
                         f"{df_trans['saldo_disponible'].max() - df_trans['saldo_disponible'].min():.2f} €",
                         help="Diferencia entre el saldo máximo y mínimo alcanzado durante el mes"
                     )
-                else:
+                elif dias is not None:
                     st.info("No hay transacciones registradas en este mes")
 
         with subtab_año:
@@ -367,13 +381,16 @@ def mostrar_dashboard():
                         help="Cuánto gastas en promedio cada día. Te ayuda a controlar tus gastos diarios y proyectar el total del mes"
                     )
 
-                    proyeccion = metrics.calcular_proyeccion_balance(3)
-                    col3.metric(
-                        "Balance en 3 Meses",
-                        f"{proyeccion['balance_proyectado']:.0f} €",
-                        delta=f"Confianza: {proyeccion['confianza']}",
-                        help="Proyección de tu balance en 3 meses basado en tu comportamiento histórico. Útil para planificar gastos futuros"
-                    )
+                    try:
+                        proyeccion = metrics.calcular_proyeccion_balance(3)
+                        col3.metric(
+                            "Balance en 3 Meses",
+                            f"{proyeccion['balance_proyectado']:.0f} €",
+                            delta=f"Confianza: {proyeccion['confianza']}",
+                            help="Proyección de tu balance en 3 meses basado en tu comportamiento histórico. Útil para planificar gastos futuros"
+                        )
+                    except sqlite3.Error as e:
+                        col3.error(f"❌ No se pudo calcular la proyección: {e}")
 
                 with st.expander("📊 Efficiency Ratios"):
                     ratios = metrics.calcular_efficiency_ratios(mes, año)
@@ -419,7 +436,7 @@ def mostrar_dashboard():
                         for cat, datos in variacion['por_categoria'].items():
                             if datos['variacion'] != 0:
                                 icono = "📈" if datos['variacion'] > 0 else "📉"
-                                st.caption(f"{icono} **{cat}**: {datos['variacion']:+.1f}%")
+                                st.caption(f"{icono} **{cat or visualizer.ETIQUETA_SIN_CATEGORIA}**: {datos['variacion']:+.1f}%")
                     else:
                         st.info("Sin datos del mes anterior")
 
@@ -591,103 +608,149 @@ def mostrar_transacciones():
         # Obtener categorías de la base de datos para el filtro
         # Se podría mejorar el rendimiento cacheando esta llamada
         # (Esta es una simplificación, se podría cachear)
-        categorias_db = list(db_manager.obtener_totales_por_categoria(mes, año).keys())
+        # Sin la clave None de los gastos sin categoría: no es un valor por el que se pueda filtrar
+        categorias_db = [c for c in db_manager.obtener_totales_por_categoria(mes, año) if c is not None]
         categorias_seleccionadas = st.multiselect("Categorías", ["Todas"] + categorias_db, default="Todas")
 
-    # --- Cargar y mostrar datos ---
-    with st.spinner("Cargando transacciones..."):
-        transacciones = db_manager.obtener_transacciones(mes=mes, año=año)
-        df_original = pd.DataFrame(transacciones)
-
-        if not df_original.empty:
-            df_filtrado = df_original.copy()
-            if "Todas" not in categorias_seleccionadas and categorias_seleccionadas:
-                df_filtrado = df_filtrado[df_filtrado['categoria'].isin(categorias_seleccionadas)]
-            
-            # Convertir la columna de fecha a objetos de fecha para el editor
-            df_filtrado['fecha'] = pd.to_datetime(df_filtrado['fecha'])
+    todo_el_historial = st.checkbox("Ver todo el historial", help="Muestra todas las transacciones, de la más reciente a la más antigua, sin filtrar por mes")
+    if todo_el_historial:
+        mes, año = None, None
+    categorias = None if "Todas" in categorias_seleccionadas or not categorias_seleccionadas else categorias_seleccionadas
 
-            st.info("Puedes editar las celdas directamente. Haz clic en 'Guardar Cambios' para persistir las modificaciones.")
-            
-            # Configuración del editor de datos
-            configuracion_columnas = {
-                "id": st.column_config.NumberColumn("ID", disabled=True),
-                "fecha": st.column_config.DateColumn("Fecha", format="YYYY-MM-DD"),
-                "concepto": st.column_config.TextColumn("Concepto", width="large"), # 'width' aquí se refiere al tamaño de la columna, no al aviso.
-                "importe": st.column_config.NumberColumn("Importe", format="%.2f €"),
-                "categoria": st.column_config.SelectboxColumn("Categoría", options=["FIJOS", "DISFRUTE", "EXTRAORDINARIOS", "INGRESO", "SIN_CLASIFICAR"], width="medium")
-            }
-            
-            df_editado = st.data_editor(
-                df_filtrado,
-                column_config=configuracion_columnas,
-                num_rows="fixed",
-                hide_index=True,
-                use_container_width=True
-            )
+    # --- Cargar y mostrar datos (solo la página visible y las precargadas) ---
+    with st.spinner("Cargando transacciones..."):
+        transacciones, hay_anterior, hay_siguiente = _pagina_transacciones((mes, año, tuple(categorias or ())))
+
+    if not transacciones:
+        st.info("No se encontraron transacciones para el período seleccionado.")
+        return
+
+    paginacion = st.session_state.paginacion_transacciones
+    df_original = pd.DataFrame(transacciones)[COLUMNAS_EDITOR]
+    # Convertir la columna de fecha a objetos de fecha para el editor
+    df_original['fecha'] = pd.to_datetime(df_original['fecha'])
+
+    st.info("Puedes editar las celdas directamente. Haz clic en 'Guardar Cambios' para persistir las modificaciones.")
+    
+    # Configuración del editor de datos
+    configuracion_columnas = {
+        "id": st.column_config.TextColumn("ID", disabled=True),
+        "fecha": st.column_config.DateColumn("Fecha", format="YYYY-MM-DD"),
+        "concepto": st.column_config.TextColumn("Concepto", width="large"), # 'width' aquí se refiere al tamaño de la columna, no al aviso.
+        "importe": st.column_config.NumberColumn("Importe", format="%.2f €"),
+        "categoria": st.column_config.SelectboxColumn("Categoría", options=["FIJOS", "DISFRUTE", "EXTRAORDINARIOS", "INGRESO", "SIN_CLASIFICAR"], width="medium")
+    }
+    
+    df_editado = st.data_editor(
+        df_original,
+        column_config=configuracion_columnas,
+        num_rows="fixed",
+        hide_index=True,
+        use_container_width=True,
+        key=f"editor_transacciones_{paginacion['clave']}_{paginacion['pagina']}"
+    )
 
-            if st.button("💾 Guardar Cambios"):
-                # Asegurarse de que los dataframes originales y editados tengan los mismos tipos y orden de columnas para una comparación justa
-                df_original_comp = df_original.set_index('id').sort_index()
-                df_editado_comp = df_editado.set_index('id').sort_index()
-                
-                # Convertir la fecha del df_original a datetime para comparar con el editor
-                df_original_comp['fecha'] = pd.to_datetime(df_original_comp['fecha'])
-                
-                # Encontrar las filas que han cambiado
-                try:
-                    # `compare` devuelve un DataFrame con las diferencias
-                    diferencias = df_original_comp.compare(df_editado_comp)
-                except ValueError: # Ocurre si no hay cambios
-                    diferencias = pd.DataFrame()
-                
-                if not diferencias.empty:
-                    with st.spinner("Guardando cambios en la base de datos..."):
-                        updates_exitosos = 0
-                        # Iterar sobre los índices de las filas modificadas
-                        for id_transaccion in diferencias.index.unique():
-                            # Obtener la fila completa de datos editados
-                            fila_editada = df_editado_comp.loc[id_transaccion]
-                            campos_a_actualizar = fila_editada.to_dict()
-                            # **LA SOLUCIÓN CLAVE**: Convertir Timestamp a objeto date
-                            if 'fecha' in campos_a_actualizar and isinstance(campos_a_actualizar['fecha'], pd.Timestamp):
-                                campos_a_actualizar['fecha'] = campos_a_actualizar['fecha'].date()
-                                
-                            if campos_a_actualizar:
-                                if db_manager.actualizar_transaccion(id_transaccion, campos_a_actualizar):
-                                    updates_exitosos += 1
-                    st.success(f"{updates_exitosos} transacciones actualizadas correctamente.")
-                    st.rerun()
-                else:
-                    st.info("No se detectaron cambios para guardar.")
+    col_anterior, col_pagina, col_siguiente = st.columns([1, 2, 1])
+    if col_anterior.button("⬅️ Anterior", disabled=not hay_anterior):
+        paginacion['pagina'] -= 1
+        st.rerun()
+    col_pagina.caption(f"Página {paginacion['pagina'] + 1} · {TAMAÑO_PAGINA_EDITOR} transacciones por página")
+    if col_siguiente.button("Siguiente ➡️", disabled=not hay_siguiente):
+        paginacion['pagina'] += 1
+        st.rerun()
+
+    if st.button("💾 Guardar Cambios"):
+        # La página original y la editada tienen las mismas filas y columnas, así que se pueden comparar directamente
+        df_original_comp = df_original.set_index('id')
+        df_editado_comp = df_editado.set_index('id')
+        
+        # Encontrar las filas que han cambiado
+        try:
+            # `compare` devuelve un DataFrame con las diferencias
+            diferencias = df_original_comp.compare(df_editado_comp)
+        except ValueError: # Ocurre si no hay cambios
+            diferencias = pd.DataFrame()
+        
+        if not diferencias.empty:
+            with st.spinner("Guardando cambios en la base de datos..."):
+                updates_exitosos = 0
+                # Iterar sobre los índices de las filas modificadas
+                for id_transaccion in diferencias.index.unique():
+                    # Obtener la fila completa de datos editados
+                    fila_editada = df_editado_comp.loc[id_transaccion]
+                    campos_a_actualizar = fila_editada.to_dict()
+                    # **LA SOLUCIÓN CLAVE**: Convertir Timestamp a objeto date
+                    if 'fecha' in campos_a_actualizar and isinstance(campos_a_actualizar['fecha'], pd.Timestamp):
+                        campos_a_actualizar['fecha'] = campos_a_actualizar['fecha'].date()
+                        campos_a_actualizar['mes'] = campos_a_actualizar['fecha'].month
+                        campos_a_actualizar['año'] = campos_a_actualizar['fecha'].year
+                        
+                    if campos_a_actualizar:
+                        if db_manager.actualizar_transaccion(id_transaccion, campos_a_actualizar):
+                            updates_exitosos += 1
+            # Los datos precargados ya no son válidos
+            del st.session_state.paginacion_transacciones
+            st.success(f"{updates_exitosos} transacciones actualizadas correctamente.")
+            st.rerun()
         else:
-            st.info("No se encontraron transacciones para el período seleccionado.")
+            st.info("No se detectaron cambios para guardar.")
+
+def _pagina_transacciones(clave_filtros):
+    """
+    Devuelve (transacciones, hay_anterior, hay_siguiente) de la página actual para los filtros dados.
+    Se piden a la base de datos ventanas de (1 + PAGINAS_PRECARGADAS) páginas con paginación por
+    clave, y se guardan en la sesión: pasar a una página ya precargada no hace ninguna consulta.
+    """
+    mes, año, categorias = clave_filtros
+    paginacion = st.session_state.get('paginacion_transacciones')
+    if paginacion is None or paginacion['clave'] != clave_filtros:
+        # 'cursores' guarda el cursor de inicio de cada ventana ya visitada
+        paginacion = {'clave': clave_filtros, 'pagina': 0, 'cursores': [None], 'ventana': None, 'filas': []}
+        st.session_state.paginacion_transacciones = paginacion
+
+    paginas_por_ventana = 1 + PAGINAS_PRECARGADAS
+    ventana, pagina_en_ventana = divmod(paginacion['pagina'], paginas_por_ventana)
+    if paginacion['ventana'] != ventana:
+        filas, siguiente = db_manager.obtener_pagina_transacciones(
+            mes=mes, año=año, categorias=list(categorias) or None,
+            cursor=paginacion['cursores'][ventana], limite=TAMAÑO_PAGINA_EDITOR * paginas_por_ventana
+        )
+        del paginacion['cursores'][ventana + 1:]
+        if siguiente:
+            paginacion['cursores'].append(siguiente)
+        paginacion['ventana'], paginacion['filas'] = ventana, filas
+
+    inicio = pagina_en_ventana * TAMAÑO_PAGINA_EDITOR
+    transacciones = paginacion['filas'][inicio:inicio + TAMAÑO_PAGINA_EDITOR]
+    hay_siguiente = len(paginacion['filas']) > inicio + TAMAÑO_PAGINA_EDITOR or len(paginacion['cursores']) > ventana + 1
+    return transacciones, paginacion['pagina'] > 0, hay_siguiente
 
 def mostrar_importar():
     st.title("📥 Importar desde Excel")
     st.markdown("Sube aquí tu archivo Excel con los movimientos bancarios para procesarlos e importarlos a la base de datos.")
 
-    uploaded_file = st.file_uploader(
-        "Elige un archivo Excel (.xlsx)", 
-        type=['xlsx']
+    hay_trabajos_activos = mostrar_trabajos_importacion()
+
+    uploaded_files = st.file_uploader(
+        "Elige uno o varios archivos Excel (.xlsx)", 
+        type=['xlsx'],
+        accept_multiple_files=True
     )
 
-    if uploaded_file is not None:
+    if uploaded_files:
+        nombres_archivos = [f.name for f in uploaded_files]
         # Almacenar el estado de la importación en la sesión
-        if 'import_data' not in st.session_state or st.session_state.get('uploaded_filename') != uploaded_file.name:
-            with st.spinner("Procesando archivo Excel..."):
-                transacciones, stats = excel_reader.leer_excel(uploaded_file)
+        if 'import_data' not in st.session_state or st.session_state.get('uploaded_filename') != nombres_archivos:
+            with st.spinner("Procesando archivos Excel..."):
+                # Las hojas de todos los archivos se procesan en paralelo
+                transacciones, stats = excel_reader.leer_excel_paralelo(uploaded_files)
                 st.session_state.import_data = transacciones
                 st.session_state.import_stats = stats
-                st.session_state.uploaded_filename = uploaded_file.name
+                st.session_state.uploaded_filename = nombres_archivos
                 # --- Detección de duplicados ---
-                st.session_state.nuevas_transacciones = []
-                st.session_state.transacciones_duplicadas = []
-                for t in transacciones:
-                    if db_manager.transaccion_existe(fecha=t['fecha'], importe=t['importe']):
-                        st.session_state.transacciones_duplicadas.append(t)
-                    else:
-                        st.session_state.nuevas_transacciones.append(t)
+                nuevas, duplicadas = db_manager.separar_duplicados(transacciones)
+                st.session_state.nuevas_transacciones = nuevas
+                st.session_state.transacciones_duplicadas = duplicadas
 
         stats = st.session_state.import_stats
         transacciones = st.session_state.import_data
@@ -704,26 +767,36 @@ def mostrar_importar():
             col2.metric("Transacciones Nuevas", len(nuevas))
             col3.metric("Potenciales Duplicados", len(duplicadas), delta_color="off")
 
+            if stats.get('files_from_cache'):
+                st.caption(f"⚡ {stats['files_from_cache']} archivo(s) recuperados de la caché sin volver a procesarlos.")
+            for archivo_con_error in stats.get('archivos_con_error', []):
+                st.warning(f"No se pudo leer el archivo {archivo_con_error}")
+            if stats.get('hojas'):
+                with st.expander(f"⏱️ Detalle por hoja ({stats.get('segundos', 0)} s en total)"):
+                    st.dataframe(pd.DataFrame(stats['hojas']), use_container_width=True)
+
             if transacciones:
                 st.subheader("Vista Previa de Transacciones a Importar")
                 st.dataframe(pd.DataFrame(nuevas).head(10))
 
-                accion_duplicados = "omitir"
+                # Sin duplicados a la vista se omiten igualmente: la importación se deduplica en segundo plano
+                omitir_duplicados = True
                 if duplicadas:
                     st.warning(f"Se han detectado {len(duplicadas)} transacciones que podrían estar ya registradas (misma fecha e importe).")
                     st.write("Transacciones duplicadas detectadas:")
                     st.dataframe(pd.DataFrame(duplicadas))
-                    accion_duplicados = st.radio(
+                    omitir_duplicados = st.radio(
                         "¿Qué quieres hacer con estas transacciones duplicadas?",
                         ('Omitir duplicados (Recomendado)', 'Importar todo (creará duplicados)'),
                         key='accion_duplicados'
-                    )
+                    ) == 'Omitir duplicados (Recomendado)'
 
                 if st.button("✅ Confirmar e Importar"):
                     transacciones_a_importar = []
-                    if accion_duplicados == 'Omitir duplicados (Recomendado)':
+                    if omitir_duplicados:
                         transacciones_a_importar = nuevas
-                        st.info(f"Se omitirán {len(duplicadas)} transacciones duplicadas.")
+                        if duplicadas:
+                            st.info(f"Se omitirán {len(duplicadas)} transacciones duplicadas.")
                     else: # Importar todo
                         transacciones_a_importar = transacciones
                         st.warning("Se importarán todas las transacciones, incluyendo posibles duplicados.")
@@ -731,35 +804,71 @@ def mostrar_importar():
                     if not transacciones_a_importar:
                         st.info("No hay nuevas transacciones para importar.")
                     else:
-                        with st.spinner("Importando transacciones..."):
-                            count = 0
-                            for t in transacciones_a_importar:
-                                categoria_final = categorizer.clasificar_transaccion(t['concepto'], t['importe'])
-                                db_manager.insertar_transaccion(
-                                    fecha=t['fecha'],
-                                    concepto=t['concepto'],
-                                    importe=t['importe'],
-                                    categoria=categoria_final,
-                                    tipo=t['tipo'],
-                                    mes=t['mes'],
-                                    año=t['año'],
-                                    notas=t.get('notas', ''),
-                                    saldo_posterior=t.get('saldo_posterior')
-                                )
-                                count += 1
-                        
-                        st.success(f"¡Éxito! Se importaron {count} nuevas transacciones.")
-                        st.balloons()
-                        # Limpiar el estado para permitir una nueva subida
-                        for key in ['import_data', 'import_stats', 'uploaded_filename', 'nuevas_transacciones', 'transacciones_duplicadas']:
-                            if key in st.session_state:
-                                del st.session_state[key]
-                        st.rerun()
+                        # Lectura, duplicados, clasificación e inserción se hacen en segundo plano
+                        id_trabajo = importador.lanzar_importacion(
+                            uploaded_files,
+                            omitir_duplicados=omitir_duplicados
+                        )
+                        if id_trabajo is None:
+                            st.error("No se pudo iniciar la importación.")
+                        else:
+                            # Limpiar el estado para permitir una nueva subida
+                            for key in ['import_data', 'import_stats', 'uploaded_filename', 'nuevas_transacciones', 'transacciones_duplicadas']:
+                                if key in st.session_state:
+                                    del st.session_state[key]
+                            st.rerun()
+
+    # Mientras haya importaciones en curso, refrescar la página para ver su progreso
+    if hay_trabajos_activos:
+        time.sleep(INTERVALO_REFRESCO_IMPORTACION)
+        st.rerun()
+
+def _formatear_segundos(segundos):
+    minutos, segundos = divmod(int(segundos), 60)
+    return f"{minutos} min {segundos} s" if minutos else f"{segundos} s"
+
+def mostrar_trabajos_importacion():
+    """Muestra el progreso de las últimas importaciones. Retorna True si alguna sigue en curso."""
+    trabajos = db_manager.obtener_trabajos_importacion(limite=5)
+    if not trabajos:
+        return False
+
+    st.subheader("Importaciones recientes")
+    hay_activos = False
+    for trabajo in trabajos:
+        nombres = ", ".join(trabajo['nombres'])
+        avance = importador.progreso(trabajo)
+        if trabajo['estado'] in importador.ESTADOS_ACTIVOS:
+            hay_activos = True
+            texto = {"pendiente": "En cola", "leyendo": "Leyendo y clasificando"}.get(
+                trabajo['estado'], f"Importando {trabajo['procesadas']}/{trabajo['total']}"
+            )
+            if avance['filas_por_segundo']:
+                texto += f" · {avance['filas_por_segundo']:.0f} filas/s · quedan {_formatear_segundos(avance['eta_segundos'])}"
+            st.progress(avance['fraccion'], text=f"⏳ {nombres}: {texto}")
+        elif trabajo['estado'] == 'completado':
+            st.success(
+                f"✅ {nombres}: {trabajo['insertadas']} transacciones importadas, "
+                f"{trabajo['ignoradas']} omitidas por duplicadas, {trabajo['errores']} con error."
+            )
+        else:
+            col1, col2 = st.columns([4, 1])
+            col1.error(f"❌ {nombres}: {trabajo['mensaje_error']} ({trabajo['procesadas']}/{trabajo['total']} procesadas)")
+            if col2.button("🔄 Reanudar", key=f"reanudar_{trabajo['id']}"):
+                importador.reanudar(trabajo['id'])
+                st.rerun()
+    return hay_activos
 
 def mostrar_categorias():
     st.title("🏷️ Categorías y Reglas de Clasificación")
     st.markdown("Gestiona las reglas que se usan para clasificar automáticamente tus transacciones.")
 
+    stats_cache = categorizer.estadisticas_cache()
+    st.caption(
+        f"Caché de clasificación: {stats_cache['aciertos']} aciertos, {stats_cache['fallos']} fallos "
+        f"({stats_cache['tasa_aciertos']:.1f}%), {stats_cache['tamaño']}/{stats_cache['tamaño_max']} entradas"
+    )
+
     # Cargar y mostrar las reglas actuales
     try:
         with open(categorizer.RULES_FILE, 'r', encoding='utf-8') as f:
@@ -849,13 +958,16 @@ def mostrar_sincronizacion():
         st.info("Descarga tu base de datos completa en formato JSON para importarla en otro dispositivo.")
 
         # Mostrar estadísticas
-        transacciones = db_manager.obtener_transacciones()
+        # Cuenta y suma en SQLite, sin traer las transacciones
+        resumen_export = db_manager.consultar_agregados(
+            agregados={'n': ('cuenta', '*'), 'balance': ('suma', 'importe')}
+        )
+        n_transacciones = resumen_export[0]['n'] if resumen_export else 0
         col1, col2 = st.columns(2)
-        col1.metric("Total de Transacciones", len(transacciones))
+        col1.metric("Total de Transacciones", n_transacciones)
 
-        if transacciones:
-            importes_totales = sum(t['importe'] for t in transacciones)
-            col2.metric("Balance Total", f"{importes_totales:.2f} €")
+        if n_transacciones:
+            col2.metric("Balance Total", f"{resumen_export[0]['balance']:.2f} €")
 
         st.markdown("---")
 
@@ -1028,6 +1140,17 @@ def mostrar_configuracion():
             st.success("¡Base de datos reseteada con éxito!")
             st.rerun()
 
+    if st.button("🔁 Reconstruir Resúmenes Mensuales", help="Recalcula los totales mensuales a partir de todas las transacciones"):
+        with st.spinner("Reconstruyendo resúmenes..."):
+            if db_manager.reconstruir_resumen_mensual():
+                st.success("Resúmenes mensuales reconstruidos.")
+            else:
+                st.error("No se pudieron reconstruir los resúmenes mensuales.")
+
+    if st.button("🧹 Vaciar Caché de Importaciones", help="Borra los archivos Excel ya procesados que se guardan para reabrirlos al instante"):
+        borradas = cache_importacion.limpiar_cache()
+        st.success(f"Caché de importaciones vaciada ({borradas} archivos).")
+
     st.write("Aquí irán otros ajustes generales de la aplicación.")
 
 # --- Lógica para mostrar la página seleccionada ---
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""
+Benchmark del clasificador: compara la evaluación original regla a regla con el clasificador
+compilado sobre las reglas de config/categorias.json y verifica que ambos dan exactamente el mismo resultado.
+"""
+
+import random
+import time
+import pandas as pd
+from utils import categorizer
+
+PALABRAS_RUIDO = ['COMPRA', 'TARJ', 'PAGO', 'RECIBO', 'TRANSF', 'PAMPLONA', 'MADRID', 'SL', 'SA', 'ONLINE', '4B', 'BIZUM']
+
+def fragmentos_de_reglas():
+    """Extrae fragmentos literales de los patrones para generar conceptos que sí coincidan."""
+    fragmentos = []
+    for regla in categorizer._rules:
+        for alternativa in (regla.get('patron') or '').split('|'):
+            literal = alternativa.replace('\\.', '.').replace('.*', ' XX ')
+            if literal.strip():
+                fragmentos.append(literal)
+    return fragmentos
+
+def generar_casos(n, semilla=42):
+    """Genera n pares (concepto, importe) mezclando coincidencias, importes exactos y ruido."""
+    rnd = random.Random(semilla)
+    fragmentos = fragmentos_de_reglas()
+    importes_exactos = [i for r in categorizer._rules for i in r.get('importes_exactos', [])]
+
+    casos = []
+    for _ in range(n):
+        palabras = rnd.sample(PALABRAS_RUIDO, 3)
+        if rnd.random() < 0.6:
+            fragmento = rnd.choice(fragmentos)
+            fragmento = fragmento.lower() if rnd.random() < 0.3 else fragmento
+            palabras.insert(rnd.randint(0, 3), fragmento)
+        concepto = ' '.join(palabras)
+
+        azar = rnd.random()
+        if azar < 0.1 and importes_exactos:
+            importe = -rnd.choice(importes_exactos)
+        elif azar < 0.15:
+            importe = None
+        else:
+            importe = round(rnd.uniform(-500, 2500), 2)
+        casos.append((concepto, importe))
+    return casos
+
+def clasificar_referencia(concepto, importe=None):
+    """Algoritmo original de clasificar_transaccion, usado como referencia de resultados."""
+    for rule in categorizer._rules:
+        patron_coincide = False
+        importe_coincide = False
+
+        if 'regex' in rule and rule['regex'].search(concepto):
+            patron_coincide = True
+        elif 'patron' not in rule or not rule['patron']:
+            patron_coincide = True
+
+        if 'importes_exactos' in rule and importe is not None:
+            if abs(importe) in rule['importes_exactos']:
+                importe_coincide = True
+        else:
+            importe_coincide = True
+
+        if patron_coincide and importe_coincide:
+            if ('patron' in rule and rule['patron']) or 'importes_exactos' in rule:
+                return rule['categoria']
+
+    return "SIN_CLASIFICAR"
+
+def medir(funcion, casos):
+    """Clasifica todos los casos y devuelve (resultados, segundos)."""
+    inicio = time.perf_counter()
+    resultados = [funcion(concepto, importe) for concepto, importe in casos]
+    return resultados, time.perf_counter() - inicio
+
+def ejecutar_benchmark(n=100_000):
+    categorizer.load_rules()
+    casos = generar_casos(n)
+
+    referencia, t_referencia = medir(clasificar_referencia, casos)
+    compilado, t_compilado = medir(categorizer.clasificar_transaccion, casos)
+
+    diferencias = [(c, r, k) for c, r, k in zip(casos, referencia, compilado) if r != k]
+    assert not diferencias, f"Resultados distintos en {len(diferencias)} casos, p. ej.: {diferencias[:5]}"
+
+    # El clasificador por lotes debe coincidir con el escalar, también con importes NaN (sin importe)
+    casos_lote = casos + [(concepto, float('nan')) for concepto, _ in casos[:1000]]
+    inicio = time.perf_counter()
+    lote = categorizer.clasificar_lote(pd.Series([c for c, _ in casos_lote]), pd.Series([i for _, i in casos_lote], dtype=float))
+    t_lote = time.perf_counter() - inicio
+    escalar = [categorizer.clasificar_transaccion(concepto, importe) for concepto, importe in casos_lote]
+    diferencias = [(c, e, l) for c, e, l in zip(casos_lote, escalar, lote) if e != l]
+    assert not diferencias, f"El lote difiere del escalar en {len(diferencias)} casos, p. ej.: {diferencias[:5]}"
+
+    print(f"📊 {n} transacciones, {len(categorizer._rules)} reglas")
+    print(f"{'Regla a regla':<22} {t_referencia:>8.3f} s")
+    print(f"{'Clasificador compilado':<22} {t_compilado:>8.3f} s  (x{t_referencia / t_compilado:.1f})")
+    print(f"{'Clasificación por lotes':<22} {t_lote:>8.3f} s  ({len(casos_lote)} filas, incluidas {len(casos_lote) - n} con importe NaN)")
+    print("✅ Los tres métodos devuelven exactamente las mismas categorías")
+
+if __name__ == "__main__":
+    ejecutar_benchmark()
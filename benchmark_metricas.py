@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark de calcular_evolucion_mensual: compara la implementación original, que carga todas las
+transacciones y las agrupa con groupby(...).apply, con la actual (resumen_mensual más el mes parcial
+agregado en SQLite) sobre una base de datos temporal con transacciones sintéticas, y verifica que
+ambas devuelven la misma evolución mensual.
+"""
+
+import os
+import tempfile
+import time
+from datetime import timedelta
+import numpy as np
+import pandas as pd
+from database import db_manager
+from utils import metrics
+
+CATEGORIAS = ['FIJOS', 'DISFRUTE', 'EXTRAORDINARIOS', 'COMIDA', 'TRANSPORTE', 'SIN_CLASIFICAR']
+
+def generar_transacciones(n, dias=3 * 365, semilla=42):
+    """Genera n transacciones repartidas en los últimos `dias` días hasta el 31/12/2024."""
+    rnd = np.random.default_rng(semilla)
+    fechas = pd.Timestamp('2024-12-31') - pd.to_timedelta(rnd.integers(0, dias, n), unit='D')
+    ingreso = rnd.random(n) < 0.3
+    importes = np.round(rnd.uniform(1, 2500, n), 2) * np.where(ingreso, 1, -1)
+    categorias = rnd.choice(CATEGORIAS, n)
+    return [
+        {
+            'fecha': f.date(), 'concepto': f"Movimiento {i}", 'importe': importe, 'categoria': categoria,
+            'tipo': 'INGRESO' if es_ingreso else 'GASTO', 'mes': f.month, 'año': f.year
+        }
+        for i, (f, importe, categoria, es_ingreso) in enumerate(zip(fechas, importes.tolist(), categorias.tolist(), ingreso.tolist()))
+    ]
+
+def evolucion_referencia():
+    """Algoritmo original de calcular_evolucion_mensual, usado como referencia de resultados."""
+    transacciones = db_manager.obtener_transacciones()
+    if not transacciones:
+        return pd.DataFrame()
+
+    df = pd.DataFrame(transacciones)
+    df['fecha'] = pd.to_datetime(df['fecha'])
+
+    fecha_max = df['fecha'].max()
+    fecha_min = fecha_max - timedelta(days=365)
+
+    df_filtrado = df[df['fecha'] >= fecha_min]
+
+    if df_filtrado.empty:
+        return pd.DataFrame()
+
+    df_agrupado = df_filtrado.groupby([df_filtrado['fecha'].dt.year.rename('año'), df_filtrado['fecha'].dt.month.rename('mes')]).apply(lambda x: pd.Series({
+        'ingresos': x[x['tipo'] == 'INGRESO']['importe'].sum(),
+        'gastos': x[x['tipo'] == 'GASTO']['importe'].sum()
+    })).reset_index()
+
+    df_agrupado['balance'] = df_agrupado['ingresos'] + df_agrupado['gastos']
+    df_agrupado['periodo'] = pd.to_datetime(df_agrupado['año'].astype(str) + '-' + df_agrupado['mes'].astype(str) + '-01')
+    df_agrupado = df_agrupado.sort_values('periodo').reset_index(drop=True)
+
+    return df_agrupado
+
+def medir(funcion):
+    """Ejecuta la función y devuelve (resultado, segundos)."""
+    inicio = time.perf_counter()
+    resultado = funcion()
+    return resultado, time.perf_counter() - inicio
+
+def ejecutar_benchmark(n=1_000_000):
+    with tempfile.TemporaryDirectory() as directorio:
+        db_manager.DB_NAME = os.path.join(directorio, 'benchmark.db')
+        db_manager.crear_tablas()
+        db_manager.insertar_transacciones_lote(generar_transacciones(n))
+
+        referencia, t_referencia = medir(evolucion_referencia)
+        # Sin la caché de métricas, para medir el cálculo y no la memorización
+        actual, t_actual = medir(metrics.calcular_evolucion_mensual.__wrapped__)
+        db_manager.cerrar_conexiones()
+
+    pd.testing.assert_frame_equal(actual, referencia, check_dtype=False, check_exact=False, rtol=1e-9)
+
+    print(f"📊 {n} transacciones, {len(referencia)} meses en la ventana")
+    print(f"{'transacciones + apply':<24} {t_referencia:>8.3f} s")
+    print(f"{'resumen_mensual':<24} {t_actual:>8.3f} s  (x{t_referencia / t_actual:.1f})")
+    print("✅ Ambos métodos devuelven exactamente la misma evolución mensual")
+
+if __name__ == "__main__":
+    ejecutar_benchmark()
@@ -1,61 +1,455 @@
-
 # database/db_manager.py
 
+import base64
+import json
+import re
 import sqlite3
+import threading
+import time
 import uuid
-from .models import ALL_TABLES
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from .models import (
+    ACTUALIZAR_SALDO_CALCULADO, ACTUALIZAR_SALDOS_DIARIOS, ALL_TABLES, MIGRACIONES, REBUILD_MONTHLY_SUMMARY, REBUILD_SEARCH_INDEX,
+    calcular_huella, contenido_huella,
+)
 
 DB_NAME = 'finanzas.db'
 
+# Número máximo de conexiones inactivas que el pool mantiene abiertas para reutilizar
+POOL_MAX_CONEXIONES = 8
+
+# Perfil de PRAGMAs que se aplica una única vez al abrir cada conexión.
+# Con WAL los lectores no esperan al escritor, y synchronous=NORMAL es seguro en modo WAL.
+PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,         # ms de espera antes de lanzar "database is locked"
+    'cache_size': -20000,         # negativo = KiB (≈20 MB de caché de páginas por conexión)
+    'mmap_size': 268435456,       # 256 MB de E/S mapeada en memoria
+    'temp_store': 'MEMORY',
+}
+
+# Segundos mínimos entre dos ejecuciones automáticas de mantenimiento (checkpoint + optimize)
+INTERVALO_MANTENIMIENTO = 300
+
+# --- Pool de conexiones ---
+_pool_lock = threading.Lock()
+_pool_inactivas = []  # Lista de tuplas (ruta, conexión) listas para reutilizar
+_pool_stats = {'abiertas': 0, 'reutilizadas': 0, 'cerradas': 0, 'en_uso': 0}
+_local = threading.local()
+_mantenimiento_lock = threading.Lock()
+_ultimo_mantenimiento = time.monotonic()
+
+# --- Versión de los datos ---
+_version_lock = threading.Lock()
+_version_datos = 0  # Aumenta cada vez que un bloque conexion() modifica la base de datos
+
 def generar_uuid():
     """Genera un UUID único para usar como ID de transacción."""
     return str(uuid.uuid4())
 
+def _regexp(patron, texto):
+    """Implementa el operador REGEXP de SQLite (sin distinguir mayúsculas, como las reglas de clasificación)."""
+    if texto is None:
+        return False
+    return re.search(patron, texto, re.IGNORECASE) is not None
+
 def get_db_connection():
-    """Establece la conexión con la base de datos."""
+    """Abre una nueva conexión con la base de datos y le aplica los PRAGMAs configurados."""
     conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
+    for pragma, valor in PRAGMAS.items():
+        conn.execute(f"PRAGMA {pragma} = {valor}")
+    conn.create_function("REGEXP", 2, _regexp, deterministic=True)
     return conn
 
+def _tomar_conexion():
+    """Saca una conexión del pool (o abre una nueva si no hay ninguna disponible)."""
+    with _pool_lock:
+        while _pool_inactivas:
+            ruta, conn = _pool_inactivas.pop()
+            if ruta == DB_NAME:
+                _pool_stats['reutilizadas'] += 1
+                _pool_stats['en_uso'] += 1
+                return ruta, conn
+            # La base de datos configurada ha cambiado: descartamos la conexión antigua
+            conn.close()
+            _pool_stats['cerradas'] += 1
+        _pool_stats['abiertas'] += 1
+        _pool_stats['en_uso'] += 1
+    return DB_NAME, get_db_connection()
+
+def _devolver_conexion(ruta, conn):
+    """Devuelve una conexión al pool o la cierra si el pool está lleno."""
+    with _pool_lock:
+        _pool_stats['en_uso'] -= 1
+        if ruta == DB_NAME and len(_pool_inactivas) < POOL_MAX_CONEXIONES:
+            _pool_inactivas.append((ruta, conn))
+            return
+        _pool_stats['cerradas'] += 1
+    conn.close()
+
+@contextmanager
+def conexion():
+    """
+    Entrega una conexión del pool para usar en un bloque `with`.
+    Las llamadas anidadas dentro del mismo hilo reutilizan la misma conexión;
+    solo el bloque más externo confirma los cambios (o los revierte si hay una excepción)
+    y devuelve la conexión al pool. Si el bloque modificó filas, antes de confirmar se ponen
+    al día los saldos en la misma transacción, así que las lecturas nunca tienen que escribir.
+    """
+    activa = getattr(_local, 'activa', None)
+    if activa is not None:
+        yield activa[1]
+        return
+
+    ruta, conn = _tomar_conexion()
+    _local.activa = (ruta, conn)
+    cambios = conn.total_changes
+    try:
+        yield conn
+        if conn.total_changes != cambios and not getattr(_local, 'migrando', False):
+            _actualizar_saldos(conn)
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        if conn.in_transaction:
+            conn.rollback()
+        raise
+    else:
+        _mantenimiento_periodico(conn)
+    finally:
+        _local.activa = None
+        # Después del commit (o rollback): quien lea la nueva versión ya ve los datos nuevos
+        if conn.total_changes != cambios:
+            marcar_datos_modificados()
+        _devolver_conexion(ruta, conn)
+
+def marcar_datos_modificados():
+    """
+    Aumenta la versión de los datos. conexion() lo hace solo al salir de cualquier bloque que haya
+    modificado filas; hay que llamarla a mano tras cambios que SQLite no cuenta (p. ej. DROP TABLE).
+    """
+    global _version_datos
+    with _version_lock:
+        _version_datos += 1
+
+def version_datos():
+    """
+    Versión actual de los datos (base de datos configurada, contador de escrituras).
+    Cambia con cada escritura, así que sirve como clave para cachear resultados calculados.
+    """
+    return DB_NAME, _version_datos
+
+def configurar_pragmas(**valores):
+    """
+    Modifica el perfil de PRAGMAs (p. ej. `configurar_pragmas(cache_size=-64000)`).
+    Las conexiones inactivas se cierran para que las nuevas se abran ya con el perfil actualizado.
+    """
+    PRAGMAS.update(valores)
+    cerrar_conexiones()
+
+def _ejecutar_mantenimiento(conn):
+    """Vuelca el WAL a la base de datos sin bloquear a nadie y actualiza las estadísticas del planificador."""
+    conn.execute("PRAGMA wal_checkpoint(PASSIVE)")
+    conn.execute("PRAGMA optimize")
+
+def _mantenimiento_periodico(conn):
+    """Ejecuta el mantenimiento si ha pasado INTERVALO_MANTENIMIENTO desde la última vez."""
+    global _ultimo_mantenimiento
+    if time.monotonic() - _ultimo_mantenimiento < INTERVALO_MANTENIMIENTO:
+        return
+    if not _mantenimiento_lock.acquire(blocking=False):
+        return # Otro hilo ya lo está ejecutando
+    try:
+        _ultimo_mantenimiento = time.monotonic()
+        _ejecutar_mantenimiento(conn)
+    except sqlite3.Error as e:
+        print(f"Error en el mantenimiento periódico de la base de datos: {e}")
+    finally:
+        _mantenimiento_lock.release()
+
+def mantenimiento():
+    """Fuerza un checkpoint del WAL y un PRAGMA optimize inmediatamente."""
+    global _ultimo_mantenimiento
+    with _mantenimiento_lock:
+        _ultimo_mantenimiento = time.monotonic()
+        with conexion() as conn:
+            _ejecutar_mantenimiento(conn)
+
+def estadisticas_pool():
+    """Devuelve las estadísticas de uso del pool de conexiones."""
+    with _pool_lock:
+        stats = dict(_pool_stats)
+        stats['inactivas'] = len(_pool_inactivas)
+    stats['max_inactivas'] = POOL_MAX_CONEXIONES
+    return stats
+
+def cerrar_conexiones():
+    """Cierra todas las conexiones inactivas del pool."""
+    with _pool_lock:
+        inactivas = list(_pool_inactivas)
+        _pool_inactivas.clear()
+        _pool_stats['cerradas'] += len(inactivas)
+    for _, conn in inactivas:
+        conn.close()
+
 def crear_tablas():
-    """Crea todas las tablas en la base de datos si no existen."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Crea todas las tablas en la base de datos si no existen y aplica las migraciones pendientes."""
     try:
-        for tabla_sql in ALL_TABLES:
-            cursor.execute(tabla_sql)
-        conn.commit()
+        with conexion() as conn:
+            cursor = conn.cursor()
+            for tabla_sql in ALL_TABLES:
+                cursor.execute(tabla_sql)
         print("Tablas creadas exitosamente o ya existentes.")
+        aplicar_migraciones()
     except sqlite3.Error as e:
         print(f"Error al crear las tablas: {e}")
+
+def obtener_version_esquema():
+    """Devuelve la versión de esquema más alta aplicada (0 si no hay ninguna)."""
+    with conexion() as conn:
+        resultado = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()[0]
+    return resultado or 0
+
+def aplicar_migraciones():
+    """
+    Aplica en orden las migraciones de MIGRACIONES que aún no estén registradas en schema_version.
+    Cada migración se ejecuta en su propia transacción: si falla, se revierte y se detiene el proceso.
+    Retorna la lista de versiones aplicadas.
+    """
+    aplicadas = []
+    # Mientras el esquema está a medias (p. ej. entre las migraciones 7 y 8) no se recalculan los saldos
+    _local.migrando = True
+    try:
+        for version, descripcion, pasos in MIGRACIONES:
+            with conexion() as conn:
+                if not conn.in_transaction:
+                    # Con el bloqueo de escritura tomado antes de leer la versión, otra sesión que
+                    # arranque a la vez espera y, al releerla, ve la migración ya aplicada
+                    conn.execute("BEGIN IMMEDIATE")
+                if version <= obtener_version_esquema():
+                    continue
+                for paso in pasos:
+                    if callable(paso):
+                        paso(conn)
+                    else:
+                        conn.execute(paso)
+                conn.execute("INSERT INTO schema_version (version, descripcion) VALUES (?, ?)", (version, descripcion))
+            print(f"Migración {version} aplicada: {descripcion}")
+            aplicadas.append(version)
     finally:
-        conn.close()
+        _local.migrando = False
+    if aplicadas:
+        with conexion() as conn:
+            _actualizar_saldos(conn)
+    return aplicadas
 
 def insertar_transaccion(fecha, concepto, importe, categoria, tipo, mes, año, notas='', saldo_posterior=None, id=None):
     """Inserta una nueva transacción en la base de datos."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        try:
+            # Generar UUID si no se proporciona (para sincronización)
+            if id is None:
+                id = generar_uuid()
+
+            huella = _huellas_libres(cursor, [contenido_huella(fecha, importe, concepto, saldo_posterior)])[0]
+            cursor.execute(_SQL_INSERTAR_TRANSACCION,
+                           (id, fecha, concepto, importe, categoria, tipo, mes, año, notas, saldo_posterior, huella))
+            return id
+        except sqlite3.Error as e:
+            print(f"Error al insertar transacción: {e}")
+            return None
+
+# Tamaño por defecto de cada bloque de executemany en las inserciones masivas
+TAMAÑO_LOTE_INSERCION = 500
+
+_COLUMNAS_INSERCION = "id, fecha, concepto, importe, categoria, tipo, mes, año, notas, saldo_posterior, huella"
+
+_SQL_INSERTAR_TRANSACCION = f"""
+    INSERT INTO transacciones ({_COLUMNAS_INSERCION})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+# Inserción idempotente: las filas cuyo id o huella ya existen se ignoran sin error
+_SQL_INSERTAR_SI_NUEVA = f"""
+    INSERT OR IGNORE INTO transacciones ({_COLUMNAS_INSERCION})
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+"""
+
+def _fila_insercion(transaccion):
+    """Convierte un diccionario de transacción en la tupla de parámetros del INSERT, sin la huella."""
+    return (
+        transaccion.get('id') or generar_uuid(),
+        transaccion['fecha'],
+        transaccion['concepto'],
+        transaccion['importe'],
+        transaccion.get('categoria'),
+        transaccion['tipo'],
+        transaccion['mes'],
+        transaccion['año'],
+        transaccion.get('notas', ''),
+        transaccion.get('saldo_posterior')
+    )
+
+def _contenido_transaccion(transaccion):
+    """Contenido normalizado con el que se calcula la huella de un diccionario de transacción."""
+    return contenido_huella(transaccion['fecha'], transaccion['importe'], transaccion['concepto'], transaccion.get('saldo_posterior'))
+
+def _huellas_existentes(cursor, huellas):
+    """Devuelve cuáles de las huellas dadas están ya en la tabla, consultando por bloques."""
+    huellas = list(huellas)
+    existentes = set()
+    for inicio in range(0, len(huellas), TAMAÑO_LOTE_INSERCION):
+        bloque = huellas[inicio:inicio + TAMAÑO_LOTE_INSERCION]
+        cursor.execute(f"SELECT huella FROM transacciones WHERE huella IN ({', '.join('?' * len(bloque))})", bloque)
+        existentes.update(fila[0] for fila in cursor.fetchall())
+    return existentes
+
+def _huellas_libres(cursor, contenidos):
+    """
+    Asigna a cada contenido la huella de la primera ocurrencia que no esté ya guardada, para las
+    inserciones que deben crear la fila aunque repita un movimiento existente. Cada ronda comprueba
+    todas las candidatas con una consulta; normalmente basta con una o dos rondas.
+    """
+    huellas = [None] * len(contenidos)
+    pendientes = {}
+    for indice, contenido in enumerate(contenidos):
+        pendientes.setdefault(contenido, []).append(indice)
+    siguiente = dict.fromkeys(pendientes, 0)
+
+    while pendientes:
+        candidatas = {}
+        for contenido, indices in pendientes.items():
+            for ocurrencia in range(siguiente[contenido], siguiente[contenido] + len(indices)):
+                candidatas[calcular_huella(contenido, ocurrencia)] = contenido
+            siguiente[contenido] += len(indices)
+
+        ocupadas = _huellas_existentes(cursor, candidatas)
+        for huella, contenido in candidatas.items():
+            if huella not in ocupadas:
+                huellas[pendientes[contenido].pop(0)] = huella
+        pendientes = {contenido: indices for contenido, indices in pendientes.items() if indices}
+    return huellas
+
+def _insertar_bloque(cursor, bloque, ids, errores):
+    """
+    Inserta un bloque de filas con executemany dentro de un SAVEPOINT.
+    Si el bloque falla, se deshace y se reintenta fila a fila para aislar los errores.
+    """
+    huellas = _huellas_libres(cursor, [contenido for _, _, contenido in bloque])
+    bloque = [(indice, fila + (huella,)) for (indice, fila, _), huella in zip(bloque, huellas)]
+
+    cursor.execute("SAVEPOINT lote_transacciones")
     try:
-        # Generar UUID si no se proporciona (para sincronización)
-        if id is None:
-            id = generar_uuid()
-
-        cursor.execute("""
-            INSERT INTO transacciones (id, fecha, concepto, importe, categoria, tipo, mes, año, notas, saldo_posterior)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-        """, (id, fecha, concepto, importe, categoria, tipo, mes, año, notas, saldo_posterior))
-        conn.commit()
-        return id
-    except sqlite3.Error as e:
-        print(f"Error al insertar transacción: {e}")
-        return None
-    finally:
-        conn.close()
+        cursor.executemany(_SQL_INSERTAR_TRANSACCION, [fila for _, fila in bloque])
+        cursor.execute("RELEASE lote_transacciones")
+        return
+    except sqlite3.Error:
+        cursor.execute("ROLLBACK TO lote_transacciones")
+        cursor.execute("RELEASE lote_transacciones")
+
+    for indice, fila in bloque:
+        try:
+            cursor.execute(_SQL_INSERTAR_TRANSACCION, fila)
+        except sqlite3.Error as e:
+            ids[indice] = None
+            errores.append((indice, str(e)))
+
+def insertar_transacciones_lote(transacciones, chunk_size=TAMAÑO_LOTE_INSERCION):
+    """
+    Inserta muchas transacciones en una única transacción de base de datos usando executemany.
+    Retorna una tupla (ids, errores): `ids` tiene un elemento por transacción de entrada
+    (None si no se pudo insertar) y `errores` es una lista de tuplas (índice, mensaje).
+    """
+    ids = []
+    errores = []
+    with conexion() as conn:
+        if not conn.in_transaction:
+            conn.execute("BEGIN")
+        cursor = conn.cursor()
+        bloque = []
+        for indice, transaccion in enumerate(transacciones):
+            try:
+                fila = _fila_insercion(transaccion)
+                contenido = _contenido_transaccion(transaccion)
+            except (KeyError, TypeError, AttributeError, ValueError) as e:
+                ids.append(None)
+                errores.append((indice, f"Transacción incompleta: {e}"))
+                continue
+
+            ids.append(fila[0])
+            bloque.append((indice, fila, contenido))
+            if len(bloque) >= chunk_size:
+                _insertar_bloque(cursor, bloque, ids, errores)
+                bloque = []
+
+        if bloque:
+            _insertar_bloque(cursor, bloque, ids, errores)
+    return ids, errores
+
+def asignar_huellas(transacciones):
+    """
+    Calcula la huella de las transacciones que aún no la tienen, numerando los movimientos idénticos
+    por orden de aparición en toda la lista. Permite insertar un extracto en varios bloques con
+    insertar_transacciones_nuevas sin que la numeración vuelva a empezar en cada bloque.
+    """
+    ocurrencias = {}
+    for transaccion in transacciones:
+        try:
+            contenido = _contenido_transaccion(transaccion)
+        except (KeyError, TypeError, AttributeError, ValueError):
+            continue # insertar_transacciones_nuevas la reportará como incompleta
+        ocurrencia = ocurrencias.get(contenido, 0)
+        ocurrencias[contenido] = ocurrencia + 1
+        if not transaccion.get('huella'):
+            transaccion['huella'] = calcular_huella(contenido, ocurrencia)
+
+def insertar_transacciones_nuevas(transacciones, chunk_size=TAMAÑO_LOTE_INSERCION):
+    """
+    Inserta solo las transacciones que aún no estén registradas, con INSERT OR IGNORE sobre el id y
+    la huella: reimportar un extracto que se solapa con lo ya guardado no crea duplicados ni necesita
+    consultar la tabla antes. Los movimientos idénticos dentro del lote se numeran por orden de aparición;
+    si el extracto se inserta en varias llamadas, sus huellas se calculan antes con asignar_huellas.
+    Retorna una tupla (insertadas, ignoradas, errores), con errores como lista de tuplas (índice, mensaje).
+    """
+    filas = []
+    errores = []
+    ocurrencias = {}
+    for indice, transaccion in enumerate(transacciones):
+        try:
+            fila = _fila_insercion(transaccion)
+            contenido = _contenido_transaccion(transaccion)
+        except (KeyError, TypeError, AttributeError, ValueError) as e:
+            errores.append((indice, f"Transacción incompleta: {e}"))
+            continue
+        ocurrencia = ocurrencias.get(contenido, 0)
+        ocurrencias[contenido] = ocurrencia + 1
+        # Las transacciones exportadas desde otra base (o pasadas por asignar_huellas) ya traen su huella
+        filas.append(fila + (transaccion.get('huella') or calcular_huella(contenido, ocurrencia),))
+
+    with conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SAVEPOINT insertar_nuevas")
+        try:
+            insertadas = 0
+            for inicio in range(0, len(filas), chunk_size):
+                cursor.executemany(_SQL_INSERTAR_SI_NUEVA, filas[inicio:inicio + chunk_size])
+                insertadas += cursor.rowcount
+            cursor.execute("RELEASE insertar_nuevas")
+            return insertadas, len(filas) - insertadas, errores
+        except sqlite3.Error as e:
+            cursor.execute("ROLLBACK TO insertar_nuevas")
+            cursor.execute("RELEASE insertar_nuevas")
+            print(f"Error al insertar las transacciones nuevas: {e}")
+            return 0, 0, errores + [(None, str(e))]
 
 def obtener_transacciones(mes=None, año=None):
     """Obtiene transacciones, opcionalmente filtradas por mes y año."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
     query = "SELECT * FROM transacciones "
     params = []
     where_clauses = []
@@ -70,88 +464,352 @@ def obtener_transacciones(mes=None, año=None):
         query += "WHERE " + " AND ".join(where_clauses)
     query += " ORDER BY fecha DESC"
     
-    cursor.execute(query, params)
-    transacciones = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        transacciones = [dict(row) for row in cursor.fetchall()]
     return transacciones
 
-def actualizar_transaccion(id_transaccion, campos_a_actualizar):
-    """Actualiza uno o más campos de una transacción existente."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+# Número de transacciones por página en las consultas paginadas
+TAMAÑO_PAGINA = 50
+
+def _codificar_cursor(fecha, id_transaccion):
+    """Token opaco con la clave (fecha, id) de la última fila de una página."""
+    return base64.urlsafe_b64encode(json.dumps([str(fecha), id_transaccion]).encode('utf-8')).decode('ascii')
+
+def _decodificar_cursor(cursor):
+    fecha, id_transaccion = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+    return fecha, id_transaccion
+
+def obtener_pagina_transacciones(mes=None, año=None, categorias=None, cursor=None, limite=TAMAÑO_PAGINA):
+    """
+    Obtiene una página de transacciones, de la más reciente a la más antigua (fecha DESC, id DESC),
+    con paginación por clave: `cursor` es el token devuelto con la página anterior (None para la
+    primera). Cada página cuesta lo mismo sea cual sea su posición, porque no usa OFFSET.
+    Retorna una tupla (transacciones, siguiente_cursor); siguiente_cursor es None en la última página.
+    """
+    filtros = []
+    params = []
+    if mes:
+        filtros.append("mes = ?")
+        params.append(mes)
+    if año:
+        filtros.append("año = ?")
+        params.append(año)
+    if categorias:
+        filtros.append(f"categoria IN ({', '.join('?' * len(categorias))})")
+        params.extend(categorias)
+    if cursor:
+        filtros.append("(fecha, id) < (?, ?)")
+        params.extend(_decodificar_cursor(cursor))
 
-    # Obtener la transacción original para comparar
-    cursor.execute("SELECT * FROM transacciones WHERE id = ?", (id_transaccion,))
-    transaccion_original = dict(cursor.fetchone())
+    query = "SELECT * FROM transacciones"
+    if filtros:
+        query += " WHERE " + " AND ".join(filtros)
+    # Se pide una fila de más para saber si existe una página siguiente
+    query += " ORDER BY fecha DESC, id DESC LIMIT ?"
+    params.append(limite + 1)
 
-    # Filtrar solo los campos que realmente han cambiado
-    campos_reales_a_actualizar = {}
-    for key, value in campos_a_actualizar.items():
-        if key in transaccion_original and transaccion_original[key] != value:
-            campos_reales_a_actualizar[key] = value
+    with conexion() as conn:
+        try:
+            filas = [dict(row) for row in conn.execute(query, params).fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error al obtener la página de transacciones: {e}")
+            return [], None
 
-    if not campos_reales_a_actualizar:
-        return True # No hay nada que actualizar, se considera un éxito
+    siguiente = None
+    if len(filas) > limite:
+        filas = filas[:limite]
+        siguiente = _codificar_cursor(filas[-1]['fecha'], filas[-1]['id'])
+    return filas, siguiente
 
-    set_clause = ", ".join([f"{key} = ?" for key in campos_a_actualizar.keys()])
-    params = list(campos_a_actualizar.values()) + [id_transaccion]
-    query = f"UPDATE transacciones SET {set_clause} WHERE id = ?"
-    
+# Filas que se leen de SQLite en cada fetchmany al recorrer transacciones sin cargarlas todas
+TAMAÑO_BLOQUE_LECTURA = 5000
+
+# Columnas que se pueden pedir a cargar_transacciones_df y cómo se tipa cada una
+COLUMNAS_DATAFRAME = {
+    'id': 'texto', 'fecha': 'fecha', 'concepto': 'texto', 'importe': 'real',
+    'categoria': 'categoria', 'tipo': 'categoria', 'mes': 'entero', 'año': 'entero',
+    'saldo_posterior': 'real', 'notas': 'texto', 'categoria_manual': 'entero',
+}
+
+def _consulta_transacciones(columnas, mes=None, año=None, desde=None, hasta=None):
+    """Construye la consulta de transacciones ordenadas por (fecha, id) con los filtros indicados."""
+    filtros = []
+    params = []
+    if mes:
+        filtros.append("mes = ?")
+        params.append(mes)
+    if año:
+        filtros.append("año = ?")
+        params.append(año)
+    if desde:
+        filtros.append("fecha >= ?")
+        params.append(str(desde))
+    if hasta:
+        filtros.append("fecha <= ?")
+        params.append(str(hasta))
+
+    query = f"SELECT {', '.join(columnas)} FROM transacciones"
+    if filtros:
+        query += " WHERE " + " AND ".join(filtros)
+    query += " ORDER BY fecha, id"
+    return query, params
+
+def iterar_transacciones(mes=None, año=None, desde=None, hasta=None, tamaño_bloque=TAMAÑO_BLOQUE_LECTURA):
+    """
+    Generador que recorre las transacciones de la más antigua a la más reciente (fecha, id),
+    leyendo de SQLite en bloques de `tamaño_bloque` filas, sin tener nunca la tabla entera en memoria.
+    Usa una conexión propia del pool, de modo que se puede escribir con las demás funciones del
+    módulo mientras se consume (solo ve datos ya confirmados); la conexión se devuelve al terminar
+    o al cerrar el generador.
+    """
+    query, params = _consulta_transacciones(['*'], mes, año, desde, hasta)
+    ruta, conn = _tomar_conexion()
+    cursor = conn.cursor()
     try:
         cursor.execute(query, params)
-        conn.commit()
-        return cursor.rowcount > 0
-    except sqlite3.Error as e:
-        print(f"Error al actualizar transacción: {e}")
-        return False
+        while True:
+            filas = cursor.fetchmany(tamaño_bloque)
+            if not filas:
+                break
+            for fila in filas:
+                yield dict(fila)
     finally:
-        conn.close()
+        cursor.close()
+        _devolver_conexion(ruta, conn)
+
+def cargar_transacciones_df(mes=None, año=None, desde=None, hasta=None, columnas=None, tamaño_bloque=TAMAÑO_BLOQUE_LECTURA):
+    """
+    Carga transacciones directamente en un DataFrame de columnas tipadas, sin pasar por un dict por fila:
+    fecha como datetime64, importes como float64, categoria/tipo como categóricas y mes/año como enteros.
+    `columnas` limita las columnas leídas (por defecto, todas las de COLUMNAS_DATAFRAME).
+    Las filas van ordenadas por (fecha, id).
+    """
+    columnas = list(columnas or COLUMNAS_DATAFRAME)
+    desconocidas = [c for c in columnas if c not in COLUMNAS_DATAFRAME]
+    if desconocidas:
+        raise ValueError(f"Columnas no válidas: {desconocidas}")
+
+    query, params = _consulta_transacciones(columnas, mes, año, desde, hasta)
+    valores = [[] for _ in columnas]
+    with conexion() as conn:
+        cursor = conn.cursor()
+        # Tuplas en lugar de sqlite3.Row: cada bloque se reparte por columnas con zip
+        cursor.row_factory = None
+        try:
+            cursor.execute(query, params)
+            while True:
+                filas = cursor.fetchmany(tamaño_bloque)
+                if not filas:
+                    break
+                for lista, bloque in zip(valores, zip(*filas)):
+                    lista.extend(bloque)
+        except sqlite3.Error as e:
+            print(f"Error al cargar transacciones: {e}")
+            valores = [[] for _ in columnas]
+
+    datos = {}
+    for columna, lista in zip(columnas, valores):
+        tipo = COLUMNAS_DATAFRAME[columna]
+        if tipo == 'fecha':
+            datos[columna] = pd.to_datetime(pd.Series(lista, dtype=object), format='ISO8601')
+        elif tipo == 'real':
+            datos[columna] = np.array(lista, dtype=np.float64)
+        elif tipo == 'categoria':
+            datos[columna] = pd.Categorical(lista)
+        elif tipo == 'entero':
+            datos[columna] = pd.array(lista, dtype='Int64')
+        else:
+            datos[columna] = pd.Series(lista, dtype=object)
+    return pd.DataFrame(datos, columns=columnas)
+
+def actualizar_transaccion(id_transaccion, campos_a_actualizar):
+    """Actualiza uno o más campos de una transacción existente."""
+    with conexion() as conn:
+        cursor = conn.cursor()
+
+        # Obtener la transacción original para comparar
+        cursor.execute("SELECT * FROM transacciones WHERE id = ?", (id_transaccion,))
+        transaccion_original = dict(cursor.fetchone())
+
+        # Filtrar solo los campos que realmente han cambiado
+        campos_reales_a_actualizar = {}
+        for key, value in campos_a_actualizar.items():
+            if key in transaccion_original and transaccion_original[key] != value:
+                campos_reales_a_actualizar[key] = value
+
+        if not campos_reales_a_actualizar:
+            return True # No hay nada que actualizar, se considera un éxito
+
+        campos_a_actualizar = dict(campos_a_actualizar)
+        if 'categoria' in campos_reales_a_actualizar:
+            # Categoría elegida por el usuario: las reclasificaciones automáticas la respetan
+            campos_a_actualizar['categoria_manual'] = 1
+
+        set_clause = ", ".join([f"{key} = ?" for key in campos_a_actualizar.keys()])
+        params = list(campos_a_actualizar.values()) + [id_transaccion]
+        query = f"UPDATE transacciones SET {set_clause} WHERE id = ?"
+        
+        try:
+            cursor.execute(query, params)
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Error al actualizar transacción: {e}")
+            return False
 
 def eliminar_transaccion(id_transaccion):
     """Elimina una transacción de la base de datos."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("DELETE FROM transacciones WHERE id = ?", (id_transaccion,))
-        conn.commit()
-        return cursor.rowcount > 0
-    except sqlite3.Error as e:
-        print(f"Error al eliminar transacción: {e}")
-        return False
-    finally:
-        conn.close()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("DELETE FROM transacciones WHERE id = ?", (id_transaccion,))
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Error al eliminar transacción: {e}")
+            return False
 
 def transaccion_existe(fecha, importe):
     """Verifica si ya existe una transacción con la misma fecha e importe."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        # Usamos LIMIT 1 para que la consulta sea más rápida, se detiene al encontrar la primera coincidencia.
-        cursor.execute("SELECT 1 FROM transacciones WHERE fecha = ? AND importe = ? LIMIT 1", (fecha, importe))
-        existe = cursor.fetchone() is not None
-        return existe
-    except sqlite3.Error as e:
-        print(f"Error al verificar si la transacción existe: {e}")
-        return False # En caso de error, asumimos que no existe para no bloquear la importación.
-    finally:
-        conn.close()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        try:
+            # Usamos LIMIT 1 para que la consulta sea más rápida, se detiene al encontrar la primera coincidencia.
+            cursor.execute("SELECT 1 FROM transacciones WHERE fecha = ? AND importe = ? LIMIT 1", (fecha, importe))
+            existe = cursor.fetchone() is not None
+            return existe
+        except sqlite3.Error as e:
+            print(f"Error al verificar si la transacción existe: {e}")
+            return False # En caso de error, asumimos que no existe para no bloquear la importación.
+
+def _clave_duplicado(fecha, importe, concepto=None, saldo_posterior=None, por_contenido=False):
+    """
+    Clave con la que se comparan las transacciones al importar. La fecha se lleva a texto igual que
+    la guarda SQLite ('YYYY-MM-DD'), de modo que coincida tanto con date como con el valor leído de la tabla.
+    """
+    clave = (str(fecha), importe)
+    if por_contenido:
+        # NaN no es igual a sí mismo: un saldo vacío se compara como None
+        saldo = None if saldo_posterior is None or saldo_posterior != saldo_posterior else saldo_posterior
+        clave += (concepto, saldo)
+    return clave
+
+def obtener_claves_existentes(fecha_inicio, fecha_fin, por_contenido=False):
+    """
+    Devuelve el conjunto de claves (fecha, importe) de las transacciones entre dos fechas, en una
+    única consulta por rango sobre el índice (fecha, importe). Con por_contenido=True las claves
+    incluyen también concepto y saldo_posterior.
+    """
+    columnas = "fecha, importe, concepto, saldo_posterior" if por_contenido else "fecha, importe"
+    with conexion() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute(f"SELECT {columnas} FROM transacciones WHERE fecha BETWEEN ? AND ?", (fecha_inicio, fecha_fin))
+            return {_clave_duplicado(*fila, por_contenido=por_contenido) for fila in cursor}
+        except sqlite3.Error as e:
+            print(f"Error al obtener las claves de transacciones existentes: {e}")
+            return set()
+
+def separar_duplicados(transacciones, por_contenido=False):
+    """
+    Separa un lote de transacciones a importar en (nuevas, duplicadas) comparándolas con las ya
+    registradas por fecha e importe, como transaccion_existe, pero con una sola consulta para todo el
+    lote: se cargan las claves del rango de fechas del lote y cada transacción se comprueba en memoria.
+    """
+    if not transacciones:
+        return [], []
+
+    claves = [
+        _clave_duplicado(t['fecha'], t['importe'], t.get('concepto'), t.get('saldo_posterior'), por_contenido)
+        for t in transacciones
+    ]
+    fechas = [clave[0] for clave in claves]
+    existentes = obtener_claves_existentes(min(fechas), max(fechas), por_contenido)
+
+    nuevas, duplicadas = [], []
+    for transaccion, clave in zip(transacciones, claves):
+        (duplicadas if clave in existentes else nuevas).append(transaccion)
+    return nuevas, duplicadas
+
+def obtener_candidatas_reclasificacion(reglas):
+    """
+    Obtiene (id, concepto, importe, categoria) de las transacciones que alguna de las reglas
+    podría clasificar: las que cumplen su patrón o, si la regla solo tiene importes, su importe.
+    Las transacciones con la categoría asignada a mano (categoria_manual) nunca son candidatas.
+    Si una regla trae 'literales' (su patrón es una alternancia de textos), se usa el índice de texto completo.
+    """
+    with conexion() as conn:
+        con_indice = _indice_busqueda_disponible(conn)
+
+        condiciones = []
+        params = []
+        for regla in reglas:
+            literales = regla.get('literales')
+            if regla.get('patron') and con_indice and literales and min(map(len, literales)) >= MIN_LONGITUD_BUSQUEDA_INDEXADA:
+                # Patrón de literales: el índice de texto completo preselecciona las filas que los contienen
+                # y la regex se comprueba solo sobre ellas
+                condiciones.append(
+                    "(rowid IN (SELECT rowid FROM transacciones_fts WHERE transacciones_fts MATCH ?) AND concepto REGEXP ?)"
+                )
+                params.append(f"concepto : ({' OR '.join(_frase_fts(l) for l in literales)})")
+                params.append(regla['patron'])
+            elif regla.get('patron'):
+                condiciones.append("concepto REGEXP ?")
+                params.append(regla['patron'])
+            elif regla.get('importes_exactos'):
+                condiciones.append(f"ABS(importe) IN ({', '.join('?' * len(regla['importes_exactos']))})")
+                params.extend(regla['importes_exactos'])
+        if not condiciones:
+            return []
+
+        query = (
+            "SELECT id, concepto, importe, categoria FROM transacciones "
+            f"WHERE categoria_manual = 0 AND ({' OR '.join(condiciones)})"
+        )
+        cursor = conn.cursor()
+        try:
+            cursor.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error al buscar transacciones candidatas a reclasificar: {e}")
+            return []
+
+def actualizar_categorias_lote(cambios):
+    """
+    Aplica una lista de pares (id, nueva_categoria) en una única transacción.
+    Retorna el número de transacciones actualizadas.
+    """
+    with conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SAVEPOINT actualizar_categorias")
+        try:
+            cursor.executemany(
+                "UPDATE transacciones SET categoria = ? WHERE id = ?",
+                [(categoria, id_transaccion) for id_transaccion, categoria in cambios]
+            )
+            actualizadas = cursor.rowcount
+            cursor.execute("RELEASE actualizar_categorias")
+            return actualizadas
+        except sqlite3.Error as e:
+            # Todo o nada: se deshacen también las filas que ya se hubieran actualizado
+            cursor.execute("ROLLBACK TO actualizar_categorias")
+            cursor.execute("RELEASE actualizar_categorias")
+            print(f"Error al actualizar categorías: {e}")
+            return 0
 
 def obtener_transacciones_por_periodo(fecha_inicio, fecha_fin):
     """Obtiene todas las transacciones en un rango de fechas."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM transacciones WHERE fecha BETWEEN ? AND ? ORDER BY fecha DESC", (fecha_inicio, fecha_fin))
-    transacciones = [dict(row) for row in cursor.fetchall()]
-    conn.close()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT * FROM transacciones WHERE fecha BETWEEN ? AND ? ORDER BY fecha DESC", (fecha_inicio, fecha_fin))
+        transacciones = [dict(row) for row in cursor.fetchall()]
     return transacciones
 
 def obtener_totales_por_categoria(mes, año):
-    """Calcula la suma de importes por categoría, filtrando por mes y/o año."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
+    """Calcula la suma de importes por categoría, filtrando por mes y/o año (lee de resumen_mensual)."""
     query = """
-        SELECT categoria, SUM(importe) as total
-        FROM transacciones
+        SELECT NULLIF(categoria, '') AS categoria, SUM(total) as total
+        FROM resumen_mensual
         WHERE tipo = 'GASTO' 
     """
     params = []
@@ -164,55 +822,459 @@ def obtener_totales_por_categoria(mes, año):
     query += """
         GROUP BY categoria
     """
-    cursor.execute(query, tuple(params))
-    totales = {row['categoria']: row['total'] for row in cursor.fetchall()}
-    conn.close()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, tuple(params))
+        totales = {row['categoria']: row['total'] for row in cursor.fetchall()}
     return totales
 
-def buscar_transacciones(termino_busqueda):
-    """Busca transacciones cuyo concepto contenga un término de búsqueda."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM transacciones WHERE concepto LIKE ? ORDER BY fecha DESC", (f'%{termino_busqueda}%',))
-    transacciones = [dict(row) for row in cursor.fetchall()]
-    conn.close()
-    return transacciones
+# Columnas admitidas por consultar_agregados (los nombres se interpolan en el SQL)
+COLUMNAS_CONSULTABLES = ('id', 'fecha', 'concepto', 'importe', 'categoria', 'tipo', 'mes', 'año', 'saldo_posterior', 'notas')
+
+# Funciones de agregación disponibles; TOTAL devuelve 0.0 (y no NULL) cuando no hay filas
+FUNCIONES_AGREGADAS = {
+    'suma': 'TOTAL({})',
+    'cuenta': 'COUNT({})',
+    'maximo': 'MAX({})',
+}
+
+OPERADORES_FILTRO = ('=', '!=', '<', '<=', '>', '>=')
+
+def consultar_agregados(agregados=None, columnas=(), filtros=(), agrupar_por=(), ordenar_por=(), limite=None):
+    """
+    Construye y ejecuta una consulta sobre transacciones para que SQLite haga las sumas, cuentas,
+    agrupaciones y ordenaciones y a Python solo lleguen los resultados.
+
+    Args:
+        agregados: dict alias -> (función, columna), p. ej. {'total': ('suma', 'importe')};
+            funciones en FUNCIONES_AGREGADAS ('cuenta' admite la columna '*')
+        columnas: columnas sin agregar a devolver ('*' para todas)
+        filtros: lista de (columna, operador, valor)
+        agrupar_por: columnas del GROUP BY
+        ordenar_por: columnas o alias del ORDER BY; con prefijo '-' para orden descendente
+        limite: número máximo de filas
+
+    Returns:
+        Lista de dicts, una por fila del resultado ([] si hay un error de base de datos)
+    """
+    agregados = agregados or {}
+
+    def comprobar(columna, admitidas=COLUMNAS_CONSULTABLES):
+        if columna not in admitidas:
+            raise ValueError(f"Columna no válida: {columna}")
+        return columna
+
+    seleccion = [c if c == '*' else comprobar(c) for c in columnas]
+    for alias, (funcion, columna) in agregados.items():
+        if funcion not in FUNCIONES_AGREGADAS or not alias.isidentifier():
+            raise ValueError(f"Agregado no válido: {alias} = {funcion}({columna})")
+        if not (columna == '*' and funcion == 'cuenta'):
+            comprobar(columna)
+        seleccion.append(f"{FUNCIONES_AGREGADAS[funcion].format(columna)} AS {alias}")
+    if not seleccion:
+        raise ValueError("La consulta no selecciona ninguna columna")
+
+    query = f"SELECT {', '.join(seleccion)} FROM transacciones"
+    params = []
+    condiciones = []
+    for columna, operador, valor in filtros:
+        comprobar(columna)
+        if operador not in OPERADORES_FILTRO:
+            raise ValueError(f"Operador no válido: {operador}")
+        condiciones.append(f"{columna} {operador} ?")
+        params.append(valor)
+    if condiciones:
+        query += " WHERE " + " AND ".join(condiciones)
+    if agrupar_por:
+        query += " GROUP BY " + ", ".join(comprobar(c) for c in agrupar_por)
+    if ordenar_por:
+        ordenables = COLUMNAS_CONSULTABLES + tuple(agregados)
+        orden = [f"{comprobar(c.lstrip('-'), ordenables)}{' DESC' if c.startswith('-') else ''}" for c in ordenar_por]
+        query += " ORDER BY " + ", ".join(orden)
+    if limite is not None:
+        query += " LIMIT ?"
+        params.append(int(limite))
+
+    with conexion() as conn:
+        try:
+            return [dict(row) for row in conn.execute(query, params).fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error en la consulta agregada: {e}")
+            return []
+
+def obtener_resumen_mensual(mes=None, año=None, desde=None):
+    """
+    Obtiene las filas de resumen_mensual (año, mes, tipo, categoria, total, n),
+    opcionalmente filtradas por mes y/o año o desde un periodo (año, mes) en adelante.
+    """
+    query = "SELECT año, mes, tipo, NULLIF(categoria, '') AS categoria, total, n FROM resumen_mensual"
+    params = []
+    where_clauses = []
+    if mes:
+        where_clauses.append("mes = ?")
+        params.append(mes)
+    if año:
+        where_clauses.append("año = ?")
+        params.append(año)
+    if desde:
+        where_clauses.append("año * 12 + mes >= ?")
+        params.append(desde[0] * 12 + desde[1])
+
+    if where_clauses:
+        query += " WHERE " + " AND ".join(where_clauses)
+    query += " ORDER BY año, mes, tipo, categoria"
+
+    with conexion() as conn:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        resumen = [dict(row) for row in cursor.fetchall()]
+    return resumen
+
+def obtener_panel_mensual(desde=None, hasta=None):
+    """
+    Obtiene en una sola consulta, para cada periodo (año, mes) entre `desde` y `hasta` (ambos
+    incluidos, tuplas (año, mes) o None para no acotar), las filas de resumen_mensual
+    (tipo, categoria, total, n) junto con los días distintos con algún gasto en ese periodo.
+    """
+    rango_resumen = ["r.año > 0", "r.mes BETWEEN 1 AND 12"]
+    rango_gastos = ["tipo = 'GASTO'"]
+    params_gastos = []
+    params_resumen = []
+    if desde:
+        rango_gastos.append("(año, mes) >= (?, ?)")
+        params_gastos.extend(desde)
+        rango_resumen.append("(r.año, r.mes) >= (?, ?)")
+        params_resumen.extend(desde)
+    if hasta:
+        rango_gastos.append("(año, mes) <= (?, ?)")
+        params_gastos.extend(hasta)
+        rango_resumen.append("(r.año, r.mes) <= (?, ?)")
+        params_resumen.extend(hasta)
+
+    query = f"""
+        WITH dias AS (
+            SELECT año, mes, COUNT(DISTINCT DATE(fecha)) AS dias_con_gasto
+            FROM transacciones
+            WHERE {' AND '.join(rango_gastos)}
+            GROUP BY año, mes
+        )
+        SELECT r.año, r.mes, r.tipo, NULLIF(r.categoria, '') AS categoria, r.total, r.n,
+               IFNULL(d.dias_con_gasto, 0) AS dias_con_gasto
+        FROM resumen_mensual r
+        LEFT JOIN dias d ON d.año = r.año AND d.mes = r.mes
+        WHERE {' AND '.join(rango_resumen)}
+        ORDER BY r.año, r.mes, r.tipo, r.categoria
+    """
+    with conexion() as conn:
+        try:
+            return [dict(row) for row in conn.execute(query, params_gastos + params_resumen).fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error al obtener el panel mensual: {e}")
+            return []
+
+def reconstruir_resumen_mensual():
+    """Recalcula resumen_mensual desde cero a partir de todas las transacciones."""
+    try:
+        with conexion() as conn:
+            if not conn.in_transaction:
+                conn.execute("BEGIN")
+            for sentencia in REBUILD_MONTHLY_SUMMARY:
+                conn.execute(sentencia)
+        return True
+    except sqlite3.Error as e:
+        print(f"Error al reconstruir el resumen mensual: {e}")
+        return False
+
+# Longitud mínima de un término para buscarlo en el índice trigram (los más cortos usan LIKE)
+MIN_LONGITUD_BUSQUEDA_INDEXADA = 3
+
+def _indice_busqueda_disponible(conn):
+    """Indica si existe el índice de texto completo (puede faltar si SQLite no soporta FTS5 trigram)."""
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'transacciones_fts'").fetchone() is not None
+
+def _frase_fts(texto):
+    """Escapa un texto como frase literal de una consulta FTS5."""
+    return '"' + texto.replace('"', '""') + '"'
+
+def buscar_transacciones(termino_busqueda, desde=None, hasta=None, categoria=None, limite=None):
+    """
+    Busca transacciones cuyo concepto o notas contengan todas las palabras del término de búsqueda
+    (sin distinguir mayúsculas), opcionalmente entre dos fechas y para una categoría.
+    Usa el índice de texto completo y ordena por relevancia y fecha; los términos de menos de
+    3 caracteres, o todos si no hay índice, se buscan con LIKE.
+    """
+    terminos = termino_busqueda.split()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        con_indice = _indice_busqueda_disponible(conn)
+        indexados = [t for t in terminos if con_indice and len(t) >= MIN_LONGITUD_BUSQUEDA_INDEXADA]
+
+        filtros = []
+        params = []
+        if indexados:
+            query = (
+                "SELECT t.* FROM transacciones_fts JOIN transacciones t ON t.rowid = transacciones_fts.rowid "
+                "WHERE transacciones_fts MATCH ?"
+            )
+            params.append(' '.join(_frase_fts(t) for t in indexados))
+            orden = " ORDER BY transacciones_fts.rank, t.fecha DESC"
+        else:
+            query = "SELECT t.* FROM transacciones t WHERE 1 = 1"
+            orden = " ORDER BY t.fecha DESC"
+
+        for termino in terminos:
+            if termino not in indexados:
+                filtros.append("(t.concepto LIKE ? OR t.notas LIKE ?)")
+                params.extend([f'%{termino}%'] * 2)
+        if desde:
+            filtros.append("t.fecha >= ?")
+            params.append(desde)
+        if hasta:
+            filtros.append("t.fecha <= ?")
+            params.append(hasta)
+        if categoria:
+            filtros.append("t.categoria = ?")
+            params.append(categoria)
+
+        query += ''.join(f" AND {filtro}" for filtro in filtros) + orden
+        if limite:
+            query += " LIMIT ?"
+            params.append(limite)
+
+        try:
+            cursor.execute(query, params)
+            return [dict(row) for row in cursor.fetchall()]
+        except sqlite3.Error as e:
+            print(f"Error al buscar transacciones: {e}")
+            return []
+
+def reconstruir_indice_busqueda():
+    """Recalcula el índice de texto completo desde transacciones (p. ej. tras un VACUUM, que puede renumerar los rowid)."""
+    with conexion() as conn:
+        try:
+            if not _indice_busqueda_disponible(conn):
+                return False
+            conn.execute(REBUILD_SEARCH_INDEX)
+            return True
+        except sqlite3.Error as e:
+            print(f"Error al reconstruir el índice de búsqueda: {e}")
+            return False
+
+def crear_trabajo_importacion(archivos, nombres, omitir_duplicados=True):
+    """Registra un trabajo de importación pendiente y retorna su ID."""
+    id_trabajo = generar_uuid()
+    with conexion() as conn:
+        try:
+            conn.execute(
+                "INSERT INTO trabajos_importacion (id, archivos, nombres, omitir_duplicados) VALUES (?, ?, ?, ?)",
+                (id_trabajo, json.dumps(archivos), json.dumps(nombres, ensure_ascii=False), int(omitir_duplicados))
+            )
+            return id_trabajo
+        except sqlite3.Error as e:
+            print(f"Error al crear el trabajo de importación: {e}")
+            return None
+
+def _trabajo_desde_fila(fila):
+    trabajo = dict(fila)
+    for campo in ('archivos', 'nombres', 'duplicados'):
+        if trabajo[campo] is not None:
+            trabajo[campo] = json.loads(trabajo[campo])
+    trabajo['omitir_duplicados'] = bool(trabajo['omitir_duplicados'])
+    return trabajo
+
+def obtener_trabajo_importacion(id_trabajo):
+    """Obtiene un trabajo de importación por su ID, o None si no existe."""
+    with conexion() as conn:
+        fila = conn.execute("SELECT * FROM trabajos_importacion WHERE id = ?", (id_trabajo,)).fetchone()
+    return _trabajo_desde_fila(fila) if fila else None
+
+def obtener_trabajos_importacion(estados=None, limite=None):
+    """Obtiene los trabajos de importación, los más recientes primero, opcionalmente filtrados por estado."""
+    query = "SELECT * FROM trabajos_importacion"
+    params = []
+    if estados:
+        query += f" WHERE estado IN ({', '.join('?' * len(estados))})"
+        params.extend(estados)
+    query += " ORDER BY created_at DESC, rowid DESC"
+    if limite:
+        query += " LIMIT ?"
+        params.append(limite)
+    with conexion() as conn:
+        return [_trabajo_desde_fila(fila) for fila in conn.execute(query, params).fetchall()]
+
+def actualizar_trabajo_importacion(id_trabajo, **campos):
+    """
+    Actualiza campos de un trabajo de importación. Los campos 'insertadas', 'ignoradas', 'errores'
+    y 'procesadas' pueden pasarse como incremento con el sufijo '_mas' (p. ej. insertadas_mas=10).
+    Dentro de un bloque conexion() abierto se confirma junto con el resto de la transacción.
+    """
+    asignaciones = []
+    params = []
+    for campo, valor in campos.items():
+        if campo.endswith('_mas'):
+            campo = campo[:-len('_mas')]
+            asignaciones.append(f"{campo} = {campo} + ?")
+        else:
+            asignaciones.append(f"{campo} = ?")
+            if campo == 'duplicados' and valor is not None:
+                valor = json.dumps(valor)
+        params.append(valor)
+    asignaciones.append("updated_at = CURRENT_TIMESTAMP")
+    with conexion() as conn:
+        try:
+            cursor = conn.execute(f"UPDATE trabajos_importacion SET {', '.join(asignaciones)} WHERE id = ?", params + [id_trabajo])
+            return cursor.rowcount > 0
+        except sqlite3.Error as e:
+            print(f"Error al actualizar el trabajo de importación: {e}")
+            return False
 
 def resetear_base_de_datos():
     """Elimina todas las tablas y las vuelve a crear, limpiando la base de datos."""
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.executescript("""DROP TABLE IF EXISTS transacciones;""")
-        crear_tablas()
-        conn.close()
+        with conexion() as conn:
+            cursor = conn.cursor()
+            cursor.executescript("""
+                DROP TABLE IF EXISTS transacciones;
+                DROP TABLE IF EXISTS resumen_mensual;
+                DROP TABLE IF EXISTS transacciones_fts;
+                DROP TABLE IF EXISTS trabajos_importacion;
+                DROP TABLE IF EXISTS recalculo_saldos;
+                DROP TABLE IF EXISTS saldos_diarios;
+                DROP TABLE IF EXISTS schema_version;
+            """)
+            crear_tablas()
+        marcar_datos_modificados()
     except Exception as e:
         print(f"Error al resetear la base de datos: {e}")
 
 def calcular_balance_total():
     """Calcula la suma total de todos los importes en la base de datos."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT SUM(importe) FROM transacciones")
-        resultado = cursor.fetchone()[0]
-        return resultado if resultado is not None else 0.0
-    except sqlite3.Error as e:
-        print(f"Error al calcular el balance total: {e}")
+    with conexion() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT SUM(importe) FROM transacciones")
+            resultado = cursor.fetchone()[0]
+            return resultado if resultado is not None else 0.0
+        except sqlite3.Error as e:
+            print(f"Error al calcular el balance total: {e}")
+            return 0.0
+
+def _actualizar_saldos(conn):
+    """
+    Recalcula saldo_calculado y saldos_diarios desde el punto más antiguo anotado por los triggers
+    hasta el final. conexion() la llama antes de confirmar cualquier bloque que haya escrito, dentro
+    de su misma transacción; si no se tocaron transacciones es una única lectura.
+    """
+    if conn.execute("SELECT 1 FROM recalculo_saldos").fetchone() is None:
+        return
+    if not conn.in_transaction:
+        # Con el bloqueo de escritura tomado, ninguna otra conexión puede mover el punto mientras tanto
+        conn.execute("BEGIN IMMEDIATE")
+    punto = conn.execute("SELECT fecha, id_transaccion FROM recalculo_saldos WHERE id = 1").fetchone()
+    if punto is None:
+        return
+    anterior = conn.execute(
+        "SELECT saldo_calculado FROM transacciones WHERE (fecha, id) < (?, ?) ORDER BY fecha DESC, id DESC LIMIT 1",
+        tuple(punto)
+    ).fetchone()
+    base = anterior[0] if anterior and anterior[0] is not None else 0.0
+    conn.execute(ACTUALIZAR_SALDO_CALCULADO, (base, punto[0], punto[1]))
+
+    # Los días se rehacen completos desde el del punto
+    dia = str(punto[0])[:10]
+    anterior = conn.execute("SELECT saldo FROM saldos_diarios WHERE fecha < ? ORDER BY fecha DESC LIMIT 1", (dia,)).fetchone()
+    base_dia = anterior[0] if anterior else 0.0
+    borrar, insertar = ACTUALIZAR_SALDOS_DIARIOS
+    conn.execute(borrar, (dia,))
+    conn.execute(insertar, (base_dia, dia))
+    conn.execute("DELETE FROM recalculo_saldos")
+
+def _ajuste_saldo(conn):
+    """
+    Diferencia entre el saldo disponible (saldo_posterior de la última transacción, como
+    obtener_ultimo_saldo) y su saldo_calculado: el saldo que había antes de la primera transacción.
+    """
+    fila = conn.execute(
+        "SELECT saldo_posterior, saldo_calculado FROM transacciones ORDER BY fecha DESC, id DESC LIMIT 1"
+    ).fetchone()
+    if fila is None:
         return 0.0
-    finally:
-        conn.close()
+    return (fila['saldo_posterior'] or 0.0) - (fila['saldo_calculado'] or 0.0)
+
+def saldo_en(fecha):
+    """
+    Obtiene el saldo disponible al cierre de `fecha`, cuadrado con el último saldo del banco.
+    Lee un único día de saldos_diarios (el último con movimientos hasta esa fecha) por su clave.
+    Si la lectura falla lanza sqlite3.Error: un 0.0 pasaría por un saldo real.
+    """
+    with conexion() as conn:
+        fila = conn.execute(
+            "SELECT saldo FROM saldos_diarios WHERE fecha <= ? ORDER BY fecha DESC LIMIT 1", (str(fecha)[:10],)
+        ).fetchone()
+        saldo = fila['saldo'] if fila else 0.0
+        return round(saldo + _ajuste_saldo(conn), 2)
+
+def saldos_entre(desde=None, hasta=None):
+    """
+    Obtiene el cierre de cada día con movimientos entre dos fechas (incluidas; None no acota):
+    lista de dicts (fecha, saldo, ingresos, gastos, n) en orden de fecha, con el saldo disponible
+    cuadrado con el último saldo del banco. Si la lectura falla lanza sqlite3.Error (una lista
+    vacía se confundiría con un periodo sin movimientos).
+    """
+    filtros = []
+    params = []
+    if desde:
+        filtros.append("fecha >= ?")
+        params.append(str(desde)[:10])
+    if hasta:
+        filtros.append("fecha <= ?")
+        params.append(str(hasta)[:10])
+    query = "SELECT fecha, saldo, ingresos, gastos, n FROM saldos_diarios"
+    if filtros:
+        query += " WHERE " + " AND ".join(filtros)
+    query += " ORDER BY fecha"
+
+    with conexion() as conn:
+        ajuste = _ajuste_saldo(conn)
+        dias = [dict(fila) for fila in conn.execute(query, params).fetchall()]
+    for dia in dias:
+        dia['saldo'] = round(dia['saldo'] + ajuste, 2)
+    return dias
+
+def obtener_curva_saldo(desde=None, hasta=None):
+    """
+    Obtiene la evolución del saldo disponible transacción a transacción entre dos días (incluidos):
+    lista de dicts (fecha, importe, saldo) en orden (fecha, id), leída por rango del índice (fecha, id).
+    Como saldos_entre, si la lectura falla lanza sqlite3.Error.
+    """
+    filtros = []
+    params = []
+    if desde:
+        filtros.append("fecha >= ?")
+        params.append(str(desde)[:10])
+    if hasta:
+        filtros.append("fecha < DATE(?, '+1 day')")
+        params.append(str(hasta)[:10])
+    query = "SELECT fecha, importe, saldo_calculado FROM transacciones"
+    if filtros:
+        query += " WHERE " + " AND ".join(filtros)
+    query += " ORDER BY fecha, id"
+
+    with conexion() as conn:
+        ajuste = _ajuste_saldo(conn)
+        return [
+            {'fecha': fila['fecha'], 'importe': fila['importe'], 'saldo': round(fila['saldo_calculado'] + ajuste, 2)}
+            for fila in conn.execute(query, params).fetchall()
+        ]
 
 def obtener_ultimo_saldo():
     """Obtiene el saldo_posterior de la transacción más reciente."""
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    try:
-        cursor.execute("SELECT saldo_posterior FROM transacciones ORDER BY fecha DESC, id DESC LIMIT 1")
-        resultado = cursor.fetchone()
-        return resultado['saldo_posterior'] if resultado and resultado['saldo_posterior'] is not None else 0.0
-    except (sqlite3.Error, TypeError) as e:
-        print(f"Error al obtener el último saldo: {e}")
-        return 0.0
-    finally:
-        conn.close()
+    with conexion() as conn:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT saldo_posterior FROM transacciones ORDER BY fecha DESC, id DESC LIMIT 1")
+            resultado = cursor.fetchone()
+            return resultado['saldo_posterior'] if resultado and resultado['saldo_posterior'] is not None else 0.0
+        except (sqlite3.Error, TypeError) as e:
+            print(f"Error al obtener el último saldo: {e}")
+            return 0.0
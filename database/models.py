@@ -1,6 +1,9 @@
 
 # database/models.py
 
+import hashlib
+import sqlite3
+
 # Sentencia SQL para crear la tabla de transacciones
 CREATE_TRANSACTIONS_TABLE = """
 CREATE TABLE IF NOT EXISTS transacciones (
@@ -39,9 +42,309 @@ CREATE TABLE IF NOT EXISTS reglas_clasificacion (
 );
 """
 
+# Sentencia SQL para crear la tabla que registra las migraciones aplicadas
+CREATE_SCHEMA_VERSION_TABLE = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    version INTEGER PRIMARY KEY,
+    descripcion TEXT NOT NULL,
+    aplicada_en TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Sentencia SQL para crear la tabla de resúmenes mensuales (agregados de transacciones).
+# Se mantiene al día con triggers sobre transacciones; las categorías nulas se guardan como ''.
+CREATE_MONTHLY_SUMMARY_TABLE = """
+CREATE TABLE IF NOT EXISTS resumen_mensual (
+    año INTEGER NOT NULL,
+    mes INTEGER NOT NULL,
+    tipo TEXT NOT NULL,
+    categoria TEXT NOT NULL DEFAULT '',
+    total REAL NOT NULL DEFAULT 0,
+    n INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (año, mes, tipo, categoria)
+) WITHOUT ROWID;
+"""
+
+# Triggers que trasladan cada alta, baja o modificación de transacciones a resumen_mensual
+_SUMAR_AL_RESUMEN = """
+    INSERT INTO resumen_mensual (año, mes, tipo, categoria, total, n)
+    VALUES (IFNULL(NEW.año, 0), IFNULL(NEW.mes, 0), NEW.tipo, IFNULL(NEW.categoria, ''), NEW.importe, 1)
+    ON CONFLICT (año, mes, tipo, categoria) DO UPDATE SET total = total + excluded.total, n = n + 1;
+"""
+_RESTAR_DEL_RESUMEN = """
+    UPDATE resumen_mensual SET total = total - OLD.importe, n = n - 1
+    WHERE año = IFNULL(OLD.año, 0) AND mes = IFNULL(OLD.mes, 0) AND tipo = OLD.tipo AND categoria = IFNULL(OLD.categoria, '');
+    DELETE FROM resumen_mensual
+    WHERE año = IFNULL(OLD.año, 0) AND mes = IFNULL(OLD.mes, 0) AND tipo = OLD.tipo AND categoria = IFNULL(OLD.categoria, '') AND n <= 0;
+"""
+
+CREATE_MONTHLY_SUMMARY_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_resumen_mensual_insert AFTER INSERT ON transacciones
+    BEGIN {_SUMAR_AL_RESUMEN} END;
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_resumen_mensual_delete AFTER DELETE ON transacciones
+    BEGIN {_RESTAR_DEL_RESUMEN} END;
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_resumen_mensual_update AFTER UPDATE OF importe, tipo, categoria, mes, año ON transacciones
+    BEGIN {_RESTAR_DEL_RESUMEN} {_SUMAR_AL_RESUMEN} END;
+    """,
+]
+
+# Sentencias para recalcular resumen_mensual desde cero a partir de transacciones
+REBUILD_MONTHLY_SUMMARY = [
+    "DELETE FROM resumen_mensual",
+    """
+    INSERT INTO resumen_mensual (año, mes, tipo, categoria, total, n)
+    SELECT IFNULL(año, 0), IFNULL(mes, 0), tipo, IFNULL(categoria, ''), SUM(importe), COUNT(*)
+    FROM transacciones
+    GROUP BY IFNULL(año, 0), IFNULL(mes, 0), tipo, IFNULL(categoria, '')
+    """,
+]
+
+# Saldo acumulado por transacción (saldo_calculado = suma de importes hasta ella, en orden (fecha, id)).
+# Los triggers solo anotan en recalculo_saldos la clave (fecha, id) más antigua afectada por un alta,
+# baja o cambio de fecha/importe; db_manager recalcula desde ahí en adelante antes de leer saldos,
+# de modo que una importación de miles de filas no reescribe la cola de la tabla fila a fila.
+CREATE_BALANCE_WATERMARK_TABLE = """
+CREATE TABLE IF NOT EXISTS recalculo_saldos (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    fecha TEXT NOT NULL,
+    id_transaccion TEXT NOT NULL
+);
+"""
+
+def _marcar_recalculo(fila):
+    """Sentencia de trigger que adelanta el punto de recálculo hasta la clave de NEW u OLD."""
+    return f"""
+    INSERT INTO recalculo_saldos (id, fecha, id_transaccion) VALUES (1, {fila}.fecha, {fila}.id)
+    ON CONFLICT (id) DO UPDATE SET fecha = excluded.fecha, id_transaccion = excluded.id_transaccion
+    WHERE (excluded.fecha, excluded.id_transaccion) < (recalculo_saldos.fecha, recalculo_saldos.id_transaccion);
+"""
+
+CREATE_BALANCE_TRIGGERS = [
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_insert AFTER INSERT ON transacciones
+    BEGIN {_marcar_recalculo('NEW')} END;
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_delete AFTER DELETE ON transacciones
+    BEGIN {_marcar_recalculo('OLD')} END;
+    """,
+    f"""
+    CREATE TRIGGER IF NOT EXISTS trg_saldos_update AFTER UPDATE OF fecha, importe, id ON transacciones
+    BEGIN {_marcar_recalculo('OLD')} {_marcar_recalculo('NEW')} END;
+    """,
+]
+
+# Recalcula saldo_calculado desde la clave (fecha, id) indicada hasta el final, partiendo del saldo
+# de la transacción anterior. Parámetros: saldo base, fecha, id.
+ACTUALIZAR_SALDO_CALCULADO = """
+UPDATE transacciones SET saldo_calculado = recalculo.saldo
+FROM (
+    SELECT id, ROUND(? + SUM(importe) OVER (ORDER BY fecha, id ROWS UNBOUNDED PRECEDING), 2) AS saldo
+    FROM transacciones
+    WHERE (fecha, id) >= (?, ?)
+) AS recalculo
+WHERE transacciones.id = recalculo.id AND transacciones.saldo_calculado IS NOT recalculo.saldo
+"""
+
+# Cierre de cada día con movimientos: saldo acumulado al final del día (el saldo_calculado de su
+# última transacción) e ingresos, gastos y número de transacciones del día. Se rehace desde el
+# mismo punto de recalculo_saldos que saldo_calculado; el cambio de tipo también lo marca.
+CREATE_DAILY_BALANCE_TABLE = """
+CREATE TABLE IF NOT EXISTS saldos_diarios (
+    fecha TEXT PRIMARY KEY,
+    saldo REAL NOT NULL,
+    ingresos REAL NOT NULL DEFAULT 0,
+    gastos REAL NOT NULL DEFAULT 0,
+    n INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+CREATE_DAILY_BALANCE_TRIGGER = f"""
+CREATE TRIGGER IF NOT EXISTS trg_saldos_diarios_update_tipo AFTER UPDATE OF tipo ON transacciones
+BEGIN {_marcar_recalculo('NEW')} END;
+"""
+
+# Rehace los días desde el indicado (incluido), encadenando su saldo con el del día anterior.
+# Parámetros: día desde el que borrar, saldo base, día desde el que recalcular.
+ACTUALIZAR_SALDOS_DIARIOS = [
+    "DELETE FROM saldos_diarios WHERE fecha >= ?",
+    """
+    INSERT INTO saldos_diarios (fecha, saldo, ingresos, gastos, n)
+    SELECT DATE(fecha),
+           ROUND(? + SUM(SUM(importe)) OVER (ORDER BY DATE(fecha)), 2),
+           TOTAL(CASE WHEN tipo = 'INGRESO' THEN importe END),
+           TOTAL(CASE WHEN tipo = 'GASTO' THEN importe END),
+           COUNT(*)
+    FROM transacciones
+    WHERE fecha >= ? AND DATE(fecha) IS NOT NULL
+    GROUP BY DATE(fecha)
+    """,
+]
+
+# Sentencia SQL para crear la tabla de trabajos de importación en segundo plano.
+# Guarda lo necesario para mostrar el progreso y reanudar un trabajo tras un reinicio.
+CREATE_IMPORT_JOBS_TABLE = """
+CREATE TABLE IF NOT EXISTS trabajos_importacion (
+    id TEXT PRIMARY KEY,
+    estado TEXT NOT NULL DEFAULT 'pendiente', -- 'pendiente', 'leyendo', 'importando', 'completado' o 'error'
+    archivos TEXT NOT NULL,                   -- JSON: rutas de los archivos subidos guardados en disco
+    nombres TEXT NOT NULL,                    -- JSON: nombres originales de los archivos
+    omitir_duplicados INTEGER NOT NULL DEFAULT 1,
+    duplicados TEXT,                          -- JSON: posiciones omitidas por duplicadas, fijadas en la primera ejecución
+    total INTEGER NOT NULL DEFAULT 0,
+    procesadas INTEGER NOT NULL DEFAULT 0,
+    insertadas INTEGER NOT NULL DEFAULT 0,
+    ignoradas INTEGER NOT NULL DEFAULT 0,
+    errores INTEGER NOT NULL DEFAULT 0,
+    mensaje_error TEXT,
+    inicio_ejecucion REAL,                    -- time.time() al arrancar la ejecución actual
+    procesadas_al_iniciar INTEGER NOT NULL DEFAULT 0,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+# Índice de texto completo (FTS5) sobre concepto y notas, con el contenido en la propia tabla
+# transacciones (enlazado por rowid). El tokenizador trigram permite buscar cualquier subcadena
+# de 3 o más caracteres sin distinguir mayúsculas, igual que LIKE '%término%' pero usando índice.
+CREATE_SEARCH_INDEX = """
+CREATE VIRTUAL TABLE IF NOT EXISTS transacciones_fts USING fts5(
+    concepto, notas,
+    content='transacciones', content_rowid='rowid', tokenize='trigram'
+);
+"""
+
+CREATE_SEARCH_INDEX_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_transacciones_fts_insert AFTER INSERT ON transacciones BEGIN
+        INSERT INTO transacciones_fts (rowid, concepto, notas) VALUES (NEW.rowid, NEW.concepto, NEW.notas);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_transacciones_fts_delete AFTER DELETE ON transacciones BEGIN
+        INSERT INTO transacciones_fts (transacciones_fts, rowid, concepto, notas) VALUES ('delete', OLD.rowid, OLD.concepto, OLD.notas);
+    END;
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS trg_transacciones_fts_update AFTER UPDATE OF concepto, notas ON transacciones BEGIN
+        INSERT INTO transacciones_fts (transacciones_fts, rowid, concepto, notas) VALUES ('delete', OLD.rowid, OLD.concepto, OLD.notas);
+        INSERT INTO transacciones_fts (rowid, concepto, notas) VALUES (NEW.rowid, NEW.concepto, NEW.notas);
+    END;
+    """,
+]
+
+# Recalcula el índice de texto completo a partir de transacciones
+REBUILD_SEARCH_INDEX = "INSERT INTO transacciones_fts (transacciones_fts) VALUES ('rebuild')"
+
+def _crear_indice_busqueda(conn):
+    """
+    Crea el índice de texto completo y sus triggers. Si esta versión de SQLite no incluye FTS5
+    con el tokenizador trigram (SQLite < 3.34), se omite y las búsquedas siguen usando LIKE.
+    """
+    try:
+        conn.execute(CREATE_SEARCH_INDEX)
+    except sqlite3.OperationalError as e:
+        print(f"Índice de búsqueda no disponible ({e}); las búsquedas usarán LIKE.")
+        return
+    for trigger_sql in CREATE_SEARCH_INDEX_TRIGGERS:
+        conn.execute(trigger_sql)
+    conn.execute(REBUILD_SEARCH_INDEX)
+
+def contenido_huella(fecha, importe, concepto, saldo_posterior):
+    """
+    Contenido normalizado de un movimiento a partir del que se calcula su huella: fecha como
+    'YYYY-MM-DD', importes con dos decimales y concepto en mayúsculas sin espacios repetidos.
+    """
+    def _numero(valor):
+        # None y NaN (valor != valor) se tratan como vacío
+        return '' if valor is None or valor != valor else f"{float(valor):.2f}"
+
+    concepto = ' '.join(str(concepto).split()).upper() if concepto is not None else ''
+    return (str(fecha)[:10], _numero(importe), concepto, _numero(saldo_posterior))
+
+def calcular_huella(contenido, ocurrencia=0):
+    """
+    Huella de un movimiento: hash del contenido normalizado y del número de ocurrencia, que
+    distingue movimientos idénticos (p. ej. dos cafés iguales el mismo día) dentro de un extracto.
+    """
+    return hashlib.sha256('|'.join((*contenido, str(ocurrencia))).encode('utf-8')).hexdigest()
+
+def _rellenar_huellas(conn):
+    """Calcula la huella de las transacciones existentes, numerando las repetidas por orden de alta."""
+    ocurrencias = {}
+    cambios = []
+    filas = conn.execute(
+        "SELECT id, fecha, importe, concepto, saldo_posterior FROM transacciones ORDER BY fecha, created_at, rowid"
+    )
+    for id_transaccion, fecha, importe, concepto, saldo_posterior in filas:
+        contenido = contenido_huella(fecha, importe, concepto, saldo_posterior)
+        ocurrencia = ocurrencias.get(contenido, 0)
+        ocurrencias[contenido] = ocurrencia + 1
+        cambios.append((calcular_huella(contenido, ocurrencia), id_transaccion))
+    conn.executemany("UPDATE transacciones SET huella = ? WHERE id = ?", cambios)
+
 # Lista de todas las sentencias de creación de tablas
 ALL_TABLES = [
     CREATE_TRANSACTIONS_TABLE,
     CREATE_CUSTOM_CATEGORIES_TABLE,
-    CREATE_CLASSIFICATION_RULES_TABLE
+    CREATE_CLASSIFICATION_RULES_TABLE,
+    CREATE_SCHEMA_VERSION_TABLE
+]
+
+# Migraciones del esquema, en orden. Cada una es una tupla (versión, descripción, pasos),
+# donde cada paso es una sentencia SQL o una función que recibe la conexión.
+# Nunca se debe modificar una migración ya publicada: los cambios van en una versión nueva.
+MIGRACIONES = [
+    (1, "Índices para consultas por periodo, fecha y detección de duplicados", [
+        # Totales por mes/año, tipo y categoría sin tocar la tabla (índice cubriente)
+        "CREATE INDEX IF NOT EXISTS idx_transacciones_periodo ON transacciones (año, mes, tipo, categoria, importe)",
+        # Rangos de fechas y comprobación de duplicados por (fecha, importe);
+        # también sirve para las consultas que solo filtran u ordenan por fecha
+        "CREATE INDEX IF NOT EXISTS idx_transacciones_fecha_importe ON transacciones (fecha, importe)",
+    ]),
+    (2, "Tabla resumen_mensual mantenida con triggers", [
+        CREATE_MONTHLY_SUMMARY_TABLE,
+        *CREATE_MONTHLY_SUMMARY_TRIGGERS,
+        *REBUILD_MONTHLY_SUMMARY,
+    ]),
+    (3, "Huella de contenido con índice único para importaciones idempotentes", [
+        # La huella identifica el movimiento tal y como llegó del banco: se fija al insertarlo
+        # y no cambia si luego se edita, para que reimportar el mismo extracto no lo duplique
+        "ALTER TABLE transacciones ADD COLUMN huella TEXT",
+        _rellenar_huellas,
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_transacciones_huella ON transacciones (huella)",
+    ]),
+    (4, "Tabla de trabajos de importación en segundo plano", [
+        CREATE_IMPORT_JOBS_TABLE,
+        "CREATE INDEX IF NOT EXISTS idx_trabajos_importacion_estado ON trabajos_importacion (estado)",
+    ]),
+    (5, "Índice de texto completo FTS5 sobre concepto y notas", [
+        _crear_indice_busqueda,
+    ]),
+    (6, "Índice para la paginación por clave (fecha, id)", [
+        # Recorre las transacciones de la más reciente a la más antigua sin ordenar en memoria
+        "CREATE INDEX IF NOT EXISTS idx_transacciones_fecha_id ON transacciones (fecha, id)",
+    ]),
+    (7, "Saldo acumulado por transacción (saldo_calculado)", [
+        "ALTER TABLE transacciones ADD COLUMN saldo_calculado REAL",
+        CREATE_BALANCE_WATERMARK_TABLE,
+        *CREATE_BALANCE_TRIGGERS,
+        # Clave menor que cualquier otra: la primera lectura de saldos calcula toda la tabla
+        "INSERT OR REPLACE INTO recalculo_saldos (id, fecha, id_transaccion) VALUES (1, '', '')",
+    ]),
+    (8, "Tabla saldos_diarios con el cierre de cada día", [
+        CREATE_DAILY_BALANCE_TABLE,
+        CREATE_DAILY_BALANCE_TRIGGER,
+        # Se rellena entera en la siguiente lectura de saldos
+        "INSERT OR REPLACE INTO recalculo_saldos (id, fecha, id_transaccion) VALUES (1, '', '')",
+    ]),
+    (9, "Marca de categoría asignada a mano", [
+        # Las reclasificaciones automáticas al cambiar las reglas no tocan estas transacciones
+        "ALTER TABLE transacciones ADD COLUMN categoria_manual INTEGER NOT NULL DEFAULT 0",
+    ]),
 ]
@@ -3,67 +3,52 @@
 Script para reclasificar todas las transacciones existentes según las nuevas reglas.
 """
 
-import sqlite3
+import pandas as pd
+from database import db_manager
 from utils import categorizer
 
 def reclasificar_todas():
     """Reclasifica todas las transacciones en la base de datos."""
 
-    db_path = 'finanzas.db'
-
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
+        # Como al abrir la app: la base de datos puede no tener aún las últimas migraciones
+        db_manager.crear_tablas()
 
-        # Obtener todas las transacciones
-        cursor.execute("SELECT id, concepto, importe, categoria FROM transacciones")
-        transacciones = cursor.fetchall()
+        # Cargar las columnas necesarias directamente en un DataFrame, salvo las transacciones
+        # que tienen la categoría asignada a mano
+        df = db_manager.cargar_transacciones_df(columnas=['id', 'concepto', 'importe', 'categoria', 'categoria_manual'])
+        df = df[df['categoria_manual'] == 0].reset_index(drop=True)
+        # Como texto: la columna categórica no admite compararse con las categorías nuevas
+        df['categoria'] = df['categoria'].astype(object)
 
-        print(f"📊 Encontradas {len(transacciones)} transacciones en la base de datos")
+        print(f"📊 Encontradas {len(df)} transacciones en la base de datos")
         print("🔄 Reclasificando...\n")
 
+        # Clasificar todas las transacciones de una vez con las nuevas reglas
+        df['nueva_categoria'] = categorizer.clasificar_lote(df['concepto'], df['importe'])
+
         # Estadísticas
+        antes = df['categoria'].value_counts()
+        despues = df['nueva_categoria'].value_counts()
         stats = {
-            'FIJOS': {'antes': 0, 'despues': 0},
-            'DISFRUTE': {'antes': 0, 'despues': 0},
-            'EXTRAORDINARIOS': {'antes': 0, 'despues': 0},
-            'SIN_CLASIFICAR': {'antes': 0, 'despues': 0}
+            cat: {'antes': int(antes.get(cat, 0)), 'despues': int(despues.get(cat, 0))}
+            for cat in ['FIJOS', 'DISFRUTE', 'EXTRAORDINARIOS', 'SIN_CLASIFICAR']
         }
 
-        cambios = []
-        actualizadas = 0
-
-        for trans_id, concepto, importe, categoria_actual in transacciones:
-            # Contar categoría anterior
-            if categoria_actual:
-                stats[categoria_actual]['antes'] = stats.get(categoria_actual, {}).get('antes', 0) + 1
-
-            # Clasificar con nuevas reglas
-            nueva_categoria = categorizer.clasificar_transaccion(concepto, importe)
-
-            # Contar nueva categoría
-            stats[nueva_categoria]['despues'] = stats.get(nueva_categoria, {}).get('despues', 0) + 1
-
-            # Si cambió, registrar y actualizar
-            if nueva_categoria != categoria_actual:
-                cambios.append({
-                    'id': trans_id,
-                    'concepto': concepto[:50],
-                    'importe': importe,
-                    'antes': categoria_actual or 'None',
-                    'despues': nueva_categoria
-                })
-
-                # Actualizar en BD
-                cursor.execute(
-                    "UPDATE transacciones SET categoria = ? WHERE id = ?",
-                    (nueva_categoria, trans_id)
-                )
-                actualizadas += 1
-
-        # Commit de los cambios
-        conn.commit()
-        conn.close()
+        # Registrar y actualizar solo las que cambian
+        df_cambios = df[df['nueva_categoria'] != df['categoria']]
+        cambios = [
+            {
+                'id': fila.id,
+                'concepto': fila.concepto[:50],
+                'importe': fila.importe,
+                'antes': fila.categoria if pd.notna(fila.categoria) else 'None',
+                'despues': fila.nueva_categoria
+            }
+            for fila in df_cambios.itertuples(index=False)
+        ]
+        # Todas las actualizaciones en una única transacción
+        actualizadas = db_manager.actualizar_categorias_lote(zip(df_cambios['id'], df_cambios['nueva_categoria']))
 
         # Mostrar resultados
         print("=" * 80)
@@ -80,7 +65,7 @@ def reclasificar_todas():
             print(f"{cat:<20} {antes:<10} {despues:<10} {signo}{cambio:<10}")
 
         print("\n" + "=" * 80)
-        print(f"✅ TOTAL ACTUALIZADAS: {actualizadas}/{len(transacciones)} transacciones")
+        print(f"✅ TOTAL ACTUALIZADAS: {actualizadas}/{len(df)} transacciones")
         print("=" * 80)
 
         # Mostrar algunos ejemplos de cambios
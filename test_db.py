@@ -1,7 +1,10 @@
 # test_db.py
 
 import os
+import sqlite3
+import time
 from database import db_manager
+from utils import metrics, sync
 from datetime import date
 
 # --- Configuración de la prueba ---
@@ -20,6 +23,9 @@ def run_db_tests():
     # 1. Crear tablas
     print("\n1. Probando la creación de tablas...")
     db_manager.crear_tablas()
+    version_esquema = db_manager.obtener_version_esquema()
+    print(f"Versión del esquema: {version_esquema}")
+    assert version_esquema == db_manager.MIGRACIONES[-1][0], "Deberían haberse aplicado todas las migraciones"
 
     # 2. Insertar transacciones de ejemplo
     print("\n2. Probando la inserción de transacciones...")
@@ -105,6 +111,226 @@ def run_db_tests():
     resultados_busqueda = db_manager.buscar_transacciones('super')
     print(f"Resultados de búsqueda para 'super': {len(resultados_busqueda)} encontrados")
     assert len(resultados_busqueda) == 1, "La búsqueda debería encontrar 1 resultado"
+    assert len(db_manager.buscar_transacciones('SUPERMERCADO compra')) == 1, "La búsqueda no debería distinguir mayúsculas ni orden"
+    assert db_manager.buscar_transacciones('super', categoria='FIJOS') == [], "El filtro de categoría debería aplicarse"
+    assert len(db_manager.buscar_transacciones('super', desde=date(2024, 7, 1), hasta=date(2024, 7, 31))) == 1
+
+    # 8. Pool de conexiones
+    print("\n8. Probando el pool de conexiones...")
+    stats_pool = db_manager.estadisticas_pool()
+    print(f"Estadísticas del pool: {stats_pool}")
+    assert stats_pool['en_uso'] == 0, "No debería quedar ninguna conexión en uso"
+    assert stats_pool['reutilizadas'] > stats_pool['abiertas'], "Las conexiones deberían reutilizarse entre llamadas"
+
+    # 9. Inserción masiva en una única transacción
+    print("\n9. Probando la inserción masiva de transacciones...")
+    lote = [
+        {'fecha': date(2024, 8, 1), 'concepto': 'Gasolina', 'importe': -60.0, 'categoria': 'FIJOS', 'tipo': 'GASTO', 'mes': 8, 'año': 2024},
+        {'fecha': date(2024, 8, 2), 'concepto': 'Cine', 'importe': -12.0, 'categoria': 'DISFRUTE', 'tipo': 'GASTO', 'mes': 8, 'año': 2024},
+        {'id': id1, 'fecha': date(2024, 8, 3), 'concepto': 'ID repetido', 'importe': -1.0, 'categoria': 'DISFRUTE', 'tipo': 'GASTO', 'mes': 8, 'año': 2024},
+    ]
+    ids_lote, errores_lote = db_manager.insertar_transacciones_lote(lote, chunk_size=2)
+    print(f"IDs insertados: {ids_lote}, errores: {errores_lote}")
+    assert len(errores_lote) == 1 and errores_lote[0][0] == 2, "Solo la fila con ID repetido debería fallar"
+    assert ids_lote[2] is None and all(ids_lote[:2]), "Las filas válidas deberían tener ID"
+    assert len(db_manager.obtener_transacciones()) == 4, "Deberían quedar 4 transacciones tras el lote"
+
+    # 10. Resumen mensual mantenido por triggers
+    print("\n10. Probando el resumen mensual...")
+    resumen = db_manager.obtener_resumen_mensual(año=2024)
+    print(f"Resumen mensual 2024: {resumen}")
+    total_resumen = sum(r['total'] for r in resumen)
+    total_transacciones = sum(t['importe'] for t in db_manager.obtener_transacciones(año=2024))
+    assert abs(total_resumen - total_transacciones) < 1e-9, "El resumen debería coincidir con las transacciones"
+    assert db_manager.reconstruir_resumen_mensual(), "La reconstrucción del resumen debería funcionar"
+    assert db_manager.obtener_resumen_mensual(año=2024) == resumen, "La reconstrucción no debería cambiar el resumen"
+
+    # 11. Detección de duplicados en bloque
+    print("\n11. Probando la detección de duplicados...")
+    a_importar = [
+        {'fecha': date(2024, 8, 1), 'concepto': 'Gasolina', 'importe': -60.0},
+        {'fecha': date(2024, 8, 2), 'concepto': 'Otro cine', 'importe': -12.0},
+        {'fecha': date(2024, 8, 2), 'concepto': 'Cine', 'importe': -13.0},
+    ]
+    nuevas, duplicadas = db_manager.separar_duplicados(a_importar)
+    print(f"Nuevas: {len(nuevas)}, duplicadas: {len(duplicadas)}")
+    assert duplicadas == a_importar[:2], "Deberían detectarse como duplicadas las de misma fecha e importe"
+    assert all(db_manager.transaccion_existe(t['fecha'], t['importe']) == (t in duplicadas) for t in a_importar), "Debería coincidir con transaccion_existe"
+    _, duplicadas_contenido = db_manager.separar_duplicados(a_importar, por_contenido=True)
+    assert duplicadas_contenido == a_importar[:1], "Por contenido, el concepto distinto no debería ser duplicado"
+
+    # 12. Importación idempotente por huella
+    print("\n12. Probando la importación idempotente por huella...")
+    extracto = [
+        {'fecha': date(2024, 8, 1), 'concepto': 'Gasolina', 'importe': -60.0, 'tipo': 'GASTO', 'mes': 8, 'año': 2024},
+        {'fecha': date(2024, 8, 4), 'concepto': 'Café', 'importe': -1.5, 'tipo': 'GASTO', 'mes': 8, 'año': 2024},
+        {'fecha': date(2024, 8, 4), 'concepto': 'Café', 'importe': -1.5, 'tipo': 'GASTO', 'mes': 8, 'año': 2024},
+    ]
+    insertadas, ignoradas, errores_nuevas = db_manager.insertar_transacciones_nuevas(extracto)
+    print(f"Primera importación: {insertadas} insertadas, {ignoradas} ignoradas")
+    assert (insertadas, ignoradas, errores_nuevas) == (2, 1, []), "Los dos cafés iguales son movimientos distintos; la gasolina ya existía"
+    assert db_manager.insertar_transacciones_nuevas(extracto) == (0, 3, []), "Reimportar el mismo extracto no debería insertar nada"
+    cafes = [dict(extracto[1], fecha=date(2024, 8, 5)) for _ in range(3)]
+    db_manager.asignar_huellas(cafes)
+    por_bloques = [db_manager.insertar_transacciones_nuevas(bloque) for bloque in (cafes[:2], cafes[2:])]
+    assert por_bloques == [(2, 0, []), (1, 0, [])], "Un movimiento repetido en otro bloque del extracto no debería ignorarse"
+    ids_forzados, errores_forzados = db_manager.insertar_transacciones_lote(extracto[:1])
+    assert all(ids_forzados) and not errores_forzados, "La inserción forzada debería admitir un movimiento repetido"
+    assert len(db_manager.obtener_transacciones(mes=8, año=2024)) == 8, "Deberían quedar 8 transacciones en agosto"
+
+    # 13. Trabajos de importación
+    print("\n13. Probando los trabajos de importación...")
+    id_trabajo = db_manager.crear_trabajo_importacion(['/tmp/extracto.xlsx'], ['extracto.xlsx'])
+    assert db_manager.actualizar_trabajo_importacion(id_trabajo, estado='importando', total=10, duplicados=[1, 2])
+    assert db_manager.actualizar_trabajo_importacion(id_trabajo, procesadas_mas=4, insertadas_mas=3)
+    trabajo = db_manager.obtener_trabajo_importacion(id_trabajo)
+    print(f"Trabajo: {trabajo['estado']} {trabajo['procesadas']}/{trabajo['total']}")
+    assert (trabajo['procesadas'], trabajo['insertadas'], trabajo['duplicados']) == (4, 3, [1, 2]), "El progreso debería acumularse"
+    assert [t['id'] for t in db_manager.obtener_trabajos_importacion(estados=['importando'])] == [id_trabajo]
+
+    # 14. Paginación por clave
+    print("\n14. Probando la paginación por clave...")
+    paginas = []
+    cursor_pagina = None
+    while True:
+        pagina, cursor_pagina = db_manager.obtener_pagina_transacciones(cursor=cursor_pagina, limite=2)
+        paginas.append(pagina)
+        if cursor_pagina is None:
+            break
+    ids_paginados = [t['id'] for pagina in paginas for t in pagina]
+    esperados = [t['id'] for t in sorted(db_manager.obtener_transacciones(), key=lambda t: (t['fecha'], t['id']), reverse=True)]
+    print(f"{len(paginas)} páginas, {len(ids_paginados)} transacciones")
+    assert ids_paginados == esperados, "Las páginas deberían recorrer todas las transacciones en orden, sin repetir"
+    assert all(len(pagina) <= 2 for pagina in paginas), "Ninguna página debería superar el límite"
+
+    # 15. Lectura por bloques y carga en columnas
+    print("\n15. Probando la lectura por bloques y el DataFrame tipado...")
+    recorridas = [t['id'] for t in db_manager.iterar_transacciones(tamaño_bloque=2)]
+    esperados = [t['id'] for t in sorted(db_manager.obtener_transacciones(), key=lambda t: (t['fecha'], t['id']))]
+    assert recorridas == esperados, "El generador debería recorrer todas las transacciones por (fecha, id)"
+    df_agosto = db_manager.cargar_transacciones_df(mes=8, año=2024, tamaño_bloque=2)
+    print(f"DataFrame de agosto: {len(df_agosto)} filas, tipos {dict(df_agosto.dtypes.astype(str))}")
+    assert len(df_agosto) == 8 and df_agosto['importe'].dtype == 'float64'
+    assert str(df_agosto['fecha'].dtype).startswith('datetime64') and df_agosto['tipo'].dtype == 'category'
+    assert db_manager.cargar_transacciones_df(año=1990, columnas=['fecha', 'importe']).empty
+
+    # 16. Consultas agregadas
+    print("\n16. Probando las consultas agregadas...")
+    por_tipo = db_manager.consultar_agregados(
+        columnas=['tipo'], agregados={'total': ('suma', 'importe'), 'n': ('cuenta', '*')},
+        filtros=[('mes', '=', 8), ('año', '=', 2024)], agrupar_por=['tipo'], ordenar_por=['-n']
+    )
+    print(f"Agosto por tipo: {por_tipo}")
+    agosto = db_manager.obtener_transacciones(mes=8, año=2024)
+    assert sum(f['n'] for f in por_tipo) == len(agosto), "La cuenta agregada debería coincidir con las filas del mes"
+    assert abs(sum(f['total'] for f in por_tipo) - sum(t['importe'] for t in agosto)) < 0.01
+    mayor_gasto = db_manager.consultar_agregados(columnas=['importe'], filtros=[('tipo', '=', 'GASTO')], ordenar_por=['importe'], limite=1)
+    assert mayor_gasto[0]['importe'] == min(t['importe'] for t in db_manager.obtener_transacciones() if t['tipo'] == 'GASTO')
+    try:
+        db_manager.consultar_agregados(columnas=['importe; DROP TABLE transacciones'])
+        assert False, "Una columna desconocida debería rechazarse"
+    except ValueError:
+        pass
+
+    # 17. Versión de los datos
+    print("\n17. Probando la versión de los datos...")
+    version = db_manager.version_datos()
+    db_manager.obtener_transacciones()
+    assert db_manager.version_datos() == version, "Una lectura no debería cambiar la versión de los datos"
+    db_manager.insertar_transaccion(date(2024, 9, 1), "Panadería", -2.0, "COMIDA", "GASTO", 9, 2024)
+    assert db_manager.version_datos() != version, "Una escritura debería cambiar la versión de los datos"
+    print(f"Versión: {version[1]} -> {db_manager.version_datos()[1]}")
+
+    # 18. Panel mensual
+    print("\n18. Probando el panel mensual...")
+    panel = db_manager.obtener_panel_mensual(desde=(2024, 8), hasta=(2024, 9))
+    print(f"Panel agosto-septiembre: {len(panel)} filas")
+    assert {(f['año'], f['mes']) for f in panel} == {(2024, 8), (2024, 9)}, "El panel debería limitarse al rango pedido"
+    agosto = [f for f in panel if f['mes'] == 8]
+    gastos_agosto = [t for t in db_manager.obtener_transacciones(mes=8, año=2024) if t['tipo'] == 'GASTO']
+    assert sum(f['n'] for f in agosto) == len(db_manager.obtener_transacciones(mes=8, año=2024))
+    assert all(f['dias_con_gasto'] == len({str(t['fecha'])[:10] for t in gastos_agosto}) for f in agosto), "dias_con_gasto es por periodo"
+
+    # 19. Saldo acumulado por transacción
+    print("\n19. Probando el saldo acumulado...")
+    curva = db_manager.obtener_curva_saldo()
+    assert curva[-1]['saldo'] == round(db_manager.obtener_ultimo_saldo(), 2), "La curva debería acabar en el último saldo"
+    assert all(abs(b['saldo'] - a['saldo'] - b['importe']) < 0.01 for a, b in zip(curva, curva[1:])), "Cada paso debería sumar su importe"
+    # Los saldos se cuadran con el último saldo del banco: un gasto antiguo eleva los saldos anteriores a él
+    saldo_previo = db_manager.saldo_en(date(2024, 7, 9))
+    saldo_julio = db_manager.saldo_en(date(2024, 7, 31))
+    id_antigua = db_manager.insertar_transaccion(date(2024, 7, 10), "Reintegro", -100.0, "EXTRAORDINARIOS", "GASTO", 7, 2024)
+    assert abs(db_manager.saldo_en(date(2024, 7, 9)) - (saldo_previo + 100.0)) < 0.01, "Una alta antigua debería recalcular los saldos"
+    assert abs(db_manager.saldo_en(date(2024, 7, 31)) - saldo_julio) < 0.01
+    db_manager.eliminar_transaccion(id_antigua)
+    # Los saldos se recalculan al escribir: leerlos no espera a otra conexión que esté escribiendo
+    escritora = sqlite3.connect(db_manager.DB_NAME)
+    escritora.execute("BEGIN IMMEDIATE")
+    inicio = time.monotonic()
+    assert abs(db_manager.saldo_en(date(2024, 7, 9)) - saldo_previo) < 0.01, "Al borrarla el saldo debería volver"
+    assert time.monotonic() - inicio < 1, "Leer un saldo no debería necesitar el bloqueo de escritura"
+    escritora.rollback()
+    escritora.close()
+    print(f"Saldo al cierre de julio: {saldo_julio:.2f}, {len(curva)} puntos en la curva")
+
+    # 20. Saldos diarios
+    print("\n20. Probando los saldos diarios...")
+    dias = db_manager.saldos_entre(date(2024, 7, 1), date(2024, 8, 31))
+    curva = db_manager.obtener_curva_saldo(date(2024, 7, 1), date(2024, 8, 31))
+    cierres = {}
+    for punto in curva:
+        cierres[str(punto['fecha'])[:10]] = punto['saldo']
+    print(f"{len(dias)} días con movimientos en julio y agosto")
+    assert {d['fecha']: d['saldo'] for d in dias} == cierres, "Cada día debería cerrar con el saldo de su última transacción"
+    assert sum(d['n'] for d in dias) == len(curva)
+    assert db_manager.saldo_en(date(2024, 8, 31)) == dias[-1]['saldo']
+    id_gasto = db_manager.insertar_transaccion(date(2024, 7, 20), "Devolución", 30.0, "", "GASTO", 7, 2024)
+    db_manager.actualizar_transaccion(id_gasto, {'tipo': 'INGRESO'})
+    # La escritura ya ha dejado saldos_diarios al día: otra conexión lo ve sin que nadie lo recalcule
+    lectora = sqlite3.connect(db_manager.DB_NAME)
+    assert lectora.execute("SELECT COUNT(*) FROM recalculo_saldos").fetchone()[0] == 0, "No debería quedar recálculo pendiente"
+    assert lectora.execute("SELECT ingresos FROM saldos_diarios WHERE fecha = '2024-07-20'").fetchone()[0] >= 30.0
+    lectora.close()
+    dia = db_manager.saldos_entre(date(2024, 7, 20), date(2024, 7, 20))[0]
+    assert dia['ingresos'] >= 30.0, "Cambiar el tipo debería rehacer los ingresos y gastos del día"
+    db_manager.eliminar_transaccion(id_gasto)
+
+    # 21. Categorías asignadas a mano
+    print("\n21. Probando que la reclasificación respeta las categorías manuales...")
+    regla = [{'patron': 'gasolina|cine', 'literales': ['gasolina', 'cine']}]
+    candidatas = db_manager.obtener_candidatas_reclasificacion(regla)
+    assert candidatas, "Las transacciones que cumplen la regla deberían ser candidatas"
+    db_manager.actualizar_transaccion(candidatas[0]['id'], {'categoria': 'OCIO'})
+    restantes = db_manager.obtener_candidatas_reclasificacion(regla)
+    print(f"Candidatas: {len(candidatas)} -> {len(restantes)} tras editar una a mano")
+    assert candidatas[0]['id'] not in {c['id'] for c in restantes}, "Una categoría editada a mano no debería reclasificarse"
+    db_manager.actualizar_categorias_lote([(restantes[0]['id'], 'FIJOS')])
+    assert len(db_manager.obtener_candidatas_reclasificacion(regla)) == len(restantes), "La reclasificación automática no marca la categoría como manual"
+
+    # 22. Sincronización entre bases
+    print("\n22. Probando la sincronización con una base exportada sin saldos...")
+    db_manager.insertar_transaccion(date(2024, 9, 3), 'Farmacia', -8.4, 'FIJOS', 'GASTO', 9, 2024)
+    exportada = {'transacciones': [
+        {'fecha': '2024-09-03', 'concepto': 'Farmacia', 'importe': -8.4, 'categoria': 'FIJOS', 'tipo': 'GASTO', 'mes': 9, 'año': 2024, 'saldo_posterior': 512.3},
+        {'fecha': '2024-09-04', 'concepto': 'Panadería', 'importe': -2.1, 'categoria': 'COMIDA', 'tipo': 'GASTO', 'mes': 9, 'año': 2024, 'saldo_posterior': 510.2},
+    ]}
+    resultado = sync.importar_base_datos(exportada)
+    print(f"Sincronización: {resultado['nuevas']} nuevas, {resultado['duplicadas']} duplicadas")
+    assert (resultado['nuevas'], resultado['duplicadas']) == (1, 1), "El mismo movimiento con y sin saldo debería reconocerse como duplicado"
+    assert sync.importar_base_datos(exportada)['duplicadas'] == 2, "Sincronizar dos veces no debería insertar nada"
+
+    # 23. Gastos sin categoría
+    print("\n23. Probando las métricas con gastos sin categoría...")
+    db_manager.insertar_transaccion(date(2023, 5, 2), 'Nómina', 1000.0, 'INGRESO', 'INGRESO', 5, 2023)
+    db_manager.insertar_transaccion(date(2023, 5, 3), 'Sin clasificar', -10.0, '', 'GASTO', 5, 2023)
+    db_manager.insertar_transaccion(date(2023, 5, 4), 'Sin clasificar', -5.0, None, 'GASTO', 5, 2023)
+    db_manager.insertar_transaccion(date(2023, 5, 5), 'Alquiler', -400.0, 'FIJOS', 'GASTO', 5, 2023)
+    totales_mayo = metrics.calcular_totales_mes(5, 2023)
+    print(f"Gastos por categoría: {totales_mayo['gastos_por_categoria']}")
+    assert totales_mayo['gastos_por_categoria'] == {None: -15.0, 'FIJOS': -400.0}, "Vacía y nula son el mismo gasto sin categoría"
+    ratios = metrics.calcular_efficiency_ratios(5, 2023)
+    assert ratios['ratio_fijos'] == 40.0, "Los gastos sin categoría no deberían romper los ratios"
+    assert metrics.calcular_totales_anual(2023)['gastos_por_categoria'] == {'FIJOS': -400.0}
 
     print("\n--- PRUEBAS DE LA BASE DE DATOS COMPLETADAS EXITOSAMENTE ---")
 
@@ -0,0 +1,115 @@
+# utils/cache_importacion.py - Caché en disco de archivos Excel ya procesados
+
+import hashlib
+import json
+import logging
+import os
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+from . import categorizer
+
+# Directorio donde se guardan los lotes de transacciones ya leídos y clasificados
+CACHE_DIR = Path(__file__).parent.parent / 'cache' / 'importaciones'
+
+# Tamaño máximo total de la caché; al superarlo se borran primero las entradas usadas hace más tiempo
+TAMAÑO_MAX_CACHE = 256 * 1024 * 1024
+
+# Columnas que se guardan de cada transacción (las notas siempre salen vacías del Excel)
+_COLUMNAS_TEXTO = ['concepto', 'categoria', 'tipo']
+_COLUMNAS_NUMERICAS = ['importe', 'saldo_posterior']
+
+def clave_archivo(ruta):
+    """
+    Clave de caché de un archivo: SHA-256 de su contenido más la versión de las reglas, para que
+    un cambio en las reglas no devuelva categorías calculadas con las anteriores.
+    """
+    sha = hashlib.sha256()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(1024 * 1024), b''):
+            sha.update(bloque)
+    return f"{sha.hexdigest()}-{categorizer.version_reglas()}"
+
+def _ruta_entrada(clave):
+    return CACHE_DIR / f"{clave}.npz"
+
+def obtener(clave):
+    """Devuelve (transacciones, hojas) guardadas para la clave, o None si no está en caché."""
+    ruta = _ruta_entrada(clave)
+    try:
+        with np.load(ruta, allow_pickle=False) as datos:
+            columnas = {nombre: datos[nombre] for nombre in datos.files}
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        logging.warning(f"Entrada de caché ilegible '{ruta.name}', se descarta: {e}")
+        ruta.unlink(missing_ok=True)
+        return None
+
+    # Marcar la entrada como usada recientemente para la expulsión por antigüedad
+    os.utime(ruta)
+
+    fechas = columnas['fecha'].astype('datetime64[D]')
+    transacciones = [
+        {
+            'fecha': fecha,
+            'concepto': concepto,
+            'importe': importe,
+            'categoria': categoria,
+            'tipo': tipo,
+            'mes': mes,
+            'año': año,
+            'notas': '',
+            'saldo_posterior': None if saldo != saldo else saldo
+        }
+        for fecha, concepto, importe, categoria, tipo, mes, año, saldo in zip(
+            fechas.astype(object).tolist(), columnas['concepto'].tolist(), columnas['importe'].tolist(),
+            columnas['categoria'].tolist(), columnas['tipo'].tolist(),
+            pd.DatetimeIndex(fechas).month.tolist(), pd.DatetimeIndex(fechas).year.tolist(),
+            columnas['saldo_posterior'].tolist()
+        )
+    ]
+    return transacciones, json.loads(str(columnas['hojas']))
+
+def guardar(clave, transacciones, hojas):
+    """
+    Guarda las transacciones de un archivo en formato columnar comprimido (un array por columna)
+    junto con el detalle por hoja, y aplica el límite de tamaño de la caché.
+    """
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        columnas = {
+            'fecha': np.array([t['fecha'] for t in transacciones], dtype='datetime64[D]'),
+            'hojas': np.array(json.dumps(hojas, ensure_ascii=False)),
+        }
+        for nombre in _COLUMNAS_TEXTO:
+            columnas[nombre] = np.array([str(t[nombre]) for t in transacciones], dtype=str)
+        for nombre in _COLUMNAS_NUMERICAS:
+            columnas[nombre] = np.array([t[nombre] if t[nombre] is not None else np.nan for t in transacciones], dtype=float)
+
+        # Escribir en un temporal y renombrar, para no dejar nunca una entrada a medias
+        temporal = CACHE_DIR / f"{clave}.tmp.npz"
+        np.savez_compressed(temporal, **columnas)
+        os.replace(temporal, _ruta_entrada(clave))
+        _limitar_tamaño()
+    except Exception as e:
+        logging.warning(f"No se pudo guardar el archivo en la caché de importaciones: {e}")
+
+def _limitar_tamaño():
+    """Borra las entradas usadas hace más tiempo hasta que la caché quede por debajo de TAMAÑO_MAX_CACHE."""
+    entradas = sorted(CACHE_DIR.glob('*.npz'), key=lambda ruta: ruta.stat().st_mtime)
+    total = sum(ruta.stat().st_size for ruta in entradas)
+    for ruta in entradas:
+        if total <= TAMAÑO_MAX_CACHE:
+            break
+        total -= ruta.stat().st_size
+        ruta.unlink(missing_ok=True)
+
+def limpiar_cache():
+    """Elimina todas las entradas de la caché. Retorna el número de archivos borrados."""
+    borradas = 0
+    for ruta in CACHE_DIR.glob('*.npz'):
+        ruta.unlink(missing_ok=True)
+        borradas += 1
+    return borradas
@@ -1,32 +1,138 @@
 
 # utils/categorizer.py
 
+import hashlib
 import json
 import re
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
+import pandas as pd
+from database import db_manager
+
 # Cargar las reglas de clasificación desde el archivo JSON
 RULES_FILE = Path(__file__).parent.parent / 'config' / 'categorias.json'
 
 _rules = []
 
+# Huella del contenido del archivo de reglas cargado; cambia con cualquier edición de las reglas
+# y permite invalidar resultados de clasificación guardados fuera de este proceso
+_version_reglas = ''
+
+# Clasificador compilado: tupla de (buscar, literales, importes, categoria) por cada regla
+# aplicable, en el mismo orden que _rules. `buscar` es el método search de la regex (None si
+# la regla no tiene patrón), `literales` los textos en minúsculas cuando el patrón es una simple
+# alternancia de literales ASCII (None si no) e `importes` un frozenset con los importes exactos.
+_clasificador = ()
+
+# Número máximo de pares (concepto, importe) cuyo resultado se guarda en la caché LRU
+TAMAÑO_CACHE_CLASIFICACION = 10000
+
+# Caracteres con significado especial en una regex (sin escapar impiden tratarla como literal)
+_METACARACTERES = set('.^$*+?{}[]()|\\')
+
 def load_rules():
     """Carga las reglas desde el archivo JSON a una variable global."""
-    global _rules
+    global _rules, _clasificador, _version_reglas
+    # Cualquier cambio en las reglas invalida los resultados memorizados
+    _clasificar_cacheado.cache_clear()
+    _version_reglas = ''
     try:
         with open(RULES_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+            contenido = f.read()
+            data = json.loads(contenido)
+            _version_reglas = hashlib.sha256(contenido.encode('utf-8')).hexdigest()[:16]
             _rules = data.get('reglas', [])
             # Compilar los patrones de regex para eficiencia
             for rule in _rules:
                 rule['regex'] = re.compile(rule['patron'], re.IGNORECASE)
+            _clasificador = compilar_clasificador(_rules)
         print(f"Reglas de clasificación cargadas exitosamente desde {RULES_FILE}")
     except FileNotFoundError:
         print(f"Advertencia: No se encontró el archivo de reglas en {RULES_FILE}. El clasificador no funcionará.")
         _rules = []
+        _clasificador = ()
     except json.JSONDecodeError:
         print(f"Error: El archivo de reglas {RULES_FILE} no es un JSON válido.")
         _rules = []
+        _clasificador = ()
+
+def version_reglas():
+    """Devuelve la versión (huella) de las reglas cargadas, o '' si no hay reglas."""
+    if not _rules:
+        load_rules()
+    return _version_reglas
+
+def _extraer_literales(patron):
+    """
+    Si el patrón es una alternancia de literales ASCII (p. ej. 'BAR |TABERNA|claude\\.ai'),
+    devuelve esos literales en minúsculas; en cualquier otro caso devuelve None.
+    Para textos ASCII, buscar estos literales con `in` equivale a la regex con IGNORECASE.
+    """
+    literales = []
+    for alternativa in patron.split('|'):
+        caracteres = []
+        escapado = False
+        for ch in alternativa:
+            if escapado:
+                if ch.isalnum(): # Secuencias como \d, \s o \b no son literales
+                    return None
+                caracteres.append(ch)
+                escapado = False
+            elif ch == '\\':
+                escapado = True
+            elif ch in _METACARACTERES:
+                return None
+            else:
+                caracteres.append(ch)
+        literal = ''.join(caracteres)
+        if escapado or not literal or not literal.isascii():
+            return None
+        literales.append(literal.lower())
+    return tuple(literales)
+
+def compilar_clasificador(reglas):
+    """
+    Precalcula todo lo que clasificar_transaccion necesita de cada regla, en el orden original
+    (la primera coincidencia gana). Las reglas sin patrón ni importes nunca asignan categoría,
+    así que se descartan aquí en lugar de evaluarse para cada transacción.
+    """
+    compilado = []
+    for rule in reglas:
+        patron = rule.get('patron')
+        tiene_importes = 'importes_exactos' in rule
+        if not patron and not tiene_importes:
+            continue
+        buscar = rule['regex'].search if patron else None
+        literales = _extraer_literales(patron) if patron else None
+        importes = frozenset(rule['importes_exactos']) if tiene_importes else None
+        compilado.append((buscar, literales, importes, rule['categoria']))
+    return tuple(compilado)
+
+@lru_cache(maxsize=TAMAÑO_CACHE_CLASIFICACION)
+def _clasificar_cacheado(concepto, importe):
+    """Aplica el clasificador compilado. Los resultados se memorizan por (concepto, importe)."""
+    # El valor absoluto solo se calcula una vez; sin importe, las condiciones de importe se ignoran
+    importe_abs = abs(importe) if importe is not None else None
+    # Los conceptos ASCII se comparan en minúsculas contra los literales, sin pasar por la regex
+    texto = concepto.lower() if concepto.isascii() else None
+
+    for buscar, literales, importes, categoria in _clasificador:
+        # 1. Condición de importe (la más barata): se compara el valor absoluto
+        if importes is not None and importe_abs is not None and importe_abs not in importes:
+            continue
+        # 2. Patrón de texto (las reglas sin patrón coinciden con cualquier texto)
+        if buscar is None:
+            return categoria
+        if literales is not None and texto is not None:
+            for literal in literales:
+                if literal in texto:
+                    return categoria
+        elif buscar(concepto):
+            return categoria
+    
+    return "SIN_CLASIFICAR" # Devolver una categoría por defecto si no hay coincidencia
 
 def clasificar_transaccion(concepto, importe=None):
     """
@@ -39,36 +145,101 @@ def clasificar_transaccion(concepto, importe=None):
         if not _rules: # Si la carga falla, no hay nada que hacer
             return "SIN_CLASIFICAR"
 
+    # NaN (una celda vacía leída con pandas) es "sin importe", igual que None y que en clasificar_lote
+    if importe is not None and importe != importe:
+        importe = None
+    return _clasificar_cacheado(concepto, importe)
+
+def estadisticas_cache():
+    """Devuelve los aciertos y fallos de la caché de clasificación desde la última carga de reglas."""
+    info = _clasificar_cacheado.cache_info()
+    total = info.hits + info.misses
+    return {
+        'aciertos': info.hits,
+        'fallos': info.misses,
+        'tasa_aciertos': round(info.hits / total * 100, 2) if total else 0.0,
+        'tamaño': info.currsize,
+        'tamaño_max': info.maxsize
+    }
+
+def clasificar_lote(conceptos, importes=None):
+    """
+    Clasifica una columna entera de transacciones de una sola vez.
+    Cada regla se evalúa una única vez con `str.contains`, solo sobre los conceptos distintos
+    de las filas que aún no tienen categoría (la máscara de pendientes se reduce a medida que
+    las reglas asignan categorías), y la condición de importe se resuelve con un `isin` vectorizado.
+    Devuelve una Series con el mismo índice que `conceptos` y el mismo resultado que
+    aplicar clasificar_transaccion fila a fila.
+    """
+    if not _rules:
+        load_rules()
+
+    # Los extractos repiten mucho los conceptos: las regex se evalúan sobre los valores únicos
+    codigos, unicos = pd.factorize(conceptos, use_na_sentinel=True)
+    textos = pd.Series(np.asarray(unicos, dtype=object))
+    con_texto = codigos >= 0
+
+    categorias = np.full(len(conceptos), "SIN_CLASIFICAR", dtype=object)
+    pendientes = np.ones(len(conceptos), dtype=bool)
+
+    importes_abs = None
+    if importes is not None:
+        importes_abs = pd.to_numeric(pd.Series(importes), errors='coerce').abs()
+        sin_importe = importes_abs.isna().to_numpy()
+
     for rule in _rules:
-        patron_coincide = False
-        importe_coincide = False
-
-        # 1. Verificar si el patrón de texto coincide
-        if 'regex' in rule and rule['regex'].search(concepto):
-            patron_coincide = True
-        # Si no hay patrón en la regla, consideramos que el texto coincide por defecto
-        elif 'patron' not in rule or not rule['patron']:
-            patron_coincide = True
-
-        # 2. Verificar si el importe coincide (si la regla tiene condición de importe)
-        if 'importes_exactos' in rule and importe is not None:
-            # Comparamos el valor absoluto del importe
-            if abs(importe) in rule['importes_exactos']:
-                importe_coincide = True
-        else:
-            # Si la regla no tiene condición de importe, consideramos que el importe coincide
-            importe_coincide = True
-
-        # 3. Si ambas condiciones se cumplen, aplicar la categoría
-        if patron_coincide and importe_coincide:
-            # Asegurarnos de que no estamos aplicando una regla de solo importe a todo
-            if ('patron' in rule and rule['patron']) or 'importes_exactos' in rule:
-                 return rule['categoria']
-    
-    return "SIN_CLASIFICAR" # Devolver una categoría por defecto si no hay coincidencia
+        if not pendientes.any():
+            break
+        patron = rule.get('patron')
+        tiene_importes = 'importes_exactos' in rule
+        if not patron and not tiene_importes:
+            continue
+
+        candidatos = pendientes.copy()
+        # 1. Condición de importe (las filas sin importe la cumplen, como en la versión escalar)
+        if tiene_importes and importes_abs is not None:
+            candidatos &= importes_abs.isin(rule['importes_exactos']).to_numpy() | sin_importe
+        # 2. Patrón de texto, solo sobre los conceptos de las filas que siguen siendo candidatas
+        if patron:
+            candidatos &= con_texto
+            necesarios = np.zeros(len(textos), dtype=bool)
+            necesarios[codigos[candidatos]] = True
+            coincide = np.zeros(len(textos), dtype=bool)
+            coincide[necesarios] = textos[necesarios].str.contains(rule['regex'], na=False).to_numpy(dtype=bool)
+            candidatos &= coincide[codigos]
+
+        categorias[candidatos] = rule['categoria']
+        pendientes &= ~candidatos
+
+    return pd.Series(categorias, index=conceptos.index, name='categoria')
 
 # --- Funciones para la gestión de reglas (Fase avanzada) ---
 
+def reclasificar_afectadas(reglas):
+    """
+    Reclasifica solo las transacciones que pueden verse afectadas por un cambio en `reglas`
+    (la versión anterior y/o nueva de las reglas modificadas): las que cumplen su patrón o sus
+    importes. Las demás no dependen de esas reglas, así que su categoría no puede cambiar.
+    Los cambios se aplican en una única transacción. Retorna el número de transacciones actualizadas.
+    """
+    try:
+        # Los literales permiten a la base de datos preseleccionar candidatas con el índice de texto completo
+        candidatas = db_manager.obtener_candidatas_reclasificacion(
+            [{**r, 'literales': _extraer_literales(r['patron']) if r.get('patron') else None} for r in reglas if r]
+        )
+        if not candidatas:
+            return 0
+
+        df = pd.DataFrame(candidatas)
+        df['nueva_categoria'] = clasificar_lote(df['concepto'], df['importe'])
+        df_cambios = df[df['nueva_categoria'] != df['categoria']]
+        actualizadas = db_manager.actualizar_categorias_lote(zip(df_cambios['id'], df_cambios['nueva_categoria']))
+        print(f"Reclasificadas {actualizadas} de {len(candidatas)} transacciones candidatas.")
+        return actualizadas
+    except Exception as e:
+        print(f"Error al reclasificar las transacciones afectadas: {e}")
+        return 0
+
 def guardar_regla(patron, categoria, tipo, importes_exactos=None):
     """Añade una nueva regla al archivo JSON y recarga las reglas."""
     try:
@@ -97,6 +268,7 @@ def guardar_regla(patron, categoria, tipo, importes_exactos=None):
             f.truncate()
         
         load_rules() # Recargar las reglas en memoria
+        reclasificar_afectadas([nueva_regla])
         return True
     except Exception as e:
         print(f"Error al guardar la nueva regla: {e}")
@@ -123,12 +295,14 @@ def actualizar_regla(patron_original, regla_actualizada):
                     print(f"Error: El nuevo patrón '{nuevo_patron}' ya existe en otra regla.")
                     return False
 
+                regla_original = reglas[index_a_actualizar]
                 reglas[index_a_actualizar] = regla_actualizada
                 data['reglas'] = reglas
                 f.seek(0)
                 json.dump(data, f, indent=2, ensure_ascii=False)
                 f.truncate()
                 load_rules()
+                reclasificar_afectadas([regla_original, regla_actualizada])
                 return True
             else:
                 print(f"Error: No se encontró la regla con el patrón original '{patron_original}'.")
@@ -148,11 +322,13 @@ def eliminar_regla(patron_a_eliminar):
             reglas_actualizadas = [regla for regla in reglas_originales if regla.get('patron') != patron_a_eliminar]
             
             if len(reglas_actualizadas) < len(reglas_originales):
+                reglas_eliminadas = [regla for regla in reglas_originales if regla.get('patron') == patron_a_eliminar]
                 data['reglas'] = reglas_actualizadas
                 f.seek(0)
                 json.dump(data, f, indent=2, ensure_ascii=False)
                 f.truncate()
                 load_rules()
+                reclasificar_afectadas(reglas_eliminadas)
                 return True
             else:
                 return False # No se encontró la regla
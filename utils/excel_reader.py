@@ -1,135 +1,398 @@
-
 # utils/excel_reader.py
 
+import numpy as np
 import pandas as pd
 import logging
 import locale
+import multiprocessing
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+import unicodedata
+from datetime import date, datetime
+from itertools import chain, islice
+import openpyxl
+from . import cache_importacion
 from . import categorizer # Importar el clasificador
 
 # Configuración básica de logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# Número de filas iniciales en las que se busca la cabecera de cada hoja
+FILAS_BUSQUEDA_CABECERA = 10
+
+# Filas que se normalizan (y clasifican) de una vez al recorrer una hoja
+TAMAÑO_BLOQUE_LECTURA = 5000
+
+def _es_fila_cabecera(valores):
+    """Indica si una fila contiene la cabecera de la tabla de movimientos."""
+    row_str = ' '.join(map(str, valores)).lower()
+    return 'fecha' in row_str and ('concepto' in row_str or 'descripcion' in row_str) and 'importe' in row_str
+
+def _normalizar_nombre_columna(nombre):
+    """Pasa un nombre de columna a minúsculas y sin tildes."""
+    return unicodedata.normalize('NFKD', str(nombre).lower()).encode('ascii', errors='ignore').decode('utf-8')
+
+def _identificar_columnas(cols):
+    """
+    Identifica las columnas de fecha, concepto, importe y saldo entre los nombres normalizados.
+    Retorna una tupla (fecha, concepto, importe, saldo) o None si la hoja no tiene columnas suficientes.
+    """
+    cols = list(cols)
+
+    def encontrar_columna(patterns):
+        # Prioridad 1: Coincidencia exacta
+        for p in patterns:
+            if p in cols:
+                return p
+        # Prioridad 2: Coincidencia de subcadena
+        for p in patterns:
+            match = next((c for c in cols if p in c), None)
+            if match:
+                return match
+        return None
+
+    col_fecha = encontrar_columna(['fecha'])
+    col_concepto = encontrar_columna(['concepto', 'descripcion'])
+    col_importe = encontrar_columna(['importe', 'cantidad'])
+    col_saldo = encontrar_columna(['saldo posterior', 'saldo'])
+
+    if not all([col_fecha, col_concepto, col_importe, col_saldo]):
+        logging.warning("No se pudieron identificar todas las columnas por nombre. Usando fallback a orden posicional.")
+        if len(cols) < 5:
+            logging.error(f"La hoja no tiene las columnas mínimas requeridas (fecha, concepto, importe, saldo). Omitiendo.")
+            return None
+        col_fecha, col_concepto, col_importe, col_saldo = cols[0], cols[1], cols[3], cols[4] # Ajustar índices si es necesario
+
+    logging.info(f"Columnas identificadas -> Fecha: '{col_fecha}', Concepto: '{col_concepto}', Importe: '{col_importe}'")
+    return col_fecha, col_concepto, col_importe, col_saldo
+
+def _parsear_fecha(valor):
+    """Convierte el valor de la celda de fecha en date, o None si no es una fecha válida."""
+    if isinstance(valor, datetime):
+        return valor.date()
+    if isinstance(valor, date):
+        return valor
+    fecha = pd.to_datetime(valor, errors='coerce', dayfirst=True)
+    return None if pd.isna(fecha) else fecha.date()
+
+def _parsear_importe(valor):
+    """Convierte el importe a float, aceptando el formato español como fallback. None si no es válido."""
+    try:
+        # Usar locale para convertir el string a float
+        return locale.atof(str(valor))
+    except (ValueError, TypeError):
+        # Fallback si atof falla o el locale no estaba disponible
+        try:
+            importe_str = str(valor).replace('.', '').replace(',', '.')
+            return float(importe_str)
+        except (ValueError, TypeError):
+            return None
+
+def _parsear_saldo(valor):
+    """Convierte el saldo posterior a float; si el valor es inválido, lo dejamos como nulo."""
+    try:
+        return locale.atof(str(valor))
+    except (ValueError, TypeError):
+        return None
+
+def _nombres_columnas(cabecera):
+    """Nombres normalizados de la fila de cabecera, con el mismo relleno que pandas para celdas vacías."""
+    return [_normalizar_nombre_columna(v if not pd.isna(v) else f"Unnamed: {i}") for i, v in enumerate(cabecera)]
+
+def _a_numero(valores):
+    """Conversión vectorizada equivalente a locale.atof(str(valor)); NaN donde no se pueda convertir."""
+    if pd.api.types.is_bool_dtype(valores):
+        return pd.Series(np.nan, index=valores.index)
+    if pd.api.types.is_numeric_dtype(valores):
+        return valores.astype(float)
+    numeros = pd.to_numeric(valores, errors='coerce')
+    # atof(str(True)) falla, así que los booleanos sueltos en una columna de texto tampoco son números
+    return numeros.mask(valores.map(type) == bool).astype(float)
+
+def _normalizar_columnas(fechas, conceptos, importes, saldos):
+    """
+    Normaliza las columnas de una hoja completa. Fechas e importes se parsean de una vez sobre
+    toda la columna; solo las celdas que el parseo vectorizado no resuelve pasan por los
+    parseadores fila a fila, así que el resultado es el mismo que parseando celda a celda.
+    """
+    validas = conceptos.notna() & importes.notna()
+    fechas, conceptos, importes, saldos = fechas[validas], conceptos[validas], importes[validas], saldos[validas]
+
+    fecha = pd.to_datetime(fechas, errors='coerce', dayfirst=True)
+    pendientes = fecha.isna() & fechas.notna()
+    if pendientes.any():
+        fecha = fecha.astype(object)
+        fecha[pendientes] = fechas[pendientes].map(_parsear_fecha)
+        fecha = pd.to_datetime(fecha, errors='coerce')
+
+    # Importes: número directo, luego formato español (1.234,56) y, para lo que quede, el parseador original
+    importe = _a_numero(importes)
+    pendientes = importe.isna()
+    if pendientes.any():
+        textos = importes[pendientes].astype(str)
+        importe[pendientes] = pd.to_numeric(textos.str.replace('.', '', regex=False).str.replace(',', '.', regex=False), errors='coerce')
+        pendientes = importe.isna()
+        if pendientes.any():
+            importe[pendientes] = importes[pendientes].map(_parsear_importe).astype(float)
+
+    saldo = _a_numero(saldos).astype(object)
+    pendientes = saldo.isna() & saldos.notna()
+    if pendientes.any():
+        saldo[pendientes] = saldos[pendientes].map(_parsear_saldo)
+
+    validas = fecha.notna() & importe.notna()
+    fecha, importe = fecha[validas], importe[validas]
+    tipos = np.where(importe > 0, 'INGRESO', 'GASTO')
+
+    return [
+        {
+            'fecha': f,
+            'concepto': c,
+            'importe': i,
+            'categoria': None, # Se asigna después, clasificando todas las filas de una vez
+            'tipo': t,
+            'mes': m,
+            'año': a,
+            'notas': '',
+            'saldo_posterior': s
+        }
+        for f, c, i, t, m, a, s in zip(
+            fecha.dt.date.tolist(), conceptos[validas].astype(str).tolist(), importe.tolist(), tipos.tolist(),
+            fecha.dt.month.tolist(), fecha.dt.year.tolist(), saldo[validas].tolist()
+        )
+    ]
+
+def _abrir_libro(file_path):
+    """Abre el libro en modo read_only: las hojas se recorren fila a fila sin cargarlas en memoria."""
+    return openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+def _bloques_hoja(hoja, tamaño_bloque=TAMAÑO_BLOQUE_LECTURA):
+    """
+    Recorre una hoja de un libro read_only una sola vez y produce sus transacciones normalizadas, sin
+    clasificar, en listas de como mucho `tamaño_bloque` filas. La cabecera se busca en las primeras
+    filas; cada bloque se normaliza por columnas, así que en memoria solo hay un bloque a la vez.
+    """
+    logging.info(f"--- Procesando hoja: '{hoja.title}' ---")
+    filas = hoja.iter_rows(values_only=True)
+    primeras = list(islice(filas, FILAS_BUSQUEDA_CABECERA))
+    if not primeras:
+        logging.info("La hoja está vacía.")
+        return
+
+    header_row_index = next((i for i, fila in enumerate(primeras) if _es_fila_cabecera(fila)), -1)
+    if header_row_index != -1:
+        logging.info(f"Fila de cabecera detectada en la fila {header_row_index+1}.")
+    else:
+        header_row_index = 0
+
+    columnas = _nombres_columnas(primeras[header_row_index])
+    logging.info(f"Columnas normalizadas: {columnas}")
+    identificadas = _identificar_columnas(columnas)
+    if identificadas is None:
+        return
+    indices = [columnas.index(c) for c in identificadas]
+
+    datos = chain(primeras[header_row_index + 1:], filas)
+    leidas = validas = 0
+    while True:
+        bloque = list(islice(datos, tamaño_bloque))
+        if not bloque:
+            break
+        leidas += len(bloque)
+        # Las filas de openpyxl pueden venir más cortas que la cabecera: lo que falta es una celda vacía
+        fechas, conceptos, importes, saldos = (
+            pd.Series([fila[i] if i < len(fila) else None for fila in bloque], dtype=object) for i in indices
+        )
+        transacciones = _normalizar_columnas(fechas, conceptos, importes, saldos)
+        validas += len(transacciones)
+        yield transacciones
+
+    logging.info(f"Leídas {leidas} filas de datos de la hoja.")
+    logging.info(f"Encontradas {validas} transacciones válidas en la hoja.")
+
+def _procesar_hoja(libro, sheet_name):
+    """
+    Lee y normaliza una hoja de un libro abierto con _abrir_libro. Retorna las transacciones de la hoja
+    sin clasificar (lista vacía si no se identifican las columnas); lanza la excepción si la hoja no se puede leer.
+    """
+    return [t for bloque in _bloques_hoja(libro[sheet_name]) for t in bloque]
+
+def _clasificar(transacciones):
+    """Clasifica las transacciones con clasificar_lote, por bloques en lugar de fila a fila."""
+    for inicio in range(0, len(transacciones), TAMAÑO_BLOQUE_LECTURA):
+        bloque = transacciones[inicio:inicio + TAMAÑO_BLOQUE_LECTURA]
+        categorias = categorizer.clasificar_lote(
+            pd.Series([t['concepto'] for t in bloque]),
+            pd.Series([t['importe'] for t in bloque])
+        )
+        for transaccion, categoria in zip(bloque, categorias):
+            transaccion['categoria'] = categoria
+
+def leer_excel_streaming(file_path, stats=None, tamaño_bloque=TAMAÑO_BLOQUE_LECTURA):
+    """
+    Versión en streaming de leer_excel: recorre cada hoja una sola vez con openpyxl en modo read_only
+    y devuelve las transacciones normalizadas de una en una, ya clasificadas (por bloques de
+    `tamaño_bloque` filas, con clasificar_lote). La memoria no crece con el tamaño del archivo.
+    Si se pasa un diccionario en stats, se rellena con los mismos contadores que devuelve leer_excel.
+    """
+    if stats is None:
+        stats = {}
+    stats.update({"total_sheets_processed": 0, "total_transactions_found": 0})
+
+    try:
+        libro = _abrir_libro(file_path)
+        logging.info(f"Archivo Excel abierto. Hojas encontradas: {libro.sheetnames}")
+    except Exception as e:
+        logging.error(f"Error fatal al abrir o leer el archivo Excel: {e}")
+        stats["error"] = str(e)
+        return
+
+    try:
+        for hoja in libro.worksheets:
+            try:
+                for bloque in _bloques_hoja(hoja, tamaño_bloque):
+                    _clasificar(bloque)
+                    stats["total_transactions_found"] += len(bloque)
+                    yield from bloque
+                stats["total_sheets_processed"] += 1
+            except Exception as e:
+                logging.error(f"Error procesando la hoja '{hoja.title}': {e}", exc_info=True)
+                continue
+    finally:
+        # En modo read_only openpyxl mantiene el fichero abierto hasta cerrar el libro
+        libro.close()
+
 def leer_excel(file_path):
     """
     Lee un archivo Excel con transacciones financieras, lo procesa y 
     retorna una lista de transacciones normalizadas. Es flexible y procesa todas las hojas.
     """
     logging.info("--- Iniciando el proceso de importación de Excel ---")
+    stats = {}
+    transacciones = list(leer_excel_streaming(file_path, stats))
+    if "error" in stats:
+        return [], {"error": stats["error"]}
+
+    logging.info(f"--- Proceso de importación finalizado. {stats['total_sheets_processed']} hojas procesadas, {stats['total_transactions_found']} transacciones encontradas. ---")
+    
+    return transacciones, stats
+
+def _procesar_hoja_en_proceso(ruta, sheet_name):
+    """
+    Tarea de leer_excel_paralelo: abre el archivo en el proceso hijo y procesa una sola hoja.
+    Devuelve (transacciones, segundos, error) para no depender de que la excepción se pueda serializar.
+    """
+    inicio = time.perf_counter()
     try:
-        xls = pd.ExcelFile(file_path)
-        sheet_names_all = xls.sheet_names
-        logging.info(f"Archivo Excel abierto. Hojas encontradas: {sheet_names_all}")
+        libro = _abrir_libro(ruta)
+        try:
+            transacciones = _procesar_hoja(libro, sheet_name)
+        finally:
+            libro.close()
+        return transacciones, time.perf_counter() - inicio, None
     except Exception as e:
-        logging.error(f"Error fatal al abrir o leer el archivo Excel: {e}")
-        return [], {"error": str(e)}
+        logging.error(f"Error procesando la hoja '{sheet_name}' de '{ruta}': {e}", exc_info=True)
+        return [], time.perf_counter() - inicio, str(e)
 
-    transacciones = []
-    hojas_procesadas = 0
+def _ruta_en_disco(archivo, temporales):
+    """
+    Los procesos hijos abren el archivo por su ruta; los archivos subidos (objetos en memoria)
+    se vuelcan una vez a un temporal en lugar de copiar sus bytes a cada tarea.
+    """
+    if isinstance(archivo, (str, os.PathLike)):
+        return os.fspath(archivo)
+    datos = archivo.getvalue() if hasattr(archivo, 'getvalue') else archivo.read()
+    with tempfile.NamedTemporaryFile(suffix='.xlsx', delete=False) as tmp:
+        tmp.write(datos)
+    temporales.append(tmp.name)
+    return tmp.name
 
-    for sheet_name in sheet_names_all:
-        try:
-            logging.info(f"--- Procesando hoja: '{sheet_name}' ---")
-            df = pd.read_excel(xls, sheet_name=sheet_name, header=None)
-            
-            header_row_index = -1
-            for i, row in df.head(10).iterrows():
-                row_str = ' '.join(map(str, row.values)).lower()
-                if 'fecha' in row_str and ('concepto' in row_str or 'descripcion' in row_str) and 'importe' in row_str:
-                    header_row_index = i
-                    logging.info(f"Fila de cabecera detectada en la fila {i+1}.")
-                    break
-            
-            df = pd.read_excel(xls, sheet_name=sheet_name, header=header_row_index if header_row_index != -1 else 0)
-            logging.info(f"Leídas {len(df)} filas de datos de la hoja.")
-            hojas_procesadas += 1
-
-            df.columns = df.columns.str.lower().str.normalize('NFKD').str.encode('ascii', errors='ignore').str.decode('utf-8')
-            logging.info(f"Columnas normalizadas: {df.columns.tolist()}")
-
-            # --- Lógica de identificación de columnas mejorada ---
-            cols = df.columns
-            def encontrar_columna(patterns):
-                # Prioridad 1: Coincidencia exacta
-                for p in patterns:
-                    if p in cols:
-                        return p
-                # Prioridad 2: Coincidencia de subcadena
-                for p in patterns:
-                    match = next((c for c in cols if p in c), None)
-                    if match:
-                        return match
-                return None
-
-            col_fecha = encontrar_columna(['fecha'])
-            col_concepto = encontrar_columna(['concepto', 'descripcion'])
-            col_importe = encontrar_columna(['importe', 'cantidad'])
-            col_saldo = encontrar_columna(['saldo posterior', 'saldo'])
-
-            if not all([col_fecha, col_concepto, col_importe, col_saldo]):
-                logging.warning("No se pudieron identificar todas las columnas por nombre. Usando fallback a orden posicional.")
-                if len(df.columns) >= 4:
-                    col_fecha, col_concepto, col_importe, col_saldo = df.columns[0], df.columns[1], df.columns[3], df.columns[4] # Ajustar índices si es necesario
-                else:
-                    logging.error(f"La hoja no tiene las 4 columnas mínimas requeridas (fecha, concepto, importe, saldo). Omitiendo.")
-                    continue
-            
-            logging.info(f"Columnas identificadas -> Fecha: '{col_fecha}', Concepto: '{col_concepto}', Importe: '{col_importe}'")
+def leer_excel_paralelo(archivos, max_workers=None, usar_cache=True):
+    """
+    Como leer_excel pero para uno o varios archivos, repartiendo cada hoja de cada archivo entre
+    un ProcessPoolExecutor. Las transacciones se devuelven en orden determinista (archivo y hoja
+    en el orden recibido) y stats incluye, en 'hojas', el tiempo y el resultado de cada hoja.
+    Con usar_cache, los archivos ya procesados con las mismas reglas se sirven desde la caché en disco.
+    """
+    if not isinstance(archivos, (list, tuple)):
+        archivos = [archivos]
 
-            num_transacciones_hoja = 0
-            for _, row in df.iterrows():
-                if pd.isna(row[col_concepto]) or pd.isna(row[col_importe]):
+    logging.info(f"--- Iniciando la importación en paralelo de {len(archivos)} archivo(s) ---")
+    inicio = time.perf_counter()
+    temporales = []
+    tareas = []
+    errores = []
+    # Por cada archivo legible: [nombre, clave de caché, transacciones, hojas]
+    leidos = []
+    try:
+        for archivo in archivos:
+            nombre = getattr(archivo, 'name', None) or os.path.basename(os.fspath(archivo))
+            try:
+                ruta = _ruta_en_disco(archivo, temporales)
+                clave = cache_importacion.clave_archivo(ruta) if usar_cache else None
+                en_cache = cache_importacion.obtener(clave) if usar_cache else None
+                if en_cache is not None:
+                    logging.info(f"Archivo '{nombre}' servido desde la caché de importaciones.")
+                    leidos.append([nombre, None, *en_cache])
                     continue
+                libro = _abrir_libro(ruta)
+                sheet_names = libro.sheetnames
+                libro.close()
+                logging.info(f"Archivo '{nombre}' abierto. Hojas encontradas: {sheet_names}")
+            except Exception as e:
+                logging.error(f"Error fatal al abrir o leer el archivo Excel '{nombre}': {e}")
+                errores.append(f"{nombre}: {e}")
+                continue
+            leidos.append([nombre, clave, [], []])
+            tareas.extend((len(leidos) - 1, ruta, sheet_name) for sheet_name in sheet_names)
 
-                fecha = pd.to_datetime(row[col_fecha], errors='coerce', dayfirst=True).date()
-                if not fecha:
-                    continue
-                
-                concepto = str(row[col_concepto])
-                
-                try:
-                    # Usar locale para convertir el string a float
-                    importe = locale.atof(str(row[col_importe]))
-                except (ValueError, TypeError):
-                    # Fallback si atof falla o el locale no estaba disponible
-                    try:
-                        importe_str = str(row[col_importe]).replace('.', '').replace(',', '.')
-                        importe = float(importe_str)
-                    except (ValueError, TypeError):
-                        continue
-
-                try:
-                    saldo_posterior = locale.atof(str(row[col_saldo]))
-                except (ValueError, TypeError, KeyError):
-                    # Si la columna de saldo no existe o el valor es inválido, lo dejamos como nulo
-                    saldo_posterior = None
-
-
-                tipo = 'INGRESO' if importe > 0 else 'GASTO'
-                categoria = categorizer.clasificar_transaccion(concepto, importe)
-
-                transacciones.append({
-                    'fecha': fecha,
-                    'concepto': concepto,
-                    'importe': importe,
-                    'categoria': categoria,
-                    'tipo': tipo,
-                    'mes': fecha.month,
-                    'año': fecha.year,
-                    'notas': '',
-                    'saldo_posterior': saldo_posterior
-                })
-                num_transacciones_hoja += 1
-            
-            logging.info(f"Encontradas {num_transacciones_hoja} transacciones válidas en la hoja.")
-
-        except Exception as e:
-            logging.error(f"Error procesando la hoja '{sheet_name}': {e}", exc_info=True)
-            continue
+        # Con una sola hoja no compensa arrancar procesos
+        if len(tareas) <= 1:
+            resultados = [_procesar_hoja_en_proceso(ruta, hoja) for _, ruta, hoja in tareas]
+        else:
+            workers = min(len(tareas), max_workers or os.cpu_count() or 1)
+            # Se llama también desde el hilo del importador en segundo plano: con fork el hijo podría
+            # heredar bloqueos tomados por otros hilos, así que los procesos se arrancan con spawn
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as executor:
+                futuros = [executor.submit(_procesar_hoja_en_proceso, ruta, hoja) for _, ruta, hoja in tareas]
+                resultados = [futuro.result() for futuro in futuros]
+    finally:
+        for ruta in temporales:
+            os.remove(ruta)
+
+    nuevas = []
+    for (posicion, _, hoja), (transacciones_hoja, segundos, error) in zip(tareas, resultados):
+        nombre, _, transacciones_archivo, hojas_archivo = leidos[posicion]
+        transacciones_archivo.extend(transacciones_hoja)
+        nuevas.extend(transacciones_hoja)
+        detalle = {"archivo": nombre, "hoja": hoja, "transacciones": len(transacciones_hoja), "segundos": round(segundos, 3)}
+        if error:
+            detalle["error"] = error
+        hojas_archivo.append(detalle)
+
+    # Solo se clasifica lo que no venía de la caché; después se guarda cada archivo leído sin errores
+    _clasificar(nuevas)
+    for nombre, clave, transacciones_archivo, hojas_archivo in leidos:
+        if clave and not any("error" in h for h in hojas_archivo):
+            cache_importacion.guardar(clave, transacciones_archivo, hojas_archivo)
+
+    transacciones = [t for _, _, transacciones_archivo, _ in leidos for t in transacciones_archivo]
+    hojas = [h for _, _, _, hojas_archivo in leidos for h in hojas_archivo]
 
     stats = {
-        "total_sheets_processed": hojas_procesadas,
-        "total_transactions_found": len(transacciones)
+        "total_files_processed": len(leidos),
+        "files_from_cache": sum(1 for _, clave, _, _ in leidos if clave is None and usar_cache),
+        "total_sheets_processed": sum(1 for h in hojas if "error" not in h),
+        "total_transactions_found": len(transacciones),
+        "hojas": hojas,
+        "segundos": round(time.perf_counter() - inicio, 3)
     }
-    logging.info(f"--- Proceso de importación finalizado. {stats['total_sheets_processed']} hojas procesadas, {stats['total_transactions_found']} transacciones encontradas. ---")
-    
+    if errores:
+        stats["archivos_con_error"] = errores
+        if len(errores) == len(archivos):
+            stats["error"] = "; ".join(errores)
+    logging.info(f"--- Importación en paralelo finalizada. {stats['total_sheets_processed']} hojas procesadas, {stats['total_transactions_found']} transacciones encontradas en {stats['segundos']} s. ---")
+
     return transacciones, stats
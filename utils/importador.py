@@ -0,0 +1,167 @@
+# utils/importador.py - Importaciones de Excel en segundo plano
+
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from database import db_manager
+from . import excel_reader
+
+# Directorio donde se guardan los archivos subidos mientras su importación no termina
+SUBIDAS_DIR = Path(__file__).parent.parent / 'cache' / 'subidas'
+
+# Transacciones que se insertan (y se confirman junto con el progreso) en cada paso del trabajo
+TAMAÑO_BLOQUE_IMPORTACION = 1000
+
+# Un único hilo: SQLite admite un solo escritor, así que los trabajos se ejecutan de uno en uno, en orden
+MAX_TRABAJOS_SIMULTANEOS = 1
+
+# Estados en los que un trabajo aún no ha terminado y debe (re)lanzarse
+ESTADOS_ACTIVOS = ('pendiente', 'leyendo', 'importando')
+
+_executor = ThreadPoolExecutor(max_workers=MAX_TRABAJOS_SIMULTANEOS, thread_name_prefix='importacion')
+_en_cola = set()  # IDs de trabajos ya enviados al executor en este proceso
+_en_cola_lock = threading.Lock()
+
+def lanzar_importacion(archivos, omitir_duplicados=True):
+    """
+    Guarda en disco los archivos subidos, registra el trabajo de importación y lo pone en cola.
+    Retorna el ID del trabajo, o None si no se pudo registrar.
+    """
+    SUBIDAS_DIR.mkdir(parents=True, exist_ok=True)
+    prefijo = db_manager.generar_uuid()
+    rutas, nombres = [], []
+    for indice, archivo in enumerate(archivos):
+        if isinstance(archivo, (str, os.PathLike)):
+            rutas.append(os.fspath(archivo))
+            nombres.append(os.path.basename(os.fspath(archivo)))
+            continue
+        ruta = SUBIDAS_DIR / f"{prefijo}_{indice}.xlsx"
+        ruta.write_bytes(archivo.getvalue() if hasattr(archivo, 'getvalue') else archivo.read())
+        rutas.append(str(ruta))
+        nombres.append(getattr(archivo, 'name', ruta.name))
+
+    id_trabajo = db_manager.crear_trabajo_importacion(rutas, nombres, omitir_duplicados)
+    if id_trabajo:
+        _encolar(id_trabajo)
+    return id_trabajo
+
+def reanudar(id_trabajo):
+    """Vuelve a poner en cola un trabajo que terminó con error; continúa desde el último bloque confirmado."""
+    db_manager.actualizar_trabajo_importacion(id_trabajo, estado='pendiente', mensaje_error=None)
+    _encolar(id_trabajo)
+
+def reanudar_pendientes():
+    """Relanza los trabajos que quedaron sin terminar (p. ej. por un reinicio de la aplicación)."""
+    pendientes = db_manager.obtener_trabajos_importacion(estados=ESTADOS_ACTIVOS)
+    # Los más antiguos primero, para respetar el orden en que se pidieron
+    for trabajo in reversed(pendientes):
+        _encolar(trabajo['id'])
+    return len(pendientes)
+
+def _encolar(id_trabajo):
+    with _en_cola_lock:
+        if id_trabajo in _en_cola:
+            return
+        _en_cola.add(id_trabajo)
+    _executor.submit(_ejecutar, id_trabajo)
+
+def _ejecutar(id_trabajo):
+    """
+    Ejecuta un trabajo: lectura y clasificación del Excel, detección de duplicados e inserción por
+    bloques. Cada bloque se confirma en la misma transacción que el contador de progreso, de modo
+    que al reanudar se continúa justo después del último bloque insertado, sin repetir ninguno.
+    """
+    try:
+        trabajo = db_manager.obtener_trabajo_importacion(id_trabajo)
+        if trabajo is None or trabajo['estado'] not in ESTADOS_ACTIVOS:
+            return
+        logging.info(f"--- Trabajo de importación {id_trabajo}: {trabajo['nombres']} ---")
+
+        db_manager.actualizar_trabajo_importacion(id_trabajo, estado='leyendo')
+        # La lectura se repite al reanudar; con la caché de importaciones es inmediata
+        transacciones, stats = excel_reader.leer_excel_paralelo(trabajo['archivos'])
+        if 'error' in stats:
+            raise ValueError(stats['error'])
+
+        # Los duplicados se deciden una sola vez, frente a lo que había antes de empezar a importar
+        duplicados = trabajo['duplicados']
+        if duplicados is None:
+            duplicados = []
+            if trabajo['omitir_duplicados']:
+                _, repetidas = db_manager.separar_duplicados(transacciones)
+                repetidas = {id(t) for t in repetidas}
+                duplicados = [i for i, t in enumerate(transacciones) if id(t) in repetidas]
+            db_manager.actualizar_trabajo_importacion(id_trabajo, duplicados=duplicados, ignoradas=len(duplicados))
+
+        omitidas = set(duplicados)
+        a_importar = [t for i, t in enumerate(transacciones) if i not in omitidas]
+        if trabajo['omitir_duplicados']:
+            # Las huellas se numeran sobre todo el extracto: dos movimientos idénticos en bloques
+            # distintos no deben recibir la misma. Al reanudar se obtienen exactamente las mismas.
+            db_manager.asignar_huellas(a_importar)
+        procesadas = trabajo['procesadas']
+        db_manager.actualizar_trabajo_importacion(
+            id_trabajo, estado='importando', total=len(a_importar),
+            inicio_ejecucion=time.time(), procesadas_al_iniciar=procesadas
+        )
+
+        for inicio in range(procesadas, len(a_importar), TAMAÑO_BLOQUE_IMPORTACION):
+            bloque = a_importar[inicio:inicio + TAMAÑO_BLOQUE_IMPORTACION]
+            with db_manager.conexion() as conn:
+                if not conn.in_transaction:
+                    conn.execute("BEGIN")
+                if trabajo['omitir_duplicados']:
+                    insertadas, ignoradas, errores = db_manager.insertar_transacciones_nuevas(bloque)
+                    if any(indice is None for indice, _ in errores):
+                        # Fallo de la base de datos: se deshace el bloque y el trabajo queda para reanudar
+                        raise RuntimeError(errores[-1][1])
+                else:
+                    ids, errores = db_manager.insertar_transacciones_lote(bloque)
+                    insertadas, ignoradas = len(ids) - len(errores), 0
+                db_manager.actualizar_trabajo_importacion(
+                    id_trabajo, procesadas_mas=len(bloque), insertadas_mas=insertadas,
+                    ignoradas_mas=ignoradas, errores_mas=len(errores)
+                )
+
+        db_manager.actualizar_trabajo_importacion(id_trabajo, estado='completado')
+        _borrar_subidas(trabajo['archivos'])
+        logging.info(f"--- Trabajo de importación {id_trabajo} completado ---")
+    except Exception as e:
+        logging.error(f"Error en el trabajo de importación {id_trabajo}: {e}", exc_info=True)
+        db_manager.actualizar_trabajo_importacion(id_trabajo, estado='error', mensaje_error=str(e))
+    finally:
+        with _en_cola_lock:
+            _en_cola.discard(id_trabajo)
+
+def _borrar_subidas(rutas):
+    """Borra las copias de los archivos subidos (nunca archivos fuera de SUBIDAS_DIR)."""
+    for ruta in rutas:
+        ruta = Path(ruta)
+        if ruta.parent == SUBIDAS_DIR:
+            ruta.unlink(missing_ok=True)
+
+def progreso(trabajo):
+    """
+    Calcula el avance de un trabajo: fracción completada, velocidad de inserción (filas/s) en la
+    ejecución actual y tiempo restante estimado en segundos (None mientras no se pueda estimar).
+    """
+    total, procesadas = trabajo['total'], trabajo['procesadas']
+    if trabajo['estado'] == 'completado':
+        fraccion = 1.0
+    else:
+        fraccion = procesadas / total if total else 0.0
+
+    filas_por_segundo = None
+    eta_segundos = None
+    if trabajo['estado'] == 'importando' and trabajo['inicio_ejecucion']:
+        transcurrido = time.time() - trabajo['inicio_ejecucion']
+        hechas = procesadas - trabajo['procesadas_al_iniciar']
+        if transcurrido > 0 and hechas > 0:
+            filas_por_segundo = hechas / transcurrido
+            eta_segundos = (total - procesadas) / filas_por_segundo
+
+    return {"fraccion": fraccion, "filas_por_segundo": filas_por_segundo, "eta_segundos": eta_segundos}
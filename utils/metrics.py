@@ -3,20 +3,93 @@
 
 from database import db_manager
 import pandas as pd
+import copy
+import functools
+import threading
 from datetime import datetime, timedelta
 
-def calcular_totales_mes(mes, año):
+# Resultados ya calculados para la versión de datos actual: (función, args, kwargs) -> resultado
+_cache = {}
+_cache_version = None
+_cache_lock = threading.Lock()
+
+def _memorizar(funcion):
     """
-    Calcula los totales de ingresos, gastos y el balance para un mes y año específicos.
+    Cachea el resultado de una métrica por argumentos y versión de los datos (db_manager.version_datos()),
+    de modo que repetirla sin escrituras de por medio (también entre reruns) es una consulta a un dict.
+    Cualquier escritura cambia la versión y vacía la caché entera.
+    Devuelve copias, porque los gráficos añaden columnas a los DataFrames que reciben.
+    """
+    @functools.wraps(funcion)
+    def envoltura(*args, **kwargs):
+        global _cache_version
+        version = db_manager.version_datos()
+        clave = (funcion.__name__, args, tuple(sorted(kwargs.items())))
+        with _cache_lock:
+            if _cache_version != version:
+                _cache.clear()
+                _cache_version = version
+            elif clave in _cache:
+                return copy.deepcopy(_cache[clave])
+
+        resultado = funcion(*args, **kwargs)
+        with _cache_lock:
+            # Si hubo una escritura mientras se calculaba, el resultado ya no corresponde a ninguna versión
+            if _cache_version == version == db_manager.version_datos():
+                _cache[clave] = resultado
+        return copy.deepcopy(resultado)
+    return envoltura
+
+def limpiar_cache():
+    """Descarta todas las métricas cacheadas."""
+    with _cache_lock:
+        _cache.clear()
+
+def _filtros_periodo(mes=None, año=None):
+    """Filtros de consultar_agregados para un mes y/o año (los valores vacíos no filtran)."""
+    filtros = []
+    if mes:
+        filtros.append(('mes', '=', mes))
+    if año:
+        filtros.append(('año', '=', año))
+    return filtros
+
+# Columnas del panel mensual devuelto por calcular_panel
+COLUMNAS_PANEL = ['periodo', 'tipo', 'categoria', 'total', 'n', 'dias_con_gasto']
+
+@_memorizar
+def calcular_panel(desde=None, hasta=None):
+    """
+    Calcula el panel de métricas mensuales entre dos periodos (tuplas (año, mes), incluidos; None no acota).
+    Es un DataFrame en formato largo con una fila por (periodo, tipo, categoria): total, n (número de
+    transacciones) y dias_con_gasto (días distintos con algún gasto en el periodo, repetido en todas sus filas).
+    Sale de una única consulta agrupada; las demás métricas por mes o año se obtienen filtrándolo.
+    """
+    filas = db_manager.obtener_panel_mensual(desde, hasta)
+    df = pd.DataFrame(filas, columns=['año', 'mes', 'tipo', 'categoria', 'total', 'n', 'dias_con_gasto'])
+    # object para conservar None como "sin categoría" (pandas convertiría las cadenas a str con NaN)
+    df['categoria'] = pd.Series([f['categoria'] for f in filas], dtype=object)
+    df['periodo'] = pd.to_datetime(pd.DataFrame({'year': df['año'], 'month': df['mes'], 'day': 1})).dt.to_period('M')
+    return df[COLUMNAS_PANEL].astype({'total': 'float64', 'n': 'int64', 'dias_con_gasto': 'int64'})
+
+def _panel_de_mes(mes, año):
+    return calcular_panel((año, mes), (año, mes))
+
+def _totales_de_panel(panel, incluir_sin_categoria=True):
+    """
+    Totales de ingresos, gastos, balance y gastos por categoría de un trozo del panel.
+    Los gastos sin categoría aparecen con la clave None salvo con incluir_sin_categoria=False.
     """
-    transacciones = db_manager.obtener_transacciones(mes=mes, año=año)
-    
-    total_ingresos = sum(t['importe'] for t in transacciones if t['tipo'] == 'INGRESO')
-    total_gastos = sum(t['importe'] for t in transacciones if t['tipo'] == 'GASTO')
+    gastos = panel[panel['tipo'] == 'GASTO']
+    total_ingresos = float(panel.loc[panel['tipo'] == 'INGRESO', 'total'].sum())
+    total_gastos = float(gastos['total'].sum())
     balance_neto = total_ingresos + total_gastos # Gastos ya son negativos
-    
-    # Obtener gastos por categoría
-    gastos_por_categoria = db_manager.obtener_totales_por_categoria(mes, año)
+
+    gastos_por_categoria = {}
+    for categoria, total in zip(gastos['categoria'], gastos['total']):
+        if categoria is None and not incluir_sin_categoria:
+            continue
+        gastos_por_categoria[categoria] = gastos_por_categoria.get(categoria, 0) + float(total)
 
     return {
         "total_ingresos": total_ingresos,
@@ -25,70 +98,98 @@ def calcular_totales_mes(mes, año):
         "gastos_por_categoria": gastos_por_categoria
     }
 
+@_memorizar
+def calcular_totales_mes(mes, año):
+    """
+    Calcula los totales de ingresos, gastos y el balance para un mes y año específicos.
+    """
+    return _totales_de_panel(_panel_de_mes(mes, año))
+
+@_memorizar
 def calcular_totales_anual(año):
     """
     Calcula los totales de ingresos, gastos y el balance para un año específico.
     También devuelve datos mensuales para gráficos de evolución.
     """
-    transacciones = db_manager.obtener_transacciones(año=año)
-    if not transacciones:
+    panel = calcular_panel((año, 1), (año, 12))
+    if panel.empty:
         return None
 
-    df = pd.DataFrame(transacciones)
-    df['fecha'] = pd.to_datetime(df['fecha'])
-
-    total_ingresos = df[df['tipo'] == 'INGRESO']['importe'].sum()
-    total_gastos = df[df['tipo'] == 'GASTO']['importe'].sum()
-    balance_neto = total_ingresos + total_gastos
+    # Como siempre en el resumen anual, los gastos sin categoría no tienen entrada propia
+    totales = _totales_de_panel(panel, incluir_sin_categoria=False)
 
-    gastos_por_categoria = df[df['tipo'] == 'GASTO'].groupby('categoria')['importe'].sum().to_dict()
-
-    evolucion_mensual = df.groupby(df['fecha'].dt.month).agg(
-        ingresos=('importe', lambda x: x[x > 0].sum()),
-        gastos=('importe', lambda x: x[x < 0].sum())
-    ).reindex(range(1, 13), fill_value=0)
+    evolucion_mensual = panel.pivot_table(index=panel['periodo'].dt.month, columns='tipo', values='total', aggfunc='sum')
+    evolucion_mensual = pd.DataFrame({
+        'ingresos': evolucion_mensual.get('INGRESO', 0.0),
+        'gastos': evolucion_mensual.get('GASTO', 0.0)
+    }, index=evolucion_mensual.index).reindex(range(1, 13), fill_value=0).fillna(0)
+    evolucion_mensual.index.name = 'mes'
     evolucion_mensual['balance'] = evolucion_mensual['ingresos'] + evolucion_mensual['gastos']
 
-    return {
-        "total_ingresos": total_ingresos, "total_gastos": total_gastos, "balance_neto": balance_neto,
-        "gastos_por_categoria": gastos_por_categoria, "evolucion_mensual": evolucion_mensual
-    }
+    return {**totales, "evolucion_mensual": evolucion_mensual}
 
+@_memorizar
 def calcular_evolucion_mensual():
     """
-    Calcula la evolución de ingresos, gastos y balance de los últimos 12 meses.
+    Calcula la evolución de ingresos, gastos y balance de los últimos 12 meses: las transacciones de
+    los 365 días anteriores a la última, agrupadas por mes. El primer mes es parcial: solo cuenta
+    desde el día del corte.
     """
-    # Obtener todas las transacciones de la base de datos
-    transacciones = db_manager.obtener_transacciones()
-    if not transacciones:
+    ultima = db_manager.consultar_agregados(agregados={'ultima': ('maximo', 'fecha')})
+    if not ultima or ultima[0]['ultima'] is None:
         return pd.DataFrame()
 
-    df = pd.DataFrame(transacciones)
-    df['fecha'] = pd.to_datetime(df['fecha'])
-    
-    # Asegurarse de que solo se consideran los últimos 12 meses desde la última transacción
-    fecha_max = df['fecha'].max()
-    fecha_min = fecha_max - timedelta(days=365)
-    
-    df_filtrado = df[df['fecha'] >= fecha_min]
-    
-    if df_filtrado.empty:
+    fecha_min = pd.Timestamp(ultima[0]['ultima']) - timedelta(days=365)
+    primer_mes = fecha_min.to_period('M')
+    mes_siguiente = primer_mes + 1
+
+    # Los meses completos posteriores al del corte salen de resumen_mensual
+    # (una fila por mes, tipo y categoría)
+    filas = db_manager.obtener_resumen_mensual(desde=(mes_siguiente.year, mes_siguiente.month))
+
+    # Del mes del corte solo cuentan las transacciones desde fecha_min
+    desde = fecha_min.strftime('%Y-%m-%d') if fecha_min == fecha_min.normalize() else fecha_min.strftime('%Y-%m-%d %H:%M:%S')
+    parcial = db_manager.consultar_agregados(
+        columnas=['tipo'], agregados={'total': ('suma', 'importe')},
+        filtros=[('fecha', '>=', desde), ('fecha', '<', mes_siguiente.start_time.strftime('%Y-%m-%d'))],
+        agrupar_por=['tipo']
+    )
+    filas += [{'año': primer_mes.year, 'mes': primer_mes.month, 'tipo': f['tipo'], 'total': f['total']} for f in parcial]
+    if not filas:
         return pd.DataFrame()
 
-    # Agrupar por año y mes
-    df_agrupado = df_filtrado.groupby([df_filtrado['fecha'].dt.year.rename('año'), df_filtrado['fecha'].dt.month.rename('mes')]).apply(lambda x: pd.Series({
-        'ingresos': x[x['tipo'] == 'INGRESO']['importe'].sum(),
-        'gastos': x[x['tipo'] == 'GASTO']['importe'].sum()
-    })).reset_index()
-
-    df_agrupado['balance'] = df_agrupado['ingresos'] + df_agrupado['gastos']
-    
-    # Crear una columna de período para ordenar
-    df_agrupado['periodo'] = pd.to_datetime(df_agrupado['año'].astype(str) + '-' + df_agrupado['mes'].astype(str) + '-01')
-    df_agrupado = df_agrupado.sort_values('periodo').reset_index(drop=True)
-
-    return df_agrupado
+    return _evolucion_de_resumen(pd.DataFrame(filas))
 
+def _evolucion_de_resumen(df):
+    """
+    Agrega filas (año, mes, tipo, total) en ingresos, gastos y balance por mes,
+    con un groupby/unstack vectorizado sobre un índice de periodos mensuales.
+    """
+    df = df[(df['año'] > 0) & df['mes'].between(1, 12)]
+    if df.empty:
+        return pd.DataFrame()
+    # Las filas del resumen son pocas (una por mes, tipo y categoría): el periodo se calcula por fila
+    periodo = pd.to_datetime(pd.DataFrame({'year': df['año'], 'month': df['mes'], 'day': 1})).dt.to_period('M')
+    por_tipo = (
+        df['total']
+        .groupby([periodo.rename('periodo'), df['tipo']])
+        .sum()
+        .unstack(fill_value=0.0)
+        .reindex(columns=['INGRESO', 'GASTO'], fill_value=0.0)
+    )
+    periodos = pd.PeriodIndex(por_tipo.index, freq='M')
+
+    evolucion = pd.DataFrame({
+        'año': periodos.year,
+        'mes': periodos.month,
+        'ingresos': por_tipo['INGRESO'].to_numpy(),
+        'gastos': por_tipo['GASTO'].to_numpy(),
+    })
+    evolucion['balance'] = evolucion['ingresos'] + evolucion['gastos']
+    evolucion['periodo'] = periodos.to_timestamp()
+    return evolucion
+
+@_memorizar
 def calcular_liquido_disponible():
     """
     Obtiene el balance total acumulado de la base de datos.
@@ -98,6 +199,7 @@ def calcular_liquido_disponible():
 
 # ========== MÉTRICAS FINANCIERAS AVANZADAS ==========
 
+@_memorizar
 def calcular_tasa_ahorro(mes, año):
     """
     Calcula el porcentaje de ingresos que se está ahorrando.
@@ -124,6 +226,7 @@ def calcular_tasa_ahorro(mes, año):
     }
 
 
+@_memorizar
 def calcular_gasto_promedio_diario(mes, año):
     """
     Calcula el gasto promedio por día del mes.
@@ -131,10 +234,10 @@ def calcular_gasto_promedio_diario(mes, año):
     Returns:
         Dict con promedio_diario, proyeccion_mes, dias_transcurridos
     """
-    transacciones = db_manager.obtener_transacciones(mes=mes, año=año)
-    gastos = [t for t in transacciones if t['tipo'] == 'GASTO']
+    panel = _panel_de_mes(mes, año)
+    gastos = panel[panel['tipo'] == 'GASTO']
 
-    if not gastos:
+    if gastos.empty:
         return {
             'promedio_diario': 0,
             'proyeccion_mes': 0,
@@ -142,12 +245,9 @@ def calcular_gasto_promedio_diario(mes, año):
             'total_gastado': 0
         }
 
-    # Calcular días transcurridos
-    df = pd.DataFrame(gastos)
-    df['fecha'] = pd.to_datetime(df['fecha'])
-
-    dias_unicos = df['fecha'].dt.day.nunique()
-    total_gastado = abs(df['importe'].sum())
+    # Días distintos con algún gasto (mismo valor en todas las filas del mes)
+    dias_unicos = int(gastos['dias_con_gasto'].iloc[0])
+    total_gastado = abs(float(gastos['total'].sum()))
 
     promedio_diario = total_gastado / dias_unicos if dias_unicos > 0 else 0
 
@@ -162,6 +262,7 @@ def calcular_gasto_promedio_diario(mes, año):
     }
 
 
+@_memorizar
 def calcular_variacion_mensual(mes, año):
     """
     Calcula la variación porcentual respecto al mes anterior.
@@ -169,13 +270,13 @@ def calcular_variacion_mensual(mes, año):
     Returns:
         Dict con variaciones por categoría y total
     """
-    # Mes actual
-    datos_actual = calcular_totales_mes(mes, año)
-
-    # Mes anterior
     mes_anterior = mes - 1 if mes > 1 else 12
     año_anterior = año if mes > 1 else año - 1
-    datos_anterior = calcular_totales_mes(mes_anterior, año_anterior)
+
+    # Los dos meses salen del mismo panel
+    panel = calcular_panel((año_anterior, mes_anterior), (año, mes))
+    datos_actual = _totales_de_panel(panel[panel['periodo'] == pd.Period(year=año, month=mes, freq='M')])
+    datos_anterior = _totales_de_panel(panel[panel['periodo'] == pd.Period(year=año_anterior, month=mes_anterior, freq='M')])
 
     # Variación total
     gastos_actual = abs(datos_actual['total_gastos'])
@@ -211,6 +312,7 @@ def calcular_variacion_mensual(mes, año):
     }
 
 
+@_memorizar
 def calcular_top_gastos(mes, año, limite=10):
     """
     Obtiene los N gastos más grandes del mes.
@@ -218,15 +320,14 @@ def calcular_top_gastos(mes, año, limite=10):
     Returns:
         List de transacciones ordenadas por importe (mayor a menor)
     """
-    transacciones = db_manager.obtener_transacciones(mes=mes, año=año)
-    gastos = [t for t in transacciones if t['tipo'] == 'GASTO']
-
-    # Ordenar por importe (de más negativo a menos negativo = mayor gasto primero)
-    gastos_ordenados = sorted(gastos, key=lambda x: x['importe'])
-
-    return gastos_ordenados[:limite]
+    # Ordenados por importe (de más negativo a menos negativo = mayor gasto primero)
+    return db_manager.consultar_agregados(
+        columnas=['*'], filtros=_filtros_periodo(mes, año) + [('tipo', '=', 'GASTO')],
+        ordenar_por=['importe', '-fecha'], limite=limite
+    )
 
 
+@_memorizar
 def calcular_proyeccion_balance(meses_futuro=3):
     """
     Proyecta el balance futuro basándose en el promedio de los últimos 3 meses.
@@ -236,18 +337,19 @@ def calcular_proyeccion_balance(meses_futuro=3):
 
     Returns:
         Dict con balance_proyectado, promedio_mensual, fecha_proyeccion
+        (lanza sqlite3.Error si no se pueden leer los saldos diarios)
     """
     # Obtener últimos 3 meses
-    transacciones = db_manager.obtener_transacciones()
-    if not transacciones:
+    # Una fila por día con movimientos (saldos_diarios), no por transacción
+    df = pd.DataFrame(db_manager.saldos_entre())
+    if df.empty:
         return {
             'balance_proyectado': 0,
             'promedio_mensual': 0,
             'confianza': 'baja'
         }
-
-    df = pd.DataFrame(transacciones)
     df['fecha'] = pd.to_datetime(df['fecha'])
+    df['importe'] = df['ingresos'] + df['gastos']
 
     # Últimos 3 meses
     fecha_max = df['fecha'].max()
@@ -289,6 +391,7 @@ def calcular_proyeccion_balance(meses_futuro=3):
     }
 
 
+@_memorizar
 def calcular_efficiency_ratios(mes, año):
     """
     Calcula ratios de eficiencia financiera.
@@ -310,6 +413,8 @@ def calcular_efficiency_ratios(mes, año):
     # Ratios por categoría
     ratios = {}
     for cat, gasto in datos['gastos_por_categoria'].items():
+        if cat is None:
+            continue # Los gastos sin categoría no tienen ratio propio
         ratio = (abs(gasto) / ingresos) * 100
         ratios[f'ratio_{cat.lower()}'] = round(ratio, 2)
 
@@ -332,6 +437,7 @@ def calcular_efficiency_ratios(mes, año):
     return ratios
 
 
+@_memorizar
 def calcular_financial_health_score(mes, año):
     """
     Calcula un score de salud financiera (0-100).
@@ -52,54 +52,30 @@ def importar_base_datos(data: Dict, modo: str = "fusionar") -> Dict:
         # (Por seguridad, no implementamos esto por ahora)
         pass
 
-    # Obtener IDs existentes para detectar duplicados
-    transacciones_existentes = db_manager.obtener_transacciones()
-    ids_existentes = {t['id'] for t in transacciones_existentes}
-
-    # Crear un conjunto de transacciones existentes por (fecha, importe, concepto)
-    # para detectar duplicados por contenido
-    transacciones_por_contenido = {
-        (t['fecha'], t['importe'], t['concepto']): t['id']
-        for t in transacciones_existentes
-    }
-
+    # Una transacción con la misma fecha, importe y concepto que otra ya registrada es la misma aunque
+    # solo una de las dos tenga saldo (la huella lo incluye): así se siguen reconociendo las bases
+    # sincronizadas antes de existir la huella. Se cargan solo las claves del rango de fechas del lote.
+    fechas = [str(t['fecha']) for t in transacciones_importar if t.get('fecha')]
+    existentes = set()
+    if fechas:
+        existentes = {
+            clave[:3] for clave in db_manager.obtener_claves_existentes(min(fechas), max(fechas), por_contenido=True)
+        }
+    a_insertar = []
     for transaccion in transacciones_importar:
-        try:
-            # Verificar si ya existe por ID
-            if transaccion['id'] in ids_existentes:
-                stats["duplicadas"] += 1
-                continue
-
-            # Verificar si existe una transacción similar (mismo fecha, importe, concepto)
-            clave_contenido = (
-                transaccion['fecha'],
-                transaccion['importe'],
-                transaccion['concepto']
-            )
-
-            if clave_contenido in transacciones_por_contenido:
-                stats["duplicadas"] += 1
-                continue
-
-            # Insertar nueva transacción
-            db_manager.insertar_transaccion(
-                id=transaccion['id'],
-                fecha=transaccion['fecha'],
-                concepto=transaccion['concepto'],
-                importe=transaccion['importe'],
-                categoria=transaccion['categoria'],
-                tipo=transaccion['tipo'],
-                mes=transaccion['mes'],
-                año=transaccion['año'],
-                notas=transaccion.get('notas', ''),
-                saldo_posterior=transaccion.get('saldo_posterior')
-            )
-
-            stats["nuevas"] += 1
-
-        except Exception as e:
-            print(f"Error al importar transacción: {e}")
-            stats["errores"] += 1
+        if (str(transaccion.get('fecha')), transaccion.get('importe'), transaccion.get('concepto')) in existentes:
+            stats["duplicadas"] += 1
+        else:
+            a_insertar.append(transaccion)
+
+    # El resto se inserta ignorando las que ya existen por id o por huella de contenido
+    insertadas, ignoradas, errores = db_manager.insertar_transacciones_nuevas(a_insertar)
+    for indice, mensaje in errores:
+        print(f"Error al importar transacción: {mensaje}")
+
+    stats["nuevas"] = insertadas
+    stats["duplicadas"] += ignoradas
+    stats["errores"] += len(errores)
 
     return stats
 
@@ -114,25 +90,27 @@ def comparar_bases_datos(data_remota: Dict) -> Dict:
     Returns:
         Dict con diferencias encontradas
     """
-    # Obtener transacciones locales
-    transacciones_locales = db_manager.obtener_transacciones()
     transacciones_remotas = data_remota.get("transacciones", [])
-
-    # Crear conjuntos de IDs
-    ids_locales = {t['id'] for t in transacciones_locales}
     ids_remotas = {t['id'] for t in transacciones_remotas}
 
+    # Recorrer las transacciones locales en bloques: solo se guardan completas las que no están en la remota
+    ids_locales = set()
+    trans_solo_local = []
+    for t in db_manager.iterar_transacciones():
+        ids_locales.add(t['id'])
+        if t['id'] not in ids_remotas:
+            trans_solo_local.append(t)
+
     # Encontrar diferencias
     solo_en_local = ids_locales - ids_remotas
     solo_en_remota = ids_remotas - ids_locales
     en_ambas = ids_locales & ids_remotas
 
     # Obtener las transacciones completas
-    trans_solo_local = [t for t in transacciones_locales if t['id'] in solo_en_local]
     trans_solo_remota = [t for t in transacciones_remotas if t['id'] in solo_en_remota]
 
     return {
-        "total_local": len(transacciones_locales),
+        "total_local": len(ids_locales),
         "total_remota": len(transacciones_remotas),
         "solo_en_local": {
             "count": len(solo_en_local),
@@ -5,6 +5,9 @@ import plotly.express as px
 import plotly.graph_objects as go
 import pandas as pd
 
+# Nombre con el que se muestran los gastos sin categoría (clave None en gastos_por_categoria)
+ETIQUETA_SIN_CATEGORIA = "Sin categoría"
+
 def grafico_distribucion_gastos(gastos_por_categoria):
     """
     Genera un gráfico de torta (pie chart) con la distribución de gastos por categoría.
@@ -14,7 +17,7 @@ def grafico_distribucion_gastos(gastos_por_categoria):
 
     # Convertir los gastos a valores positivos para el gráfico
     data = {
-        "categoria": list(gastos_por_categoria.keys()),
+        "categoria": [c if c is not None else ETIQUETA_SIN_CATEGORIA for c in gastos_por_categoria.keys()],
         "total": [-v for v in gastos_por_categoria.values()] 
     }
     df = pd.DataFrame(data)